@@ -1,4 +1,22 @@
+import frappe
 from frappe.model.document import Document
 
 class AlphaXCardTransaction(Document):
     pass
+
+
+def on_doctype_update():
+    # Sales Invoice before_submit approval check
+    frappe.db.add_index(
+        "AlphaX Card Transaction",
+        ["reference_doctype", "reference_name", "mode_of_payment", "status"],
+        index_name="reference_mop_status_index",
+    )
+    # Settlement reconciliation: exact and fuzzy lookups, per-run claims, missing-in-settlement scan
+    frappe.db.add_index("AlphaX Card Transaction", ["rrn", "terminal_id"], index_name="rrn_terminal_index")
+    frappe.db.add_index("AlphaX Card Transaction", ["terminal_id", "auth_code"], index_name="terminal_auth_code_index")
+    frappe.db.add_index("AlphaX Card Transaction", ["terminal_id", "trace_no"], index_name="terminal_trace_index")
+    frappe.db.add_index("AlphaX Card Transaction", ["settlement_reconciliation"])
+    frappe.db.add_index("AlphaX Card Transaction", ["status", "creation"], index_name="status_creation_index")
+    # Keyset-paginated export
+    frappe.db.add_index("AlphaX Card Transaction", ["creation", "name"], index_name="creation_name_index")
@@ -0,0 +1,10 @@
+import frappe
+from frappe.model.document import Document
+
+class AlphaXPayloadBlob(Document):
+    """Compressed, content-addressed payload (name = sha256 of the JSON text)."""
+
+    def get_text(self):
+        from alphax_card_terminal.payload_store import get_text
+
+        return get_text(self.name)
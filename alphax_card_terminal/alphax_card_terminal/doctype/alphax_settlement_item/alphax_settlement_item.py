@@ -0,0 +1,10 @@
+import frappe
+from frappe.model.document import Document
+
+class AlphaXSettlementItem(Document):
+    pass
+
+
+def on_doctype_update():
+    # Results of one run by outcome
+    frappe.db.add_index("AlphaX Settlement Item", ["reconciliation", "result"], index_name="reconciliation_result_index")
@@ -0,0 +1,27 @@
+import frappe
+from frappe.model.document import Document
+
+class AlphaXSettlementReconciliation(Document):
+    """One settlement report upload; processed by alphax_card_terminal.reconciliation in the background."""
+
+    def validate(self):
+        if self.column_map:
+            try:
+                if not isinstance(frappe.parse_json(self.column_map), dict):
+                    raise ValueError
+            except Exception:
+                frappe.throw("Column Map must be a JSON object of field -> report column.")
+
+    def after_insert(self):
+        from alphax_card_terminal.reconciliation import enqueue_reconciliation
+
+        enqueue_reconciliation(self.name)
+
+    def on_trash(self):
+        from alphax_card_terminal.reconciliation import _reset
+
+        _reset(self.name)
+
+
+def on_doctype_update():
+    frappe.db.add_index("AlphaX Settlement Reconciliation", ["status"])
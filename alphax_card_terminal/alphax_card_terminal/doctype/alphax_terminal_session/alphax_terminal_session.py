@@ -1,4 +1,12 @@
+import frappe
 from frappe.model.document import Document
 
 class AlphaXTerminalSession(Document):
     pass
+
+
+def on_doctype_update():
+    # Session reaper: PENDING sessions ordered by age
+    frappe.db.add_index("AlphaX Terminal Session", ["status", "started_on"], index_name="status_started_on_index")
+    # Keyset-paginated export
+    frappe.db.add_index("AlphaX Terminal Session", ["creation", "name"], index_name="creation_name_index")
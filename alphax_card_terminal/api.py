@@ -1,34 +1,59 @@
-import hmac
-import hashlib
+import time
 
 import frappe
-from frappe.utils import now_datetime
-
+from frappe.utils import cint, flt, now_datetime
+
+from alphax_card_terminal import device_pool, metrics, payload_store, presence
+
+from alphax_card_terminal.callbacks import (
+    DEFAULT_TOLERANCE_SECONDS,
+    apply_capture_result,
+    hmac_ok,
+    ingest_batch,
+    ingest_callback,
+    max_batch_size,
+)
+from alphax_card_terminal.capture_jobs import enqueue_capture, runs_in_background
 from alphax_card_terminal.drivers.base import CaptureRequest
-from alphax_card_terminal.drivers.registry import get_driver
+from alphax_card_terminal.drivers.registry import get_active_drivers, get_driver
+from alphax_card_terminal.idempotency import IdempotencyBusy, run_once
+from alphax_card_terminal.mapping import card_transaction_fieldnames, get_mapping
+from alphax_card_terminal.profiles import get_profile, get_profile_for_mop
+from alphax_card_terminal.session_events import EXPIRED, FINAL_STATUSES, SessionWaiter, notify_session_final
 
 
-def _get_settings_from_mop(mode_of_payment: str):
-    # Mode of Payment custom fields (fixtures)
-    settings_name = frappe.db.get_value("Mode of Payment", mode_of_payment, "act_terminal_settings")
-    if not settings_name:
-        return None
-    return frappe.get_doc("AlphaX Payment Terminal Settings", settings_name)
+def _get_settings(settings_name: str | None, mode_of_payment: str):
+    """Compiled terminal profile, by explicit settings name or via the Mode of Payment link."""
+    return get_profile(settings_name) if settings_name else get_profile_for_mop(mode_of_payment)
 
 
 @frappe.whitelist()
 def get_available_drivers():
-    return frappe.get_all(
-        "AlphaX Terminal Driver",
-        filters={"is_active": 1},
-        fields=["name", "driver_code", "driver_name", "description", "capabilities"],
-        order_by="driver_name asc",
-    )
+    fields = ("name", "driver_code", "driver_name", "description", "capabilities")
+    return [{k: d.get(k) for k in fields} for d in get_active_drivers()]
+
+
+@frappe.whitelist()
+def get_mqtt_publisher_stats():
+    """Connection state, in-flight count and publish latency of this worker's MQTT publishers."""
+    frappe.only_for("System Manager")
+    from alphax_card_terminal.drivers.mqtt_pool import get_pool_stats
+
+    return get_pool_stats()
+
+
+@frappe.whitelist()
+def get_http_pool_stats():
+    """Requests, errors and opened/reused keep-alive connections per driver endpoint in this worker."""
+    frappe.only_for("System Manager")
+    from alphax_card_terminal.drivers.http_pool import get_pool_stats
+
+    return get_pool_stats()
 
 
 @frappe.whitelist()
 def terminal_test_connection(settings_name: str):
-    s = frappe.get_doc("AlphaX Payment Terminal Settings", settings_name)
+    s = get_profile(settings_name)
     drv = get_driver(s)
     return drv.test_connection()
 
@@ -43,13 +68,41 @@ def create_terminal_session(
     settings_name: str | None = None,
     idempotency_key: str | None = None,
 ):
-    """Create a terminal session record (vendor-neutral correlation object)."""
-    s = frappe.get_doc("AlphaX Payment Terminal Settings", settings_name) if settings_name else _get_settings_from_mop(mode_of_payment)
+    """Create a terminal session record (vendor-neutral correlation object).
+
+    Repeating a call with the same idempotency_key returns the original session.
+    """
+    idempotency_key = idempotency_key or None
+    if idempotency_key:
+        existing = _session_by_idempotency_key(idempotency_key)
+        if existing:
+            return existing
+
+    def _create():
+        return _create_terminal_session(
+            mode_of_payment, amount, currency, reference_doctype, reference_name, settings_name, idempotency_key
+        )
+
+    try:
+        return run_once("session", idempotency_key, _create)
+    except IdempotencyBusy:
+        frappe.throw("A session with this idempotency key is already being created. Retry shortly.")
+
+
+def _session_by_idempotency_key(idempotency_key: str):
+    row = frappe.db.get_value(
+        "AlphaX Terminal Session", {"idempotency_key": idempotency_key}, ["name", "uuid"], as_dict=True
+    )
+    return {"session": row.name, "uuid": row.uuid} if row else None
+
+
+def _create_terminal_session(
+    mode_of_payment, amount, currency, reference_doctype, reference_name, settings_name, idempotency_key
+):
+    s = _get_settings(settings_name, mode_of_payment)
     if not s:
         frappe.throw("Terminal Settings not configured for this Mode of Payment.")
 
-    drv_doc = frappe.get_doc("AlphaX Terminal Driver", s.driver) if getattr(s, "driver", None) else None
-
     doc = frappe.new_doc("AlphaX Terminal Session")
     doc.uuid = frappe.generate_hash(length=32)
     doc.status = "PENDING"
@@ -57,7 +110,8 @@ def create_terminal_session(
     doc.branch = getattr(s, "branch", None)
     doc.mode_of_payment = mode_of_payment
     doc.terminal_settings = s.name
-    doc.driver = drv_doc.name if drv_doc else None
+    doc.driver = getattr(s, "driver", None) or None
+    doc.device = getattr(s, "device", None) or None
     doc.amount = amount
     doc.currency = currency or "SAR"
     doc.reference_doctype = reference_doctype
@@ -65,7 +119,21 @@ def create_terminal_session(
     doc.started_on = now_datetime()
     doc.created_by_user = frappe.session.user
     doc.idempotency_key = idempotency_key
-    doc.insert(ignore_permissions=True)
+
+    if not idempotency_key:
+        doc.insert(ignore_permissions=True)
+        return {"session": doc.name, "uuid": doc.uuid}
+
+    # Unique index on idempotency_key is the last line of defence (e.g. Redis unavailable).
+    frappe.db.savepoint("alphax_session_insert")
+    try:
+        doc.insert(ignore_permissions=True)
+    except frappe.UniqueValidationError:
+        frappe.db.rollback(save_point="alphax_session_insert")
+        existing = _session_by_idempotency_key(idempotency_key)
+        if existing:
+            return existing
+        raise
     return {"session": doc.name, "uuid": doc.uuid}
 
 
@@ -84,12 +152,110 @@ def terminal_capture_start(
 
     - If session is provided, the driver request/response will be written to the session record.
     - If session is not provided, you can call create_terminal_session() first for async flows.
+    - Repeating a call with the same idempotency_key returns the original result; concurrent
+      duplicates wait for the first call instead of triggering a second capture on the device.
     """
-    s = frappe.get_doc("AlphaX Payment Terminal Settings", settings_name) if settings_name else _get_settings_from_mop(mode_of_payment)
+    if idempotency_key and session:
+        done = frappe.db.get_value(
+            "AlphaX Terminal Session",
+            {"name": session, "idempotency_key": idempotency_key, "status": ["in", FINAL_STATUSES]},
+            ["response_payload", "response_blob"],
+            as_dict=True,
+        )
+        if done and (done.response_payload or done.response_blob):
+            return payload_store.load(done.response_payload, done.response_blob)
+
+    def _capture():
+        return _terminal_capture_start(
+            mode_of_payment, amount, currency, reference_doctype, reference_name, settings_name, session, idempotency_key
+        )
+
+    wait = _capture_wait_seconds(settings_name, mode_of_payment) if idempotency_key else 0
+    try:
+        return run_once("capture", idempotency_key, _capture, wait_seconds=wait, keep=_capture_attempted)
+    except IdempotencyBusy:
+        return {
+            "status": "PENDING",
+            "session": session,
+            "message": "A capture with this idempotency key is already in progress.",
+        }
+
+
+def _capture_attempted(res) -> bool:
+    """False for results where no device was asked to capture (busy / offline): those are not replayed."""
+    return not (isinstance(res, dict) and res.get("status") == "ERROR" and res.get("device_status"))
+
+
+def _capture_wait_seconds(settings_name: str | None, mode_of_payment: str) -> float:
+    # Duplicates wait for the first capture, bounded by the profile's timeout.
+    s = _get_settings(settings_name, mode_of_payment)
+    return flt(getattr(s, "timeout_seconds", None) or 45)
+
+
+def _queue_feedback(session: str | None, uuid: str | None, settings):
+    """on_wait callback: tell the POS its place in the device queue (realtime, to the current user)."""
+
+    def on_wait(position: int):
+        frappe.publish_realtime(
+            device_pool.QUEUE_EVENT,
+            {"session": session, "uuid": uuid, "device": settings.get("device"), "position": position},
+            user=frappe.session.user,
+        )
+
+    return on_wait
+
+
+def _terminal_capture_start(
+    mode_of_payment, amount, currency, reference_doctype, reference_name, settings_name, session, idempotency_key
+):
+    s = _get_settings(settings_name, mode_of_payment)
     if not s:
         return {"status": "ERROR", "message": "Terminal Settings not configured for this Mode of Payment."}
 
+    # Pooled profiles take the least-busy online device of the branch; others fail fast (or use a
+    # fallback profile) instead of waiting out the timeout on an offline device, then wait their
+    # turn for the device.
+    lease, position = None, 0
+    received = time.perf_counter()  # capture duration includes waiting for the device
+    session_uuid = frappe.db.get_value("AlphaX Terminal Session", session, "uuid") if session else None
+    on_wait = _queue_feedback(session, session_uuid, s)
+    if cint(s.get("use_device_pool")):
+        lease = session or idempotency_key or frappe.generate_hash(length=16)
+        routed, unavailable, position = device_pool.acquire(s, lease, on_wait)
+        device_status = device_pool.BUSY
+    else:
+        routed, unavailable = presence.route(s)
+        device_status = presence.OFFLINE
+        if routed and routed.get("device") and cint(routed.get("serialize_device_access")):
+            lease = session or idempotency_key or frappe.generate_hash(length=16)
+            routed, unavailable, position = device_pool.acquire_device(routed, lease, on_wait)
+            device_status = device_pool.BUSY
+    if not routed:
+        res = {"status": "ERROR", "device_status": device_status, "device": s.get("device"), "message": unavailable}
+        if position:
+            res["queue_position"] = position
+        if session and device_status == presence.OFFLINE:
+            apply_capture_result(frappe.get_doc("AlphaX Terminal Session", session), res, "ERROR")
+        metrics.observe(
+            "alphax_capture_duration_seconds",
+            time.perf_counter() - received,
+            driver=s.get("driver"),
+            settings=s.name,
+            status=device_status,
+        )
+        return res
+    if routed is not s:
+        s = routed
+        if session:
+            frappe.db.set_value(
+                "AlphaX Terminal Session",
+                session,
+                {"terminal_settings": s.name, "driver": s.get("driver"), "device": s.get("device")},
+            )
+
     drv = get_driver(s)
+    labels = {"driver": drv.driver_code, "settings": s.name}
+    started = time.perf_counter()
 
     req = CaptureRequest(
         mode_of_payment=mode_of_payment,
@@ -98,33 +264,54 @@ def terminal_capture_start(
         reference_doctype=reference_doctype,
         reference_name=reference_name,
         idempotency_key=idempotency_key,
+        session_uuid=session_uuid,
     )
 
-    res = drv.start_capture(req)
+    if runs_in_background(s, drv):
+        if not session:
+            created = _create_terminal_session(
+                mode_of_payment, amount, currency, reference_doctype, reference_name, s.name, idempotency_key
+            )
+            session, req.session_uuid = created["session"], created["uuid"]
+            # The session's final status releases the device (notify_session_final releases by session name).
+            device_pool.rekey(lease, session)
+        res = enqueue_capture(s, req, session)
+        metrics.observe("alphax_capture_duration_seconds", time.perf_counter() - received, status="QUEUED", **labels)
+        return res
+
+    try:
+        res = drv.start_capture(req)
+    except Exception as e:
+        device_pool.release(lease)
+        elapsed = time.perf_counter() - started
+        outcome = metrics.outcome_of_exception(e)
+        metrics.observe("alphax_driver_call_duration_seconds", elapsed, status=outcome, **labels)
+        metrics.observe("alphax_capture_duration_seconds", time.perf_counter() - received, status=outcome, **labels)
+        raise
+    driver_seconds = time.perf_counter() - started
+
+    # Standard fields (rrn, auth_code, ...) via the bank app's response mapping, without
+    # overriding what the driver returned.
+    mapped = get_mapping(s.name).apply(res)
+    for k, v in mapped.items():
+        if k != "status" and v is not None:
+            res.setdefault(k, v)
 
     if session:
         try:
-            ss = frappe.get_doc("AlphaX Terminal Session", session)
-            ss.request_payload = frappe.as_json(res.get("payload") or res.get("request") or {})
-            # For sync drivers we may already have a final response
-            if res.get("status") in ("APPROVED", "DECLINED", "ERROR", "CANCELLED"):
-                ss.status = res.get("status")
-                ss.response_payload = frappe.as_json(res)
-                ss.completed_on = now_datetime()
-            ss.save(ignore_permissions=True)
+            apply_capture_result(frappe.get_doc("AlphaX Terminal Session", session), res, mapped["status"])
         except Exception:
-            pass
-
-    return res
+            # The POS still gets the driver result; the session is left for the reaper / a callback.
+            frappe.log_error(title=f"AlphaX: could not update session {session}")
+            metrics.inc("alphax_session_update_failures_total", **labels)
 
+    if lease and not session:
+        device_pool.release(lease)  # nothing else could release it
 
-def _hmac_ok(secret: str, raw_body: bytes, signature: str | None) -> bool:
-    if not secret or not signature:
-        return False
-    dig = hmac.new(secret.encode("utf-8"), raw_body, hashlib.sha256).hexdigest()
-    # allow "sha256=<hex>" or raw hex
-    sig = signature.replace("sha256=", "").strip()
-    return hmac.compare_digest(dig, sig)
+    outcome = metrics.outcome_of_result(res, mapped["status"])
+    metrics.observe("alphax_driver_call_duration_seconds", driver_seconds, status=outcome, **labels)
+    metrics.observe("alphax_capture_duration_seconds", time.perf_counter() - received, status=outcome, **labels)
+    return res
 
 
 @frappe.whitelist(allow_guest=True)
@@ -134,92 +321,205 @@ def terminal_callback(uuid: str):
     Expected:
     - raw body is JSON
     - header X-AlphaX-Signature = sha256=<hex> (optional but recommended)
+    - headers X-AlphaX-Timestamp (unix seconds) and X-AlphaX-Nonce (optional): the signature
+      then covers "<timestamp>.<body>" and replays outside the window / of a used nonce are rejected
     The secret is taken from Terminal Settings config_json.callback_secret if present.
     """
     raw = frappe.request.get_data() or b"{}"
     headers = {k: v for k, v in (frappe.request.headers or {}).items()}
-    payload = frappe.parse_json(raw)
+    return ingest_callback(uuid, raw, headers)
 
-    # Locate session
-    ss_name = frappe.db.get_value("AlphaX Terminal Session", {"uuid": uuid}, "name")
-    if not ss_name:
-        frappe.throw("Invalid UUID", frappe.ValidationError)
-    ss = frappe.get_doc("AlphaX Terminal Session", ss_name)
 
-    # Verify signature (if configured)
-    secret = None
-    try:
-        sdoc = frappe.get_doc("AlphaX Payment Terminal Settings", ss.terminal_settings)
-        cfg = frappe.parse_json(getattr(sdoc, "config_json", None) or "{}")
-        secret = cfg.get("callback_secret")
-    except Exception:
-        secret = None
-
-    sig = headers.get("X-AlphaX-Signature") or headers.get("x-alphax-signature")
-    if secret and not _hmac_ok(secret, raw, sig):
-        frappe.throw("Invalid signature", frappe.PermissionError)
-
-    ss.response_payload = frappe.as_json(payload)
-    # Normalize status
-    status = (payload.get("status") or payload.get("result") or "PENDING").upper()
-    if status not in ("APPROVED", "DECLINED", "ERROR", "CANCELLED", "PENDING"):
-        status = "PENDING"
-    ss.status = status
-    if status in ("APPROVED", "DECLINED", "ERROR", "CANCELLED"):
-        ss.completed_on = now_datetime()
-    ss.save(ignore_permissions=True)
-
-    # Optional: create AlphaX Card Transaction record for approved/declined
-    if status in ("APPROVED", "DECLINED"):
-        _ = log_terminal_response(
-            {
-                "status": "Approved" if status == "APPROVED" else "Declined",
-                "amount": ss.amount,
-                "currency": ss.currency,
-                "reference_doctype": ss.reference_doctype,
-                "reference_name": ss.reference_name,
-                "mode_of_payment": ss.mode_of_payment,
-                "terminal_id": payload.get("terminal_id") or payload.get("tid"),
-                "merchant_id": payload.get("merchant_id") or payload.get("mid"),
-                "rrn": payload.get("rrn") or payload.get("transaction_id"),
-                "auth_code": payload.get("auth_code"),
-                "response_code": payload.get("response_code"),
-                "response_message": payload.get("message") or payload.get("response_message"),
-                "raw_response": frappe.as_json(payload),
-            },
-            session_uuid=uuid,
-        )
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def terminal_heartbeat():
+    """Agent heartbeat(s): {"device": "<device_code>"} or {"heartbeats": [{"device": ...}, ...]}.
+
+    Guests sign the body like callbacks (X-AlphaX-Signature, optional X-AlphaX-Timestamp) with
+    `alphax_heartbeat_secret` from site config. Only Redis is written; last_seen/status reach
+    AlphaX Terminal Device in the next batched flush.
+    """
+    raw = frappe.request.get_data() or b"{}"
+    if frappe.session.user == "Guest":
+        secret = frappe.conf.get("alphax_heartbeat_secret")
+        timestamp = frappe.get_request_header("X-AlphaX-Timestamp")
+        if not hmac_ok(secret, raw, frappe.get_request_header("X-AlphaX-Signature"), timestamp):
+            raise frappe.PermissionError
+        if timestamp and abs(time.time() - flt(timestamp)) > DEFAULT_TOLERANCE_SECONDS:
+            raise frappe.PermissionError
 
-    return {"ok": True, "uuid": uuid, "status": ss.status}
+    accepted = presence.record_heartbeats(presence.parse_heartbeats(frappe.parse_json(raw)))
+    return {"ok": True, "accepted": accepted, "offline_after": presence.offline_after()}
 
 
 @frappe.whitelist()
-def get_terminal_session_status(uuid: str):
-    ss_name = frappe.db.get_value("AlphaX Terminal Session", {"uuid": uuid}, "name")
-    if not ss_name:
+def get_terminal_payload(blob: str):
+    """Stored payload (request/response/raw response) by AlphaX Payload Blob name, including archived ones."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+    text = payload_store.get_text(blob)
+    if text is None:
+        frappe.throw("Payload not found", frappe.DoesNotExistError)
+    return frappe.parse_json(text)
+
+
+@frappe.whitelist(methods=["GET"])
+def export_terminal_data(
+    doctype: str,
+    format: str = "ndjson",
+    company: str | None = None,
+    branch: str | None = None,
+    terminal: str | None = None,
+    device: str | None = None,
+    status: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    include_payloads: int = 0,
+):
+    """Stream AlphaX Card Transaction / AlphaX Terminal Session rows as NDJSON or CSV.
+
+    Keyset-paginated over (creation, name); `terminal` is a Terminal Settings name. Payload
+    columns are included only with include_payloads=1 (System Manager / Accounts Manager).
+    """
+    from werkzeug.wrappers import Response
+
+    from alphax_card_terminal import export
+
+    include = bool(cint(include_payloads))
+    export.validate_request(doctype, format, include)
+    body = export.stream(
+        doctype,
+        format,
+        include,
+        company=company,
+        branch=branch,
+        terminal=terminal,
+        device=device,
+        status=status,
+        from_date=from_date,
+        to_date=to_date,
+    )
+    filename = f"{frappe.scrub(doctype)}.{format}"
+    return Response(
+        body,
+        mimetype="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        direct_passthrough=True,
+    )
+
+
+@frappe.whitelist(methods=["POST"])
+def rerun_settlement_reconciliation(name: str):
+    """Queue a settlement reconciliation again (e.g. after fixing its column map); earlier results are replaced."""
+    from alphax_card_terminal.reconciliation import RUN_DOCTYPE, enqueue_reconciliation, is_stale
+
+    doc = frappe.get_doc(RUN_DOCTYPE, name)
+    doc.check_permission("write")
+    # A run left Running by a job that died (worker killed, OOM) can be restarted once it is stale.
+    if doc.status == "Running" and not is_stale(doc.started_on):
+        frappe.throw("This reconciliation is still running.")
+    enqueue_reconciliation(doc.name)
+    return {"status": "Queued"}
+
+
+@frappe.whitelist(allow_guest=True, methods=["GET"])
+def get_terminal_metrics():
+    """Prometheus text exposition of capture, driver, callback and session-lag metrics (all workers).
+
+    Guests need `Authorization: Bearer <alphax_metrics_token>` or a remote IP listed in
+    `alphax_metrics_allowed_ips` (site config); logged-in users need System Manager.
+    """
+    from werkzeug.wrappers import Response
+
+    if not metrics.scrape_allowed():
+        raise frappe.PermissionError
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def terminal_callback_batch():
+    """Batch callback endpoint for agents replaying buffered results.
+
+    Body: {"results": [{"uuid": ..., "body": "<raw callback JSON>", "signature": "sha256=<hex>"}, ...]}
+    (a bare JSON array is accepted too). Each item is verified exactly like a
+    terminal_callback request whose body is `body`. Returns one outcome per item, in order.
+    """
+    data = frappe.parse_json(frappe.request.get_data() or b"{}")
+    items = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        frappe.throw("Expected a list of results", frappe.ValidationError)
+    if len(items) > max_batch_size():
+        frappe.throw(f"Batch too large (max {max_batch_size()} results)", frappe.ValidationError)
+
+    return {"ok": True, "results": ingest_batch(items)}
+
+
+def _session_status(uuid: str):
+    ss = frappe.db.get_value(
+        "AlphaX Terminal Session",
+        {"uuid": uuid},
+        ["name", "uuid", "status", "response_payload", "response_blob"],
+        as_dict=True,
+    )
+    if not ss:
         return {"ok": False, "message": "Not found"}
-    ss = frappe.get_doc("AlphaX Terminal Session", ss_name)
     return {
         "ok": True,
         "uuid": ss.uuid,
         "status": ss.status,
         "session": ss.name,
-        "response": frappe.parse_json(ss.response_payload or "{}"),
+        "response": payload_store.load(ss.response_payload, ss.response_blob),
     }
 
 
+@frappe.whitelist()
+def get_terminal_session_status(uuid: str):
+    return _session_status(uuid)
+
+
+# Each waiting call holds a (sync) web worker, so the wait stays short and clients re-poll.
+DEFAULT_LONGPOLL_MAX_SECONDS = 5
+
+
+@frappe.whitelist()
+def wait_for_terminal_session(uuid: str, timeout: float = DEFAULT_LONGPOLL_MAX_SECONDS):
+    """Long-poll: return as soon as the session reaches a final status, or after `timeout` seconds
+    (capped by `alphax_longpoll_max_seconds`); call again while the status is not final.
+
+    Woken by terminal_callback / log_terminal_response through Redis pub/sub. POS clients should
+    listen for realtime event `alphax_terminal_session` instead and use this only as a fallback.
+    """
+    max_timeout = flt(frappe.conf.get("alphax_longpoll_max_seconds") or DEFAULT_LONGPOLL_MAX_SECONDS)
+    timeout = min(max(flt(timeout), 0), max_timeout)
+
+    res = _session_status(uuid)
+    if not res["ok"] or res["status"] in FINAL_STATUSES or not timeout:
+        return res
+
+    with SessionWaiter(uuid) as waiter:
+        # Subscribed: re-check on a fresh snapshot so a notification sent meanwhile is not missed.
+        frappe.db.rollback()
+        res = _session_status(uuid)
+        if res["status"] in FINAL_STATUSES:
+            return res
+        waiter.wait(timeout)
+
+    frappe.db.rollback()
+    return _session_status(uuid)
+
+
 @frappe.whitelist()
 def log_terminal_response(payload: dict, session_uuid: str | None = None):
     """Log a terminal response into AlphaX Card Transaction."""
+    started = time.perf_counter()
     d = frappe.new_doc("AlphaX Card Transaction")
-    allowed = set(d.as_dict().keys())
+    allowed = card_transaction_fieldnames()
 
     for k, v in (payload or {}).items():
         if k in allowed:
             setattr(d, k, v)
 
-    # Always keep full raw JSON
-    d.raw_response = frappe.as_json(payload or {})
+    # Always keep full raw JSON (compressed, deduplicated)
+    d.raw_response = None
+    d.raw_response_blob = payload_store.put(payload)
     d.insert(ignore_permissions=True)
 
     # link session if provided
@@ -227,10 +527,15 @@ def log_terminal_response(payload: dict, session_uuid: str | None = None):
         ss_name = frappe.db.get_value("AlphaX Terminal Session", {"uuid": session_uuid}, "name")
         if ss_name:
             ss = frappe.get_doc("AlphaX Terminal Session", ss_name)
-            # If session is still pending, mark it final based on transaction status
-            if ss.status == "PENDING":
+            # If session is still pending (or expired by the reaper), mark it final based on transaction status
+            notify = ss.status in ("PENDING", EXPIRED)
+            if notify:
                 ss.status = "APPROVED" if (d.status or "").lower() == "approved" else "DECLINED"
                 ss.completed_on = now_datetime()
             ss.save(ignore_permissions=True)
+            if notify:
+                notify_session_final(ss.uuid, ss.status, ss.name, ss.created_by_user)
+                metrics.observe_session_final(ss, ss.status, ss.completed_on)
 
+    metrics.observe("alphax_log_response_duration_seconds", time.perf_counter() - started, status=d.status)
     return d.name
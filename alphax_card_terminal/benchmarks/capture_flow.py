@@ -0,0 +1,468 @@
+"""End-to-end capture-flow benchmark.
+
+Each lane is a POS thread with its own DB connection running, per transaction:
+
+    create_terminal_session -> terminal_capture_start -> (fake agent) terminal_callback
+    -> get_terminal_session_status (polled until final) -> sales_invoice_before_submit
+
+The capture is answered by the Simulator driver; a pool of fake callback
+agents signs the result (HMAC + timestamp + nonce) and delivers it through
+the same code path as the terminal_callback endpoint. Reports throughput,
+p50/p95/p99 latency and DB queries per operation.
+
+    bench --site <site> execute alphax_card_terminal.benchmarks.capture_flow.run \\
+        --kwargs "{'lanes': '1,4,8,16', 'transactions': 50, 'output': '/tmp/capture_flow.json'}"
+
+    bench --site <site> execute alphax_card_terminal.benchmarks.capture_flow.compare \\
+        --kwargs "{'baseline': '/tmp/before.json', 'current': '/tmp/after.json'}"
+
+Run it on a staging site: it creates a benchmark terminal profile and Mode of
+Payment (kept) and placeholder Sales Invoice rows, sessions and card
+transactions (deleted afterwards unless keep_data=1).
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint, flt, now_datetime
+
+SETTINGS_NAME = "AlphaX Benchmark"
+MODE_OF_PAYMENT = "AlphaX Benchmark Card"
+INVOICE_PREFIX = "ACT-BENCH-"
+
+OPERATIONS = (
+    "create_terminal_session",
+    "terminal_capture_start",
+    "terminal_callback",
+    "get_terminal_session_status",
+    "sales_invoice_before_submit",
+)
+
+
+class QueryCounter:
+    """Counts statements sent through this thread's frappe.db connection."""
+
+    def __init__(self, db):
+        self.count = 0
+        sql = db.sql
+
+        def counted(*args, **kwargs):
+            self.count += 1
+            return sql(*args, **kwargs)
+
+        db.sql = counted
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS + ("transaction",)}
+        self.queries: Dict[str, List[int]] = {op: [] for op in OPERATIONS}
+        self.errors: Dict[str, int] = {op: 0 for op in OPERATIONS + ("transaction",)}
+        self.error_samples: List[str] = []
+
+    def add(self, op: str, ms: float, queries: Optional[int] = None):
+        with self._lock:
+            self.latencies[op].append(ms)
+            if queries is not None:
+                self.queries[op].append(queries)
+
+    def fail(self, op: str, exc: BaseException):
+        with self._lock:
+            self.errors[op] += 1
+            if len(self.error_samples) < 10:
+                self.error_samples.append(f"{op}: {exc!r}")
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return round(ordered[min(rank, len(ordered) - 1)], 2)
+
+
+def _summary(latencies: List[float], queries: Optional[List[int]], errors: int) -> Dict[str, Any]:
+    out = {
+        "count": len(latencies),
+        "errors": errors,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": round(max(latencies), 2) if latencies else None,
+    }
+    if queries is not None:
+        out["queries_per_op"] = round(sum(queries) / len(queries), 2) if queries else None
+        out["max_queries"] = max(queries) if queries else None
+    return out
+
+
+class _Worker(threading.Thread):
+    """Thread with its own site context and DB connection."""
+
+    def __init__(self, site: str, sites_path: str, user: str, name: str):
+        super().__init__(name=name, daemon=True)
+        self.site = site
+        self.sites_path = sites_path
+        self.user = user
+        self.counter: Optional[QueryCounter] = None
+
+    def run(self):
+        frappe.init(site=self.site, sites_path=self.sites_path)
+        try:
+            frappe.connect()
+            frappe.set_user(self.user)
+            self.counter = QueryCounter(frappe.db)
+            self.work()
+        finally:
+            frappe.destroy()
+
+    def work(self):
+        raise NotImplementedError
+
+    def timed(self, recorder: Recorder, op: str, fn, *args, **kwargs):
+        """Run one operation like a request: call, then commit (or roll back on error)."""
+        start = time.perf_counter()
+        before = self.counter.count
+        try:
+            result = fn(*args, **kwargs)
+            queries = self.counter.count - before
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            recorder.fail(op, e)
+            raise
+        recorder.add(op, (time.perf_counter() - start) * 1000, queries)
+        return result
+
+
+class FakeAgent(_Worker):
+    """Delivers signed capture results the way an Android/bridge agent would."""
+
+    def __init__(self, jobs: "queue.Queue", recorder: Recorder, secret: str, delay_ms: float, **kw):
+        super().__init__(**kw)
+        self.jobs = jobs
+        self.recorder = recorder
+        self.secret = secret
+        self.delay_ms = delay_ms
+
+    def work(self):
+        from alphax_card_terminal.callbacks import ingest_callback
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            uuid, result = job
+            if self.delay_ms:
+                time.sleep(self.delay_ms / 1000.0)
+            raw = frappe.as_json(dict(result, uuid=uuid)).encode("utf-8")
+            timestamp = str(int(time.time()))
+            sig = hmac.new(self.secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + raw, hashlib.sha256)
+            headers = {
+                "X-AlphaX-Signature": "sha256=" + sig.hexdigest(),
+                "X-AlphaX-Timestamp": timestamp,
+                "X-AlphaX-Nonce": frappe.generate_hash(length=16),
+            }
+            try:
+                self.timed(self.recorder, "terminal_callback", ingest_callback, uuid, raw, headers)
+            except Exception:
+                pass
+
+
+class Lane(_Worker):
+    def __init__(
+        self,
+        lane: int,
+        invoices: List[str],
+        jobs: "queue.Queue",
+        recorder: Recorder,
+        poll_interval: float,
+        poll_timeout: float,
+        **kw,
+    ):
+        super().__init__(**kw)
+        self.lane = lane
+        self.invoices = invoices
+        self.jobs = jobs
+        self.recorder = recorder
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.completed = 0
+
+    def work(self):
+        for invoice in self.invoices:
+            start = time.perf_counter()
+            try:
+                self.transaction(invoice)
+            except Exception as e:
+                self.recorder.fail("transaction", e)
+                continue
+            self.recorder.add("transaction", (time.perf_counter() - start) * 1000)
+            self.completed += 1
+
+    def transaction(self, invoice: str):
+        from alphax_card_terminal import api
+        from alphax_card_terminal.events.sales_invoice_before_submit import sales_invoice_before_submit
+
+        amount = round(random.uniform(1, 500), 2)
+        if f"{amount:.2f}".endswith(".99"):
+            amount = round(amount + 0.01, 2)  # the simulator declines *.99
+
+        rec = self.recorder
+        session = self.timed(
+            rec,
+            "create_terminal_session",
+            api.create_terminal_session,
+            MODE_OF_PAYMENT,
+            amount,
+            reference_doctype="Sales Invoice",
+            reference_name=invoice,
+            idempotency_key=f"{invoice}-session",
+        )
+        result = self.timed(
+            rec,
+            "terminal_capture_start",
+            api.terminal_capture_start,
+            MODE_OF_PAYMENT,
+            amount,
+            reference_doctype="Sales Invoice",
+            reference_name=invoice,
+        )
+        self.jobs.put((session["uuid"], result))
+
+        deadline = time.monotonic() + self.poll_timeout
+        while True:
+            status = self.timed(rec, "get_terminal_session_status", api.get_terminal_session_status, session["uuid"])
+            if status.get("status") != "PENDING":
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Session {session['uuid']} still PENDING")
+            time.sleep(self.poll_interval)
+
+        invoice_doc = frappe._dict(
+            doctype="Sales Invoice",
+            name=invoice,
+            payments=[frappe._dict(mode_of_payment=MODE_OF_PAYMENT, amount=amount)],
+        )
+        self.timed(rec, "sales_invoice_before_submit", sales_invoice_before_submit, invoice_doc)
+
+
+def setup() -> str:
+    """Create (or reuse) the benchmark profile and Mode of Payment; returns the callback secret."""
+    if not frappe.db.exists("AlphaX Terminal Driver", "simulator"):
+        frappe.throw("Driver 'simulator' not found. Run bench migrate to sync fixtures.")
+
+    if frappe.db.exists("AlphaX Payment Terminal Settings", SETTINGS_NAME):
+        s = frappe.get_doc("AlphaX Payment Terminal Settings", SETTINGS_NAME)
+        secret = (frappe.parse_json(s.config_json or "{}") or {}).get("callback_secret")
+    else:
+        secret = None
+        s = frappe.new_doc("AlphaX Payment Terminal Settings")
+        s.settings_name = SETTINGS_NAME
+    if not secret:
+        secret = frappe.generate_hash(length=32)
+    s.enabled = 1
+    s.driver = "simulator"
+    s.terminal_id = "BENCH0001"
+    s.merchant_id = "BENCH"
+    s.config_json = json.dumps({"callback_secret": secret, "require_callback_timestamp": 1})
+    s.save(ignore_permissions=True)
+
+    if frappe.db.exists("Mode of Payment", MODE_OF_PAYMENT):
+        mop = frappe.get_doc("Mode of Payment", MODE_OF_PAYMENT)
+    else:
+        mop = frappe.new_doc("Mode of Payment")
+        mop.mode_of_payment = MODE_OF_PAYMENT
+        mop.type = "Bank"
+    mop.enabled = 1
+    mop.act_capture_terminal_data = 1
+    mop.act_require_terminal_approval = 1
+    mop.act_terminal_settings = SETTINGS_NAME
+    mop.save(ignore_permissions=True)
+
+    frappe.db.commit()
+    return secret
+
+
+def _create_invoices(run_id: str, lanes: int, transactions: int) -> List[List[str]]:
+    """Placeholder draft Sales Invoice rows (name only) so sessions can link to them."""
+    names = [[f"{INVOICE_PREFIX}{run_id}-{lane}-{i}" for i in range(transactions)] for lane in range(lanes)]
+    now = now_datetime()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "Sales Invoice",
+        ["name", "creation", "modified", "owner", "modified_by", "docstatus"],
+        [[n, now, now, user, user, 0] for lane in names for n in lane],
+    )
+    frappe.db.commit()
+    return names
+
+
+def cleanup(run_id: Optional[str] = None):
+    """Delete benchmark sessions, card transactions and placeholder invoices (of one run, or all)."""
+    prefix = f"{INVOICE_PREFIX}{run_id}-" if run_id else INVOICE_PREFIX
+    like = {"reference_doctype": "Sales Invoice", "reference_name": ["like", f"{prefix}%"]}
+    frappe.db.delete("AlphaX Card Transaction", like)
+    frappe.db.delete("AlphaX Terminal Session", like)
+    frappe.db.delete("Sales Invoice", {"name": ["like", f"{prefix}%"]})
+    frappe.db.commit()
+
+
+def measure(
+    lanes: int,
+    transactions: int,
+    agents: Optional[int] = None,
+    callback_delay_ms: float = 0,
+    poll_interval: float = 0.05,
+    poll_timeout: float = 30,
+    user: str = "Administrator",
+    keep_data: bool = False,
+) -> Dict[str, Any]:
+    """One measurement at a fixed number of lanes."""
+    secret = setup()
+    run_id = frappe.generate_hash(length=6)
+    invoices = _create_invoices(run_id, lanes, transactions)
+    site, sites_path = frappe.local.site, frappe.local.sites_path
+    agents = cint(agents) or max(1, lanes // 2)
+
+    recorder = Recorder()
+    jobs: "queue.Queue" = queue.Queue()
+    ctx = {"site": site, "sites_path": sites_path, "user": user}
+    agent_threads = [
+        FakeAgent(jobs, recorder, secret, flt(callback_delay_ms), name=f"alphax-bench-agent-{i}", **ctx)
+        for i in range(agents)
+    ]
+    lane_threads = [
+        Lane(i, invoices[i], jobs, recorder, flt(poll_interval), flt(poll_timeout), name=f"alphax-bench-lane-{i}", **ctx)
+        for i in range(lanes)
+    ]
+
+    for t in agent_threads:
+        t.start()
+    started = time.perf_counter()
+    for t in lane_threads:
+        t.start()
+    for t in lane_threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    for _ in agent_threads:
+        jobs.put(None)
+    for t in agent_threads:
+        t.join()
+
+    if not keep_data:
+        cleanup(run_id)
+
+    completed = sum(t.completed for t in lane_threads)
+    return {
+        "run_id": run_id,
+        "lanes": lanes,
+        "agents": agents,
+        "transactions_per_lane": transactions,
+        "duration_seconds": round(elapsed, 3),
+        "transactions": {
+            "completed": completed,
+            "failed": lanes * transactions - completed,
+            "throughput_per_second": round(completed / elapsed, 2) if elapsed else None,
+        },
+        "end_to_end": _summary(recorder.latencies["transaction"], None, recorder.errors["transaction"]),
+        "operations": {
+            op: _summary(recorder.latencies[op], recorder.queries[op], recorder.errors[op]) for op in OPERATIONS
+        },
+        "error_samples": recorder.error_samples,
+    }
+
+
+def run(
+    lanes: Any = 4,
+    transactions: int = 25,
+    agents: Optional[int] = None,
+    callback_delay_ms: float = 0,
+    poll_interval: float = 0.05,
+    poll_timeout: float = 30,
+    user: str = "Administrator",
+    output: Optional[str] = None,
+    keep_data: int = 0,
+) -> Dict[str, Any]:
+    """Run the benchmark for one or more lane counts (e.g. lanes="1,4,8,16").
+
+    Returns the report; with `output` it is also written there as JSON.
+    """
+    lane_counts = [cint(x) for x in str(lanes).split(",") if cint(x) > 0]
+    report = {
+        "site": frappe.local.site,
+        "started_at": str(now_datetime()),
+        "config": {
+            "transactions_per_lane": cint(transactions),
+            "agents": agents,
+            "callback_delay_ms": flt(callback_delay_ms),
+            "poll_interval": flt(poll_interval),
+        },
+        "runs": [
+            measure(
+                n,
+                cint(transactions),
+                agents=agents,
+                callback_delay_ms=callback_delay_ms,
+                poll_interval=poll_interval,
+                poll_timeout=poll_timeout,
+                user=user,
+                keep_data=bool(cint(keep_data)),
+            )
+            for n in lane_counts
+        ],
+    }
+
+    for r in report["runs"]:
+        print(
+            f"lanes={r['lanes']:<3} tx/s={r['transactions']['throughput_per_second']} "
+            f"failed={r['transactions']['failed']} e2e p95={r['end_to_end']['p95_ms']}ms"
+        )
+        for op, s in r["operations"].items():
+            print(
+                f"    {op:<30} p50={s['p50_ms']} p95={s['p95_ms']} p99={s['p99_ms']} "
+                f"queries={s['queries_per_op']} errors={s['errors']}"
+            )
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    return report
+
+
+def compare(baseline: str, current: str, tolerance: float = 0.1) -> Dict[str, Any]:
+    """Compare two reports (JSON paths) run by run; lists p95, query-count and throughput regressions."""
+
+    def load(path):
+        with open(path) as f:
+            return {r["lanes"]: r for r in json.load(f)["runs"]}
+
+    base, cur = load(baseline), load(current)
+    tolerance = flt(tolerance)
+    regressions = []
+    for lanes in sorted(set(base) & set(cur)):
+        b, c = base[lanes], cur[lanes]
+        b_tps, c_tps = b["transactions"]["throughput_per_second"], c["transactions"]["throughput_per_second"]
+        if b_tps and c_tps is not None and c_tps < b_tps * (1 - tolerance):
+            regressions.append({"lanes": lanes, "metric": "throughput_per_second", "baseline": b_tps, "current": c_tps})
+        for op in OPERATIONS:
+            bo, co = b["operations"].get(op) or {}, c["operations"].get(op) or {}
+            if bo.get("p95_ms") and co.get("p95_ms") and co["p95_ms"] > bo["p95_ms"] * (1 + tolerance):
+                regressions.append({"lanes": lanes, "operation": op, "metric": "p95_ms", "baseline": bo["p95_ms"], "current": co["p95_ms"]})
+            if bo.get("queries_per_op") is not None and (co.get("queries_per_op") or 0) > bo["queries_per_op"]:
+                regressions.append(
+                    {"lanes": lanes, "operation": op, "metric": "queries_per_op", "baseline": bo["queries_per_op"], "current": co["queries_per_op"]}
+                )
+    for r in regressions:
+        print(r)
+    return {"ok": not regressions, "regressions": regressions}
@@ -0,0 +1,499 @@
+"""Simulated terminal fleet for load and soak tests.
+
+Emulates any number of terminals/agents for Simulator profiles in async mode
+(config_json `simulate_async: 1`). The fleet:
+
+- takes capture requests from the driver (Redis list, or MQTT topic
+  alphax/sim/request/# with `sim_transport: "mqtt"`);
+- queues them per virtual terminal (one capture at a time per device) and
+  answers after a sampled latency, with configurable decline / error /
+  timeout (no answer) rates;
+- delivers signed callbacks (HMAC over "<timestamp>.<body>", nonce) over
+  HTTP to terminal_callback, as MQTT result messages for the
+  alphax-mqtt-subscriber worker, or in-process ("direct", no web server);
+- optionally sends duplicates and stale out-of-order callbacks, keeps every
+  virtual device's heartbeat alive, and generates load itself (`rate`).
+
+    bench --site <site> execute alphax_card_terminal.benchmarks.fleet.provision --kwargs "{'terminals': 2000}"
+    bench --site <site> alphax-sim-fleet --transport http --url https://staging.example.com \\
+        --latency lognormal:800:0.5 --decline-rate 0.05 --timeout-rate 0.01 --duplicate-rate 0.02 \\
+        --rate 50 --duration 3600
+
+Only use it on staging sites: provision() creates devices and profiles named
+SIM-xxxxx / "AlphaX Sim SIM-xxxxx" and a Mode of Payment.
+"""
+from __future__ import annotations
+
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import math
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, flt
+
+from alphax_card_terminal.benchmarks.capture_flow import _percentile, _Worker
+from alphax_card_terminal.drivers.impl.simulator import FLEET_REQUEST_TOPIC, fleet_jobs_key
+
+DEVICE_PREFIX = "SIM-"
+SETTINGS_PREFIX = "AlphaX Sim "
+MODE_OF_PAYMENT = "AlphaX Simulated Card"
+TRANSPORTS = ("http", "mqtt", "direct")
+HEARTBEAT_SECONDS = 10
+REPORT_SECONDS = 10
+
+
+# -----------------------------------------------------------------------------
+# Provisioning
+# -----------------------------------------------------------------------------
+def provision(
+    terminals: int = 100,
+    company: Optional[str] = None,
+    branch: Optional[str] = None,
+    sim_transport: str = "redis",
+    mqtt_settings: Optional[str] = None,
+    timeout_seconds: int = 45,
+) -> Dict[str, Any]:
+    """Create (or update) `terminals` virtual devices with one async Simulator profile each."""
+    if not frappe.db.exists("AlphaX Terminal Driver", "simulator"):
+        frappe.throw("Driver 'simulator' not found. Run bench migrate to sync fixtures.")
+
+    secret = frappe.db.get_value(
+        "AlphaX Payment Terminal Settings", {"name": ["like", f"{SETTINGS_PREFIX}%"]}, "config_json"
+    )
+    secret = (frappe.parse_json(secret) or {}).get("callback_secret") if secret else None
+    secret = secret or frappe.generate_hash(length=32)
+    config = {
+        "simulate_async": 1,
+        "sim_transport": sim_transport,
+        "callback_secret": secret,
+        "require_callback_timestamp": 1,
+    }
+    if mqtt_settings:
+        config["mqtt_settings"] = mqtt_settings
+
+    existing = set(frappe.get_all("AlphaX Terminal Device", filters={"device_code": ["like", f"{DEVICE_PREFIX}%"]}, pluck="device_code"))
+    for i in range(1, cint(terminals) + 1):
+        code = f"{DEVICE_PREFIX}{i:05d}"
+        if code not in existing:
+            device = frappe.new_doc("AlphaX Terminal Device")
+            device.device_code = code
+            device.display_name = f"Simulated terminal {i}"
+            device.company = company
+            device.branch = branch
+            device.mqtt_settings = mqtt_settings
+            device.insert(ignore_permissions=True)
+            device_name = device.name
+        else:
+            device_name = frappe.db.get_value("AlphaX Terminal Device", {"device_code": code})
+
+        name = f"{SETTINGS_PREFIX}{code}"
+        s = (
+            frappe.get_doc("AlphaX Payment Terminal Settings", name)
+            if frappe.db.exists("AlphaX Payment Terminal Settings", name)
+            else frappe.new_doc("AlphaX Payment Terminal Settings")
+        )
+        s.settings_name = name
+        s.enabled = 1
+        s.company = company
+        s.branch = branch
+        s.driver = "simulator"
+        s.device = device_name
+        s.terminal_id = code
+        s.merchant_id = "SIMFLEET"
+        s.timeout_seconds = timeout_seconds
+        s.config_json = json.dumps(config)
+        s.save(ignore_permissions=True)
+        if i % 100 == 0:
+            frappe.db.commit()
+
+    if not frappe.db.exists("Mode of Payment", MODE_OF_PAYMENT):
+        mop = frappe.new_doc("Mode of Payment")
+        mop.mode_of_payment = MODE_OF_PAYMENT
+        mop.type = "Bank"
+        mop.insert(ignore_permissions=True)
+    frappe.db.commit()
+    return {"terminals": cint(terminals), "callback_secret": secret}
+
+
+def _fleet_profiles() -> Dict[str, Dict[str, Any]]:
+    """Simulator profile name -> {device, terminal_id, secret} for the provisioned fleet."""
+    out = {}
+    for r in frappe.get_all(
+        "AlphaX Payment Terminal Settings",
+        filters={"name": ["like", f"{SETTINGS_PREFIX}%"], "enabled": 1},
+        fields=["name", "device", "terminal_id", "config_json"],
+    ):
+        cfg = frappe.parse_json(r.config_json or "{}") or {}
+        out[r.name] = {"device": r.device, "terminal_id": r.terminal_id, "secret": cfg.get("callback_secret")}
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Behaviour
+# -----------------------------------------------------------------------------
+def parse_latency(spec: str):
+    """Sampler (seconds) for "fixed:MS", "uniform:MIN_MS:MAX_MS", "normal:MEAN_MS:SD_MS" or "lognormal:MEDIAN_MS:SIGMA"."""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: args[0] / 1000.0
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1]) / 1000.0
+    if kind == "normal":
+        return lambda: max(random.gauss(args[0], args[1]), 0) / 1000.0
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1]) / 1000.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def result_body(job: Dict[str, Any], outcome: str) -> Dict[str, Any]:
+    status = {"approved": "Approved", "declined": "Declined", "error": "Error"}.get(outcome, "Processing")
+    if outcome == "approved" and f"{flt(job.get('amount')):.2f}".endswith(".99"):
+        status = "Declined"  # same rule as the synchronous simulator
+    return {
+        "uuid": job["uuid"],
+        "status": status,
+        "amount": job.get("amount"),
+        "currency": job.get("currency"),
+        "rrn": frappe.generate_hash(length=12).upper() if status != "Processing" else None,
+        "auth_code": frappe.generate_hash(length=6).upper() if status == "Approved" else None,
+        "response_code": {"Approved": "00", "Declined": "05", "Error": "96"}.get(status),
+        "response_message": f"SIMULATED {status.upper()}",
+        "terminal_id": job.get("terminal_id"),
+        "merchant_id": job.get("merchant_id"),
+        "raw": {"simulator": True, "fleet": True},
+    }
+
+
+def sign(secret: Optional[str], raw: bytes) -> Dict[str, str]:
+    timestamp = str(int(time.time()))
+    headers = {"X-AlphaX-Timestamp": timestamp, "X-AlphaX-Nonce": frappe.generate_hash(length=16)}
+    if secret:
+        sig = hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + raw, hashlib.sha256)
+        headers["X-AlphaX-Signature"] = "sha256=" + sig.hexdigest()
+    return headers
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Counter = Counter()
+        self.callback_ms: List[float] = []
+
+    def inc(self, key: str, n: int = 1):
+        with self._lock:
+            self.counts[key] += n
+
+    def sent(self, ms: float, ok: bool):
+        with self._lock:
+            self.counts["callbacks_ok" if ok else "callbacks_failed"] += 1
+            if len(self.callback_ms) < 200000:
+                self.callback_ms.append(ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.counts)
+            ms = list(self.callback_ms)
+        out["callback_p50_ms"] = _percentile(ms, 50)
+        out["callback_p99_ms"] = _percentile(ms, 99)
+        return out
+
+
+# -----------------------------------------------------------------------------
+# Fleet
+# -----------------------------------------------------------------------------
+class Fleet:
+    def __init__(
+        self,
+        site: str,
+        sites_path: str,
+        transport: str = "direct",
+        url: Optional[str] = None,
+        mqtt_settings: Optional[str] = None,
+        result_topic: str = "alphax/result",
+        latency: str = "lognormal:1500:0.5",
+        decline_rate: float = 0.05,
+        error_rate: float = 0.01,
+        timeout_rate: float = 0.0,
+        duplicate_rate: float = 0.0,
+        out_of_order_rate: float = 0.0,
+        senders: int = 8,
+        rate: float = 0.0,
+        load_threads: int = 4,
+        heartbeats: bool = True,
+        user: str = "Administrator",
+    ):
+        if transport not in TRANSPORTS:
+            frappe.throw(f"transport must be one of {', '.join(TRANSPORTS)}")
+        if transport == "http" and not url:
+            frappe.throw("transport http needs the site's base url")
+        if transport == "mqtt" and not mqtt_settings:
+            frappe.throw("transport mqtt needs mqtt_settings")
+        self.site, self.sites_path, self.user = site, sites_path, user
+        self.transport = transport
+        self.url = (url or "").rstrip("/")
+        self.mqtt_settings = mqtt_settings
+        self.result_topic = result_topic.rstrip("/")
+        self.latency = parse_latency(latency)
+        self.rates = (decline_rate, error_rate, timeout_rate)
+        self.duplicate_rate = duplicate_rate
+        self.out_of_order_rate = out_of_order_rate
+        self.senders = senders
+        self.rate = rate
+        self.load_threads = load_threads
+        self.heartbeats = heartbeats
+
+        self.stop = threading.Event()
+        self.stats = Stats()
+        self.profiles = _fleet_profiles()
+        if not self.profiles:
+            frappe.throw("No simulated terminals. Run alphax_card_terminal.benchmarks.fleet.provision first.")
+        self._heap: List[Tuple[float, int, str, Dict[str, Any], Dict[str, Any]]] = []
+        self._heap_lock = threading.Condition()
+        self._seq = itertools.count()
+        self._busy_until: Dict[str, float] = {}
+        self._busy_lock = threading.Lock()
+        self.outbox: "queue.Queue" = queue.Queue()
+        self._mqtt = None
+
+    # --- scheduling ---
+    def _outcome(self) -> str:
+        decline, error, timeout = self.rates
+        r = random.random()
+        if r < timeout:
+            return "timeout"
+        if r < timeout + error:
+            return "error"
+        if r < timeout + error + decline:
+            return "declined"
+        return "approved"
+
+    def _schedule(self, at: float, kind: str, job: Dict[str, Any], body: Dict[str, Any]):
+        with self._heap_lock:
+            heapq.heappush(self._heap, (at, next(self._seq), kind, job, body))
+            self._heap_lock.notify()
+
+    def accept(self, job: Dict[str, Any]):
+        """A capture request reached its virtual terminal."""
+        self.stats.inc("requests")
+        profile = self.profiles.get(job.get("settings")) or {}
+        job["secret"] = profile.get("secret")
+        device = profile.get("device") or job.get("terminal_id") or job.get("settings")
+        with self._busy_lock:
+            done = max(time.time(), self._busy_until.get(device, 0.0)) + self.latency()
+            self._busy_until[device] = done
+        outcome = self._outcome()
+        self.stats.inc(f"outcome_{outcome}")
+        if outcome == "timeout":
+            return  # the device never answers; the reaper expires the session
+        body = result_body(job, outcome)
+        self._schedule(done, "result", job, body)
+        if random.random() < self.duplicate_rate:
+            self._schedule(done + random.uniform(0.05, 2.0), "duplicate", job, body)
+        if random.random() < self.out_of_order_rate:
+            # A progress message that arrives after the final result.
+            self._schedule(done + random.uniform(0.01, 0.5), "out_of_order", job, result_body(job, "processing"))
+
+    def _scheduler(self):
+        while not self.stop.is_set():
+            with self._heap_lock:
+                if not self._heap:
+                    self._heap_lock.wait(0.5)
+                    continue
+                at = self._heap[0][0]
+                delay = at - time.time()
+                if delay > 0:
+                    self._heap_lock.wait(min(delay, 0.5))
+                    continue
+                _, _, kind, job, body = heapq.heappop(self._heap)
+            self.outbox.put((kind, job, body))
+
+    # --- intake ---
+    def _redis_intake(self):
+        key = fleet_jobs_key()
+        while not self.stop.is_set():
+            try:
+                pipe = frappe.cache().pipeline(transaction=False)
+                pipe.brpop(key, timeout=1)
+                popped = pipe.execute()[0]
+            except Exception:
+                time.sleep(1)
+                continue
+            if popped:
+                self.accept(json.loads(popped[1]))
+
+    def _mqtt_client(self):
+        from alphax_card_terminal.drivers.mqtt_pool import resolve_broker
+
+        import paho.mqtt.client as mqtt  # type: ignore
+
+        broker = resolve_broker({"mqtt_settings": self.mqtt_settings})
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1) if hasattr(mqtt, "CallbackAPIVersion") else mqtt.Client()
+        if broker.get("username"):
+            client.username_pw_set(broker["username"], broker.get("password"))
+        if broker.get("use_ssl"):
+            client.tls_set()
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.on_connect = lambda c, u, f, rc, *a: c.subscribe(f"{FLEET_REQUEST_TOPIC}/#", qos=1) if rc == 0 else None
+        client.on_message = lambda c, u, msg: self.accept(json.loads(msg.payload))
+        client.connect_async(broker["host"], broker["port"], broker.get("keepalive") or 60)
+        client.loop_start()
+        return client
+
+    # --- delivery ---
+    def deliver(self, kind: str, job: Dict[str, Any], body: Dict[str, Any], http=None):
+        raw = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        headers = sign(job.get("secret"), raw)
+        started = time.perf_counter()
+        ok = False
+        try:
+            if self.transport == "http":
+                r = http.post(
+                    f"{self.url}/api/method/alphax_card_terminal.api.terminal_callback",
+                    params={"uuid": job["uuid"]},
+                    data=raw,
+                    headers=dict(headers, **{"Content-Type": "application/json"}),
+                    timeout=30,
+                )
+                ok = r.status_code == 200
+                self.stats.inc(f"http_{r.status_code}")
+            elif self.transport == "mqtt":
+                envelope = {
+                    "uuid": job["uuid"],
+                    "body": raw.decode("utf-8"),
+                    "signature": headers.get("X-AlphaX-Signature"),
+                    "timestamp": headers["X-AlphaX-Timestamp"],
+                }
+                info = self._mqtt.publish(f"{self.result_topic}/{job['uuid']}", json.dumps(envelope), qos=1)
+                info.wait_for_publish(10)
+                ok = info.is_published()
+            else:
+                from alphax_card_terminal.callbacks import ingest_callback
+
+                ingest_callback(job["uuid"], raw, headers)
+                frappe.db.commit()
+                ok = True
+        except Exception:
+            if self.transport == "direct":
+                frappe.db.rollback()
+            ok = False
+        self.stats.sent((time.perf_counter() - started) * 1000, ok)
+        self.stats.inc(f"sent_{kind}")
+
+    # --- run ---
+    def run(self, duration: float = 0) -> Dict[str, Any]:
+        threads: List[threading.Thread] = [threading.Thread(target=self._scheduler, name="fleet-scheduler", daemon=True)]
+        if self.mqtt_settings:
+            self._mqtt = self._mqtt_client()  # requests from sim_transport "mqtt" profiles, results for transport mqtt
+        threads.append(_Intake(self, site=self.site, sites_path=self.sites_path, user=self.user, name="fleet-intake"))
+        for i in range(self.senders):
+            threads.append(_Sender(self, site=self.site, sites_path=self.sites_path, user=self.user, name=f"fleet-sender-{i}"))
+        if self.heartbeats:
+            threads.append(_Heartbeats(self, site=self.site, sites_path=self.sites_path, user=self.user, name="fleet-heartbeats"))
+        if self.rate > 0:
+            for i in range(self.load_threads):
+                threads.append(_Load(self, site=self.site, sites_path=self.sites_path, user=self.user, name=f"fleet-load-{i}"))
+        for t in threads:
+            t.start()
+
+        started = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                self.stop.wait(REPORT_SECONDS)
+                print(json.dumps({"elapsed_s": int(time.monotonic() - started), **self.stats.snapshot()}), flush=True)
+                if duration and time.monotonic() - started >= duration:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stop.set()
+        for t in threads:
+            t.join(timeout=5)
+        if self._mqtt is not None:
+            self._mqtt.loop_stop()
+            self._mqtt.disconnect()
+        return {"terminals": len(self.profiles), "transport": self.transport, **self.stats.snapshot()}
+
+
+class _FleetThread(_Worker):
+    def __init__(self, fleet: Fleet, **kw):
+        super().__init__(**kw)
+        self.fleet = fleet
+
+
+class _Intake(_FleetThread):
+    """Requests from sim_transport "redis" profiles (MQTT requests arrive on the paho thread)."""
+
+    def work(self):
+        self.fleet._redis_intake()
+
+
+class _Sender(_FleetThread):
+    def work(self):
+        http = None
+        if self.fleet.transport == "http":
+            import requests
+
+            http = requests.Session()
+        while not self.fleet.stop.is_set() or not self.fleet.outbox.empty():
+            try:
+                kind, job, body = self.fleet.outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.fleet.deliver(kind, job, body, http)
+
+
+class _Heartbeats(_FleetThread):
+    """Keeps every virtual device ONLINE (presence.record_heartbeats, one Redis call)."""
+
+    def work(self):
+        from alphax_card_terminal.presence import record_heartbeats
+
+        devices = [p["device"] for p in self.fleet.profiles.values() if p.get("device")]
+        while not self.fleet.stop.is_set():
+            try:
+                record_heartbeats(devices)
+            except Exception:
+                pass
+            self.fleet.stop.wait(HEARTBEAT_SECONDS)
+
+
+class _Load(_FleetThread):
+    """Open-loop capture load: sessions + terminal_capture_start on random virtual terminals."""
+
+    def work(self):
+        from alphax_card_terminal import api
+
+        interval = self.fleet.load_threads / self.fleet.rate
+        names = list(self.fleet.profiles)
+        next_at = time.monotonic()
+        while not self.fleet.stop.is_set():
+            next_at += interval
+            settings = random.choice(names)
+            amount = round(random.uniform(1, 500), 2)
+            try:
+                session = api.create_terminal_session(MODE_OF_PAYMENT, amount, settings_name=settings)
+                api.terminal_capture_start(MODE_OF_PAYMENT, amount, settings_name=settings, session=session["session"])
+                frappe.db.commit()
+                self.fleet.stats.inc("captures_started")
+            except Exception:
+                frappe.db.rollback()
+                self.fleet.stats.inc("captures_failed")
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                self.fleet.stop.wait(delay)
+
+
+def run(duration: float = 0, **options) -> Dict[str, Any]:
+    """Run the fleet for `duration` seconds (0 = until interrupted); see Fleet for options."""
+    fleet = Fleet(frappe.local.site, frappe.local.sites_path, **options)
+    return fleet.run(duration=duration)
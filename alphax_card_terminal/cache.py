@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Optional
+
+import frappe
+
+
+class WorkerCache:
+    """Per-worker, per-site memo invalidated through a shared Redis version token.
+
+    Values live in process memory (so cached objects can be classes, compiled
+    extractors, etc.), while a small token in Redis tells every worker when its
+    copy is stale. Reading the token is a single Redis GET, memoised for the
+    request by frappe.cache().
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._sites: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def _version_key(self) -> str:
+        return f"alphax_card_terminal:{self.name}:version"
+
+    def _current_version(self) -> str:
+        version = frappe.cache().get_value(self._version_key)
+        if not version:
+            version = frappe.generate_hash(length=10)
+            frappe.cache().set_value(self._version_key, version)
+        return version
+
+    def _bucket(self) -> Dict[str, Any]:
+        site = getattr(frappe.local, "site", None) or ""
+        version = self._current_version()
+        bucket = self._sites.get(site)
+        if not bucket or bucket.get("__version__") != version:
+            bucket = {"__version__": version}
+            self._sites[site] = bucket
+        return bucket
+
+    def get(self, key: str, generator: Optional[Callable[[], Any]] = None) -> Any:
+        bucket = self._bucket()
+        if key not in bucket and generator is not None:
+            bucket[key] = generator()
+        return bucket.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._bucket()[key] = value
+
+    def peek(self, key: str) -> Any:
+        """Return the local value without consulting Redis (may be stale)."""
+        site = getattr(frappe.local, "site", None) or ""
+        return (self._sites.get(site) or {}).get(key)
+
+    def clear(self) -> None:
+        """Invalidate this cache on every worker of the current site."""
+        frappe.cache().set_value(self._version_key, frappe.generate_hash(length=10))
+        self._sites.pop(getattr(frappe.local, "site", None) or "", None)
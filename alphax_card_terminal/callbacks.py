@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import time
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.query_builder import Case
+from frappe.utils import cint, now_datetime
+
+from alphax_card_terminal import metrics, payload_store
+from alphax_card_terminal.idempotency import on_rollback
+from alphax_card_terminal.mapping import get_mapping
+from alphax_card_terminal.profiles import get_callback_key, get_callback_secret
+from alphax_card_terminal.session_events import EXPIRED, FINAL_STATUSES, notify_session_final
+
+SESSION_FIELDS = [
+    "name",
+    "uuid",
+    "status",
+    "terminal_settings",
+    "driver",
+    "started_on",
+    "amount",
+    "currency",
+    "reference_doctype",
+    "reference_name",
+    "mode_of_payment",
+    "created_by_user",
+]
+
+# Standard fields filled from the payload through the profile's response mapping
+MAPPED_FIELDS = [
+    "terminal_id",
+    "merchant_id",
+    "rrn",
+    "auth_code",
+    "response_code",
+    "response_message",
+    "masked_pan",
+    "tender_brand",
+    "trace_no",
+    "batch_no",
+]
+
+CARD_TRANSACTION_FIELDS = [
+    "status",
+    "amount",
+    "currency",
+    "reference_doctype",
+    "reference_name",
+    "mode_of_payment",
+    *MAPPED_FIELDS,
+    "raw_response_blob",
+]
+
+
+DEFAULT_TOLERANCE_SECONDS = 300
+# Batch items are replayed from an agent's offline buffer, so they may be older than live callbacks.
+BUFFERED_TOLERANCE_SECONDS = 24 * 3600
+# How long nonces / signatures of results without a timestamp are remembered.
+REPLAY_MEMORY_SECONDS = 7 * 24 * 3600
+
+# Final results a later callback may not overwrite (EXPIRED is set by the reaper and still can be).
+SETTLED_STATUSES = tuple(s for s in FINAL_STATUSES if s != EXPIRED)
+
+
+def hmac_ok(secret: str, raw_body: bytes, signature: str | None, timestamp: str | None = None) -> bool:
+    """HMAC-SHA256 over the body, or over "<timestamp>.<body>" when the agent sends a timestamp."""
+    if not secret or not signature:
+        return False
+    message = f"{timestamp}.".encode("utf-8") + raw_body if timestamp else raw_body
+    dig = hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+    # allow "sha256=<hex>" or raw hex
+    sig = signature.replace("sha256=", "").strip()
+    return hmac.compare_digest(dig, sig)
+
+
+def normalize_status(payload: Dict[str, Any], settings_name: Optional[str] = None) -> str:
+    return get_mapping(settings_name).status(payload or {})
+
+
+def card_transaction_values(ss, mapped: Dict[str, Any], payload_blob: Optional[str]) -> Dict[str, Any]:
+    """AlphaX Card Transaction values for an APPROVED/DECLINED result on session `ss`.
+
+    `mapped` is the output of the profile's compiled response mapping for the payload,
+    `payload_blob` the stored payload (shared with the session's response).
+    """
+    values = {k: mapped.get(k) for k in MAPPED_FIELDS}
+    values.update(
+        status="Approved" if mapped["status"] == "APPROVED" else "Declined",
+        amount=ss.amount,
+        currency=ss.currency,
+        reference_doctype=ss.reference_doctype,
+        reference_name=ss.reference_name,
+        mode_of_payment=ss.mode_of_payment,
+        raw_response_blob=payload_blob,
+    )
+    return values
+
+
+def apply_capture_result(ss, res: Dict[str, Any], status: Optional[str] = None):
+    """Write a driver's start_capture result into session doc `ss` and save it."""
+    ss.request_blob, response_blob = payload_store.put_many([res.get("payload") or res.get("request"), res])
+    # For sync drivers we may already have a final response
+    status = status or normalize_status(res, ss.terminal_settings)
+    if status in FINAL_STATUSES:
+        ss.status = status
+        ss.response_blob = response_blob
+        ss.completed_on = now_datetime()
+        if status == "ERROR" and res.get("message"):
+            ss.error_message = res.get("message")
+    ss.save(ignore_permissions=True)
+    if ss.status in FINAL_STATUSES:
+        notify_session_final(ss.uuid, ss.status, ss.name, ss.created_by_user)
+        metrics.observe_session_final(ss, ss.status, ss.completed_on)
+
+
+def _reject(reason: str, message: str):
+    metrics.inc("alphax_callbacks_rejected_total", reason=reason)
+    frappe.throw(message, frappe.PermissionError)
+
+
+def _header(headers: Dict[str, str], name: str) -> Optional[str]:
+    return headers.get(name) or headers.get(name.lower())
+
+
+def _replay_reason(
+    settings_name: str, uuid: str, timestamp: Optional[str], nonce: Optional[str], buffered: bool = False
+) -> Optional[tuple]:
+    """(reason, message) when a signed result must not be applied, else None.
+
+    Timestamped results must be inside the profile's window (a wider one for
+    buffered batch items) and use a nonce once within it. Results without a
+    timestamp (refused with `require_callback_timestamp`) are de-duplicated by
+    uuid and nonce/signature for REPLAY_MEMORY_SECONDS. The nonce is claimed
+    up front (so concurrent duplicates are refused) and given back if the
+    transaction rolls back, so the agent's retry of a result that was not
+    written is accepted.
+    """
+    key_info = get_callback_key(settings_name)
+    tolerance = cint(key_info.tolerance_seconds or DEFAULT_TOLERANCE_SECONDS)
+    if buffered:
+        tolerance = max(cint(key_info.buffered_tolerance_seconds or BUFFERED_TOLERANCE_SECONDS), tolerance)
+    if timestamp:
+        try:
+            age = abs(time.time() - float(timestamp))
+        except ValueError:
+            return "invalid_timestamp", "Invalid X-AlphaX-Timestamp"
+        if age > tolerance:
+            return "stale_timestamp", "Stale callback timestamp"
+        ttl = tolerance * 2
+    elif cint(key_info.require_timestamp):
+        return "missing_timestamp", "Missing X-AlphaX-Timestamp"
+    else:
+        ttl = REPLAY_MEMORY_SECONDS
+    if not nonce:
+        return None
+    key = frappe.cache().make_key(f"alphax_card_terminal:callback_nonce:{settings_name}:{uuid}:{nonce}")
+    try:
+        fresh = frappe.cache().set(key, 1, nx=True, ex=ttl)
+    except Exception:
+        fresh = True  # Redis down: the timestamp window still bounds replays
+    if not fresh:
+        return "replay", "Replayed callback"
+    on_rollback(lambda: _forget_nonce(key))
+    return None
+
+
+def _forget_nonce(key: str):
+    try:
+        frappe.cache().delete(key)
+    except Exception:
+        pass
+
+
+def _reject_replay(settings_name: str, uuid: str, timestamp: Optional[str], nonce: Optional[str]):
+    reason = _replay_reason(settings_name, uuid, timestamp, nonce)
+    if reason:
+        _reject(*reason)
+
+
+def ingest_callback(uuid: str, raw: bytes, headers: Dict[str, str]) -> Dict[str, Any]:
+    """Single-callback hot path.
+
+    Everything that can reject a forged or replayed callback (narrow session
+    lookup, cached secret, HMAC, timestamp window, nonce) runs before any
+    document is loaded; retries for settled sessions are acknowledged without writing; accepted results are written with one field-level
+    UPDATE and one INSERT.
+    """
+    started = time.perf_counter()
+    ss = frappe.db.get_value("AlphaX Terminal Session", {"uuid": uuid}, SESSION_FIELDS, as_dict=True)
+    if not ss:
+        metrics.inc("alphax_callbacks_rejected_total", reason="invalid_uuid")
+        frappe.throw("Invalid UUID", frappe.ValidationError)
+
+    # Verify signature (if configured)
+    secret = get_callback_secret(ss.terminal_settings)
+    sig = _header(headers, "X-AlphaX-Signature")
+    timestamp = _header(headers, "X-AlphaX-Timestamp")
+    if secret and not hmac_ok(secret, raw, sig, timestamp):
+        _reject("invalid_signature", "Invalid signature")
+
+    if ss.status in SETTLED_STATUSES:
+        # Agent retry of a result we already have: acknowledge without writing.
+        return {"ok": True, "uuid": uuid, "status": ss.status}
+
+    if secret:
+        _reject_replay(ss.terminal_settings, uuid, timestamp, _header(headers, "X-AlphaX-Nonce") or sig)
+
+    payload = frappe.parse_json(raw) or {}
+    mapped = get_mapping(ss.terminal_settings).apply(payload)
+    status = mapped["status"]
+    now = now_datetime()
+    blob = payload_store.put(payload)
+    values = {"status": status, "response_blob": blob}
+    if status in FINAL_STATUSES:
+        values["completed_on"] = now
+    if not _update_unsettled_session(ss.name, values, now):
+        # A concurrent delivery settled the session first: acknowledge without writing twice.
+        current = frappe.db.get_value("AlphaX Terminal Session", ss.name, "status")
+        return {"ok": True, "uuid": uuid, "status": current, "skipped": True}
+
+    # Optional: create AlphaX Card Transaction record for approved/declined
+    if status in ("APPROVED", "DECLINED"):
+        _bulk_insert_card_transactions([card_transaction_values(ss, mapped, blob)], now)
+    if status in FINAL_STATUSES:
+        notify_session_final(uuid, status, ss.name, ss.created_by_user)
+        metrics.observe_session_final(ss, status, now)
+
+    metrics.observe("alphax_callback_duration_seconds", time.perf_counter() - started, settings=ss.terminal_settings, status=status)
+    return {"ok": True, "uuid": uuid, "status": status}
+
+
+def _parse_item(item: Dict[str, Any]):
+    """Return (uuid, raw bytes, payload dict, signature, timestamp, nonce) for one batch item.
+
+    `body` is the exact JSON the agent would have POSTed to terminal_callback
+    (what the signature covers, with the optional `timestamp`); `payload` is
+    accepted for unsigned profiles. Items go through the same replay checks as
+    single callbacks (optional `nonce`, else the signature), with the wider
+    buffered timestamp window since they are old by design.
+    """
+    uuid = item.get("uuid")
+    body = item.get("body")
+    if body is not None:
+        raw = body.encode("utf-8") if isinstance(body, str) else frappe.as_json(body).encode("utf-8")
+    else:
+        raw = frappe.as_json(item.get("payload") or {}).encode("utf-8")
+    payload = frappe.parse_json(raw) or {}
+    return uuid or payload.get("uuid"), raw, payload, item.get("signature"), item.get("timestamp"), item.get("nonce")
+
+
+def ingest_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Apply many signed callback results with set-based reads and writes.
+
+    - one locking query for all sessions; callback secrets come from the cached key table
+    - one UPDATE for all session rows (never over a settled result), one bulk INSERT for card transactions
+    Items for sessions that are already final are acknowledged and skipped,
+    so agents can safely replay their buffer.
+    """
+    parsed = []
+    outcomes: List[Dict[str, Any]] = []
+    for item in items:
+        try:
+            parsed.append(_parse_item(item or {}))
+        except Exception:
+            parsed.append((None, b"", {}, None, None, None))
+
+    uuids = list({p[0] for p in parsed if p[0]})
+    sessions = {}
+    if uuids:
+        # Row locks (in name order) make concurrent batches carrying the same result wait for
+        # each other, so the status checks below see what the first one wrote.
+        for row in frappe.get_all(
+            "AlphaX Terminal Session",
+            filters={"uuid": ["in", uuids]},
+            fields=SESSION_FIELDS,
+            order_by="name asc",
+            for_update=True,
+        ):
+            sessions[row.uuid] = row
+
+    now = now_datetime()
+    updates: Dict[str, Dict[str, Any]] = {}
+    transactions: List[Dict[str, Any]] = []
+    finals = []
+
+    for uuid, raw, payload, sig, timestamp, nonce in parsed:
+        ss = sessions.get(uuid) if uuid else None
+        if not ss:
+            metrics.inc("alphax_callbacks_rejected_total", reason="invalid_uuid")
+            outcomes.append({"uuid": uuid, "ok": False, "message": "Invalid UUID"})
+            continue
+        secret = get_callback_secret(ss.terminal_settings)
+        if secret and not hmac_ok(secret, raw, sig, timestamp):
+            metrics.inc("alphax_callbacks_rejected_total", reason="invalid_signature")
+            outcomes.append({"uuid": uuid, "ok": False, "message": "Invalid signature"})
+            continue
+        if ss.status in SETTLED_STATUSES:
+            outcomes.append({"uuid": uuid, "ok": True, "status": ss.status, "skipped": True})
+            continue
+        replay = _replay_reason(ss.terminal_settings, uuid, timestamp, nonce or sig, buffered=True) if secret else None
+        if replay:
+            metrics.inc("alphax_callbacks_rejected_total", reason=replay[0])
+            outcomes.append({"uuid": uuid, "ok": False, "reason": replay[0], "message": replay[1]})
+            continue
+
+        mapped = get_mapping(ss.terminal_settings).apply(payload)
+        status = mapped["status"]
+        updates[ss.name] = {
+            "status": status,
+            "payload": payload,
+            "completed_on": now if status in FINAL_STATUSES else None,
+        }
+        if status in FINAL_STATUSES:
+            ss.status = status  # later duplicates in the same batch are skipped
+            finals.append(ss)
+        if status in ("APPROVED", "DECLINED"):
+            transactions.append((ss.name, card_transaction_values(ss, mapped, None)))
+        outcomes.append({"uuid": uuid, "ok": True, "status": status})
+
+    # One INSERT IGNORE for all payloads; transactions share their session's blob.
+    for vals, blob in zip(updates.values(), payload_store.put_many(v["payload"] for v in updates.values())):
+        vals["response_blob"] = blob
+    transactions = [dict(values, raw_response_blob=updates[name]["response_blob"]) for name, values in transactions]
+
+    if updates and _bulk_update_sessions(updates, now) != len(updates):
+        # Cannot happen while the rows are locked; never insert transactions for results not written.
+        frappe.throw("AlphaX Terminal Session changed during callback ingestion; retry the batch.")
+    if transactions:
+        _bulk_insert_card_transactions(transactions, now)
+    for ss in finals:
+        notify_session_final(ss.uuid, ss.status, ss.name, ss.created_by_user)
+        metrics.observe_session_final(ss, ss.status, now)
+
+    return outcomes
+
+
+def _affected_rows() -> int:
+    return cint(getattr(frappe.db._cursor, "rowcount", 0))
+
+
+def _update_unsettled_session(name: str, values: Dict[str, Any], now) -> bool:
+    """Field-level UPDATE that only applies while the session has no settled result; True if it did."""
+    Session = frappe.qb.DocType("AlphaX Terminal Session")
+    q = (
+        frappe.qb.update(Session)
+        .set(Session.modified, now)
+        .set(Session.modified_by, frappe.session.user)
+        .where(Session.name == name)
+        .where(Session.status.notin(SETTLED_STATUSES))
+    )
+    for field, value in values.items():
+        q = q.set(Session[field], value)
+    q.run()
+    return _affected_rows() > 0
+
+
+def _bulk_update_sessions(updates: Dict[str, Dict[str, Any]], now) -> int:
+    """One CASE UPDATE for many sessions, skipping settled ones; returns the number of rows written."""
+    Session = frappe.qb.DocType("AlphaX Terminal Session")
+    status_case = Case()
+    blob_case = Case()
+    completed_case = Case()
+    for name, vals in updates.items():
+        status_case = status_case.when(Session.name == name, vals["status"])
+        blob_case = blob_case.when(Session.name == name, vals["response_blob"])
+        if vals["completed_on"]:
+            completed_case = completed_case.when(Session.name == name, vals["completed_on"])
+    completed_case = completed_case.else_(Session.completed_on)
+
+    q = (
+        frappe.qb.update(Session)
+        .set(Session.status, status_case)
+        .set(Session.response_blob, blob_case)
+        .set(Session.modified, now)
+        .set(Session.modified_by, frappe.session.user)
+        .where(Session.name.isin(list(updates)))
+        .where(Session.status.notin(SETTLED_STATUSES))
+    )
+    if any(v["completed_on"] for v in updates.values()):
+        q = q.set(Session.completed_on, completed_case)
+    q.run()
+    return _affected_rows()
+
+
+def _bulk_insert_card_transactions(rows: List[Dict[str, Any]], now):
+    user = frappe.session.user
+    fields = ["name", "creation", "modified", "owner", "modified_by", "docstatus"] + CARD_TRANSACTION_FIELDS
+    values = [
+        [frappe.generate_hash(length=10), now, now, user, user, 0] + [r.get(f) for f in CARD_TRANSACTION_FIELDS]
+        for r in rows
+    ]
+    frappe.db.bulk_insert("AlphaX Card Transaction", fields, values)
+
+
+def max_batch_size() -> int:
+    return cint(frappe.conf.get("alphax_callback_batch_max") or 500)
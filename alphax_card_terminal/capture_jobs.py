@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import time
+from dataclasses import asdict
+from typing import Any, Dict
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from alphax_card_terminal import metrics
+from alphax_card_terminal.callbacks import apply_capture_result, normalize_status
+from alphax_card_terminal.drivers.base import CaptureRequest, DriverMode
+from alphax_card_terminal.drivers.registry import get_driver
+from alphax_card_terminal.profiles import get_profile
+from alphax_card_terminal.session_events import notify_session_final
+
+DEFAULT_QUEUE = "alphax_terminal"
+
+
+def runs_in_background(settings_doc, driver) -> bool:
+    """Blocking SYNC drivers can be moved off the web worker per terminal profile."""
+    return bool(cint(getattr(settings_doc, "run_capture_in_background", 0))) and driver.mode == DriverMode.SYNC
+
+
+def enqueue_capture(settings_doc, req: CaptureRequest, session: str) -> Dict[str, Any]:
+    """Queue the driver call and answer the POS with the PENDING session right away."""
+    timeout = cint(getattr(settings_doc, "timeout_seconds", None)) or 45
+    frappe.enqueue(
+        "alphax_card_terminal.capture_jobs.run_capture",
+        queue=getattr(settings_doc, "background_queue", None) or DEFAULT_QUEUE,
+        timeout=timeout + 60,
+        enqueue_after_commit=True,
+        session=session,
+        settings_name=settings_doc.name,
+        request=asdict(req),
+    )
+    uuid = frappe.db.get_value("AlphaX Terminal Session", session, "uuid")
+    return {
+        "status": "PENDING",
+        "transport": "BACKGROUND_JOB",
+        "session": session,
+        "uuid": uuid,
+        "message": "Capture queued. Wait for the session to complete.",
+    }
+
+
+def run_capture(session: str, settings_name: str, request: Dict[str, Any]):
+    """Background job: run the driver call and write the final result into the session."""
+    ss = frappe.get_doc("AlphaX Terminal Session", session)
+    if ss.status != "PENDING":
+        return
+
+    labels = {"driver": ss.driver, "settings": settings_name}
+    started = time.perf_counter()
+    try:
+        s = get_profile(settings_name)
+        drv = get_driver(s)
+        labels["driver"] = drv.driver_code
+        res = drv.start_capture(CaptureRequest(**request))
+    except Exception as e:
+        metrics.observe(
+            "alphax_driver_call_duration_seconds", time.perf_counter() - started, status=metrics.outcome_of_exception(e), **labels
+        )
+        frappe.log_error(title=f"AlphaX capture job failed ({session})")
+        ss.status = "ERROR"
+        ss.error_message = str(e)
+        ss.completed_on = now_datetime()
+        ss.save(ignore_permissions=True)
+        notify_session_final(ss.uuid, ss.status, ss.name, ss.created_by_user)
+        metrics.observe_session_final(ss, ss.status, ss.completed_on)
+        return
+
+    outcome = metrics.outcome_of_result(res, normalize_status(res, settings_name))
+    metrics.observe("alphax_driver_call_duration_seconds", time.perf_counter() - started, status=outcome, **labels)
+    apply_capture_result(ss, res)
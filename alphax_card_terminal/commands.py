@@ -0,0 +1,51 @@
+import json
+
+import click
+from frappe.commands import get_site, pass_context
+from frappe.exceptions import SiteNotSpecifiedError
+
+
+@click.command("alphax-mqtt-subscriber")
+@click.option("--batch-size", default=200, type=int, help="Flush after this many messages per site.")
+@click.option("--linger-ms", default=200, type=int, help="Flush at most this long after the first queued message.")
+@click.option("--shared-group", default=None, help="Subscribe as MQTT shared subscription $share/<group>/... (several workers).")
+@pass_context
+def mqtt_subscriber(context, batch_size, linger_ms, shared_group):
+    """Receive terminal results and heartbeats from all enabled AlphaX MQTT Settings brokers (long-running)."""
+    from alphax_card_terminal.mqtt_subscriber import run
+
+    if not context.sites:
+        raise SiteNotSpecifiedError
+    run(list(context.sites), batch_size=batch_size, linger_ms=linger_ms, shared_group=shared_group)
+
+
+@click.command("alphax-sim-fleet")
+@click.option("--transport", default="direct", type=click.Choice(["http", "mqtt", "direct"]), help="How callbacks are delivered.")
+@click.option("--url", default=None, help="Site base URL (transport http).")
+@click.option("--mqtt-settings", default=None, help="AlphaX MQTT Settings for MQTT requests/results.")
+@click.option("--latency", default="lognormal:1500:0.5", help="fixed:MS | uniform:MIN:MAX | normal:MEAN:SD | lognormal:MEDIAN:SIGMA")
+@click.option("--decline-rate", default=0.05, type=float)
+@click.option("--error-rate", default=0.01, type=float)
+@click.option("--timeout-rate", default=0.0, type=float, help="Share of captures that never get a callback.")
+@click.option("--duplicate-rate", default=0.0, type=float)
+@click.option("--out-of-order-rate", default=0.0, type=float, help="Share followed by a stale progress callback.")
+@click.option("--senders", default=8, type=int, help="Concurrent callback senders.")
+@click.option("--rate", default=0.0, type=float, help="Also start this many captures per second.")
+@click.option("--duration", default=0, type=float, help="Seconds to run (0: until interrupted).")
+@pass_context
+def sim_fleet(context, duration, **options):
+    """Emulate the provisioned simulated terminals (benchmarks/fleet.py) against one site."""
+    import frappe
+
+    from alphax_card_terminal.benchmarks.fleet import run
+
+    site = get_site(context)
+    frappe.init(site=site)
+    try:
+        frappe.connect()
+        print(json.dumps(run(duration=duration, **options), indent=2))
+    finally:
+        frappe.destroy()
+
+
+commands = [mqtt_subscriber, sim_fleet]
@@ -0,0 +1,265 @@
+"""Device leases: one capture at a time per terminal, and branch pools dispatching to the least-busy one.
+
+A pool is the set of enabled profiles with "Share Devices in Branch" that
+have the same company, branch and driver; each profile is pinned to one
+device, so picking a device means capturing with that device's profile.
+
+In-flight captures per device are Redis sorted sets of lease id -> expiry
+(session timeout + grace), so a lost release heals itself when the lease
+expires; the lease -> device "owners" hash is pruned of expired leases on
+acquire and by an hourly sweep (prune_owners). Choosing and claiming a device is one Lua script: it drops expired
+leases, respects a per-device capacity and the pool's FIFO wait queue, and
+picks the least-busy candidate. Leases are released when the session turns
+final (session_events.notify_session_final) or when the driver call fails.
+
+acquire_device() applies the same lease and queue to a single device, for
+profiles with "One Capture at a Time per Device".
+"""
+from __future__ import annotations
+
+import random
+import time
+from typing import Callable, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint
+
+from alphax_card_terminal import presence
+
+BUSY = "BUSY"
+# Realtime event with {session, uuid, device, position} while a capture waits for its device.
+QUEUE_EVENT = "alphax_terminal_queue"
+
+DEFAULT_CAPACITY = 1
+DEFAULT_WAIT_SECONDS = 10
+LEASE_GRACE_SECONDS = 60
+POLL_SECONDS = 0.2
+# A waiter that stops refreshing its ticket for this long is dropped from the queue.
+TICKET_TTL_SECONDS = 3
+
+# KEYS: queue, owners, device zsets...
+# ARGV: now, lease, expires_at, capacity, ticket ("" = not queued)
+_ACQUIRE = """
+local now = tonumber(ARGV[1])
+local head = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+if head and head ~= ARGV[5] then return -1 end
+local best, best_n = nil, nil
+for i = 3, #KEYS do
+  local expired = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', now)
+  if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now)
+    for _, l in ipairs(expired) do
+      if redis.call('HGET', KEYS[2], l) == KEYS[i] then redis.call('HDEL', KEYS[2], l) end
+    end
+  end
+  if redis.call('ZSCORE', KEYS[i], ARGV[2]) then best = i break end
+  local n = redis.call('ZCARD', KEYS[i])
+  if n < tonumber(ARGV[4]) and (best_n == nil or n < best_n) then best, best_n = i, n end
+end
+if not best then return 0 end
+redis.call('ZADD', KEYS[best], ARGV[3], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[2], KEYS[best])
+if ARGV[5] ~= '' then redis.call('ZREM', KEYS[1], ARGV[5]) end
+return best - 2
+"""
+
+# KEYS: owners; ARGV: lease
+_RELEASE = """
+local key = redis.call('HGET', KEYS[1], ARGV[1])
+if not key then return 0 end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return redis.call('ZREM', key, ARGV[1])
+"""
+
+# KEYS: owners; ARGV: now, leases... Drops owner entries whose lease is gone or expired.
+_PRUNE = """
+local now = tonumber(ARGV[1])
+local n = 0
+for i = 2, #ARGV do
+  local key = redis.call('HGET', KEYS[1], ARGV[i])
+  if key then
+    local expires = redis.call('ZSCORE', key, ARGV[i])
+    if not expires or tonumber(expires) <= now then
+      redis.call('ZREM', key, ARGV[i])
+      redis.call('HDEL', KEYS[1], ARGV[i])
+      n = n + 1
+    end
+  end
+end
+return n
+"""
+
+# KEYS: owners; ARGV: old lease, new lease. Moves a held lease (same device, same expiry) to a new id.
+_REKEY = """
+local key = redis.call('HGET', KEYS[1], ARGV[1])
+if not key then return 0 end
+local expires = redis.call('ZSCORE', key, ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+if not expires then return 0 end
+redis.call('ZREM', key, ARGV[1])
+redis.call('ZADD', key, expires, ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[2], key)
+return 1
+"""
+
+
+def _key(*parts: str) -> str:
+    return frappe.cache().make_key("alphax_card_terminal:device_pool:" + ":".join(parts))
+
+
+def _candidates(profile) -> List[Tuple[str, object]]:
+    """(device, profile) of pool members that are not OFFLINE: ONLINE first, then UNKNOWN, shuffled within each."""
+    from alphax_card_terminal.profiles import get_pool_members, get_profile
+
+    online, unknown = [], []
+    for name in get_pool_members(profile):
+        try:
+            member = get_profile(name)
+        except frappe.DoesNotExistError:
+            continue
+        device = member.get("device")
+        if not device:
+            continue
+        state = presence.device_state(device)[0]
+        if state == presence.ONLINE:
+            online.append((device, member))
+        elif state == presence.UNKNOWN:
+            unknown.append((device, member))
+    random.shuffle(online)
+    random.shuffle(unknown)
+    return online + unknown
+
+
+def _try_acquire(queue: str, candidates, lease: str, ttl: int, capacity: int, ticket: str) -> int:
+    cache = frappe.cache()
+    keys = [queue, _key("owners")] + [_key("device", device) for device, _ in candidates]
+    now = time.time()
+    return int(cache.eval(_ACQUIRE, len(keys), *keys, now, lease, now + ttl, capacity, ticket))
+
+
+def _drop_stale_head(queue: str):
+    cache = frappe.cache()
+    pipe = cache.pipeline(transaction=False)
+    pipe.zrange(queue, 0, 0)
+    head = (pipe.execute()[0] or [None])[0]
+    if head is None:
+        return
+    head = head.decode() if isinstance(head, bytes) else head
+    pipe = cache.pipeline(transaction=False)
+    pipe.exists(_key("ticket", head))
+    if not pipe.execute()[0]:
+        cache.pipeline(transaction=False).zrem(queue, head).execute()
+
+
+def _acquire(
+    profile, lease: str, candidates, queue: str, on_wait: Optional[Callable[[int], None]]
+) -> Tuple[Optional[object], Optional[str], int]:
+    """(member profile, None, 0), or (None, reason, last queue position) after `pool_wait_seconds`."""
+    capacity = cint(profile.get("max_inflight_per_device")) or DEFAULT_CAPACITY
+    ttl = (cint(profile.get("timeout_seconds")) or 45) + LEASE_GRACE_SECONDS
+    wait = cint(profile.get("pool_wait_seconds", DEFAULT_WAIT_SECONDS))
+    position = 0
+
+    try:
+        picked = _try_acquire(queue, candidates, lease, ttl, capacity, "")
+        if picked > 0:
+            return candidates[picked - 1][1], None, 0
+        if wait <= 0:
+            return None, "Terminal device is busy.", 0
+
+        cache = frappe.cache()
+        ticket = f"{lease}:{frappe.generate_hash(length=8)}"
+        cache.pipeline(transaction=False).zadd(queue, {ticket: time.time()}, nx=True).set(
+            _key("ticket", ticket), 1, ex=TICKET_TTL_SECONDS
+        ).execute()
+        deadline = time.monotonic() + wait
+        try:
+            while time.monotonic() < deadline:
+                pipe = cache.pipeline(transaction=False)
+                pipe.set(_key("ticket", ticket), 1, ex=TICKET_TTL_SECONDS)
+                pipe.zrank(queue, ticket)
+                rank = pipe.execute()[1]
+                if rank is not None and rank + 1 != position:
+                    position = rank + 1
+                    if on_wait:
+                        on_wait(position)
+                time.sleep(POLL_SECONDS)
+                _drop_stale_head(queue)
+                picked = _try_acquire(queue, candidates, lease, ttl, capacity, ticket)
+                if picked > 0:
+                    return candidates[picked - 1][1], None, 0
+        finally:
+            cache.pipeline(transaction=False).zrem(queue, ticket).delete(_key("ticket", ticket)).execute()
+    except Exception:
+        # Redis unavailable: capture without a lease.
+        frappe.log_error(title="AlphaX: device lease unavailable")
+        return profile, None, 0
+
+    return None, f"Terminal device is busy (waited {wait}s, position {position or 1} in queue).", position or 1
+
+
+def acquire(
+    profile, lease: str, on_wait: Optional[Callable[[int], None]] = None
+) -> Tuple[Optional[object], Optional[str], int]:
+    """Claim a device of `profile`'s pool for lease `lease` (usually the session name).
+
+    Returns (member profile, None, 0), or (None, reason, queue position) when no device is
+    online or all stayed busy for `pool_wait_seconds`. `on_wait(position)` is called whenever
+    the caller's place in the FIFO queue changes.
+    """
+    candidates = _candidates(profile)
+    if not candidates:
+        return None, "No online terminal device in this branch pool.", 0
+    queue = _key("queue", *(str(x) for x in (profile.get("company"), profile.get("branch"), profile.get("driver"))))
+    return _acquire(profile, lease, candidates, queue, on_wait)
+
+
+def acquire_device(
+    profile, lease: str, on_wait: Optional[Callable[[int], None]] = None
+) -> Tuple[Optional[object], Optional[str], int]:
+    """Claim `profile`'s own device (per-device lock with a FIFO queue); same results as acquire().
+
+    Profiles without a device are returned unchanged. The lease set is the one pools use, so a
+    device shared by a pooled and an unpooled profile is still used by one capture at a time.
+    """
+    device = profile.get("device")
+    if not device:
+        return profile, None, 0
+    return _acquire(profile, lease, [(device, profile)], _key("queue", "device", device), on_wait)
+
+
+def release(lease: Optional[str]):
+    """Free the device held by `lease`; safe to call for leases that do not exist."""
+    if not lease:
+        return
+    try:
+        frappe.cache().eval(_RELEASE, 1, _key("owners"), lease)
+    except Exception:
+        pass  # the lease expires on its own
+
+
+
+def prune_owners(batch_size: int = 500) -> int:
+    """Scheduler job (hourly): drop owner entries of expired leases on devices no capture has touched since."""
+    cache = frappe.cache()
+    owners = _key("owners")
+    cursor, pruned = 0, 0
+    while True:
+        pipe = cache.pipeline(transaction=False)
+        pipe.hscan(owners, cursor, count=batch_size)
+        cursor, entries = pipe.execute()[0]
+        leases = [k.decode() if isinstance(k, bytes) else k for k in entries]
+        if leases:
+            pruned += int(cache.eval(_PRUNE, 1, owners, time.time(), *leases))
+        if not int(cursor):
+            return pruned
+
+
+def rekey(lease: Optional[str], new_lease: str):
+    """Hand the device held by `lease` over to `new_lease` (e.g. the session created after acquiring)."""
+    if not lease or lease == new_lease:
+        return
+    try:
+        frappe.cache().eval(_REKEY, 1, _key("owners"), lease, new_lease)
+    except Exception:
+        pass  # the lease expires on its own
@@ -5,6 +5,7 @@ from enum import Enum
 from typing import Any, Dict, Optional
 
 import frappe
+from frappe.utils import cint, flt
 
 
 class DriverMode(str, Enum):
@@ -23,6 +24,15 @@ class CaptureRequest:
     reference_doctype: Optional[str] = None
     reference_name: Optional[str] = None
     idempotency_key: Optional[str] = None
+    # uuid of the AlphaX Terminal Session the result will be reported against (when there is one)
+    session_uuid: Optional[str] = None
+
+
+def capture_failure(exc: BaseException, message: Optional[str] = None, **extra) -> Dict[str, Any]:
+    """start_capture result for a failed call: status TIMEOUT when the endpoint / terminal timed out, else ERROR."""
+    from alphax_card_terminal.metrics import outcome_of_exception
+
+    return {"status": outcome_of_exception(exc), "message": message or str(exc), **extra}
 
 class BaseTerminalDriver:
     """Base class for terminal drivers.
@@ -31,6 +41,7 @@ class BaseTerminalDriver:
     - Vendor-neutral core (driver catalog + profiles).
     - Extensible drivers (MQTT bridge, Android agent, JS SDK like Stripe Terminal, REST gateways, etc.).
     - Drivers are stateless; all configuration comes from Terminal Settings and/or linked Device docs.
+      `settings` is usually a compiled TerminalProfile (read-only, attribute access like the doc).
     """
 
     driver_code: str = "base"
@@ -55,6 +66,10 @@ class BaseTerminalDriver:
     def test_connection(self) -> Dict[str, Any]:
         return {"ok": True, "message": "No connection test implemented for this driver."}
 
+    def cancel_capture(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        """Abort a capture the ERP gave up on (session expired). Best effort; `session` is the session row."""
+        return {"ok": False, "message": "Cancel not supported by this driver."}
+
     def get_client_config(self) -> Dict[str, Any]:
         """For CLIENT_SDK drivers: returns info the POS UI needs (public keys, locations, etc.)."""
         return {}
@@ -66,7 +81,82 @@ class BaseTerminalDriver:
         return {"ok": True}
 
     # --- Helpers ---
+    def _http(
+        self,
+        method: str,
+        url: str,
+        read_timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+        retries: Optional[int] = None,
+        **kwargs,
+    ) -> Any:
+        """HTTP call through the worker's keep-alive pool for this endpoint.
+
+        Timeouts: connect = config `connect_timeout_seconds` (default 5),
+        read = `read_timeout` or the profile's `timeout_seconds`.
+        Pool size per endpoint: config `http_pool_size` (default 10).
+        Circuit breaker (on unless `circuit_breaker: 0`): `circuit_failure_rate` (%),
+        `circuit_min_requests`, `circuit_window_seconds`, `circuit_open_seconds`.
+        Retries: `http_retries` (default 0, max 3). Failover / hedging: `secondary_endpoint_url`
+        (replaces `endpoint_url` at the start of `url`) and `hedge_after_ms`.
+        POSTs with an idempotency key send it as `Idempotency-Key`; they count as idempotent
+        (retried and hedged like GETs) only with `endpoint_deduplicates: 1`.
+        """
+        from alphax_card_terminal.drivers import http_pool
+
+        cfg = self._get_config()
+        breaker = None
+        if cint(cfg.get("circuit_breaker", 1)):
+            breaker = {
+                "failure_rate": flt(cfg.get("circuit_failure_rate") or http_pool.DEFAULT_FAILURE_RATE),
+                "min_requests": cint(cfg.get("circuit_min_requests") or http_pool.DEFAULT_MIN_REQUESTS),
+                "window_seconds": flt(cfg.get("circuit_window_seconds") or http_pool.DEFAULT_WINDOW_SECONDS),
+                "open_seconds": flt(cfg.get("circuit_open_seconds") or http_pool.DEFAULT_OPEN_SECONDS),
+            }
+
+        primary = (cfg.get("endpoint_url") or "").rstrip("/")
+        secondary = (cfg.get("secondary_endpoint_url") or "").rstrip("/")
+        secondary_url = secondary + url[len(primary):] if primary and secondary and url.startswith(primary) else None
+
+        idempotent = None
+        if idempotency_key:
+            kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"Idempotency-Key": idempotency_key})
+            if cint(cfg.get("endpoint_deduplicates")):
+                idempotent = True
+
+        hedge_after_ms = cfg.get("hedge_after_ms")
+        return http_pool.request(
+            method,
+            url,
+            connect_timeout=float(cfg.get("connect_timeout_seconds") or http_pool.DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=float(read_timeout or cfg.get("timeout_seconds") or 45),
+            pool_size=int(cfg.get("http_pool_size") or http_pool.DEFAULT_POOL_SIZE),
+            breaker=breaker,
+            retries=cint(cfg.get("http_retries")) if retries is None else retries,
+            secondary_url=secondary_url,
+            hedge_after=flt(hedge_after_ms) / 1000.0 if hedge_after_ms not in (None, "") else None,
+            idempotent=idempotent,
+            **kwargs,
+        )
+
+    def _http_post(
+        self, url: str, data: Any = None, read_timeout: Optional[float] = None, idempotency_key: Optional[str] = None
+    ) -> Any:
+        return self._http("POST", url, read_timeout=read_timeout, idempotency_key=idempotency_key, data=data)
+
+    def _http_get(self, url: str, read_timeout: Optional[float] = None) -> Any:
+        return self._http("GET", url, read_timeout=read_timeout)
+
+    def _ping_timeout(self) -> float:
+        """Read timeout of test_connection pings: config `ping_timeout_seconds` (default 5)."""
+        return flt(self._get_config().get("ping_timeout_seconds") or 5)
+
     def _get_config(self) -> Dict[str, Any]:
+        # Compiled profile (alphax_card_terminal.profiles): already merged, no parsing needed.
+        compiled = getattr(self.settings, "config", None)
+        if compiled is not None and not isinstance(compiled, str):
+            return dict(compiled)
+
         # Merge explicit fields + config_json (if provided)
         cfg: Dict[str, Any] = {}
         for k in [
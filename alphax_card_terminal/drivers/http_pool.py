@@ -0,0 +1,418 @@
+"""Keep-alive HTTP for REST-style drivers, with fail-fast circuit breakers, retries and hedging.
+
+- One keep-alive session per endpoint origin per worker (EndpointPool).
+- One circuit breaker per endpoint origin and site, kept in Redis so every
+  worker sees the same state. Closed: calls go through and outcomes are counted
+  in a fixed window. Open: once the failure rate reaches the threshold (with at
+  least `min_requests` calls in the window), calls fail at once with
+  CircuitOpen, without waiting for a timeout. Half-open: after `open_seconds`
+  one probe call is let through. It closes the circuit on success and re-opens
+  it on failure. Timeouts, connection errors and HTTP 5xx count as failures.
+- Capped retries with full jitter. Idempotent requests are retried on
+  timeouts, connection errors and 502/503/504. Other requests are retried only
+  when the connection was never established, because then nothing was sent.
+- A secondary endpoint takes over when the primary's circuit is open, or when
+  an idempotent request (or one that never left) fails. With `hedge_after`,
+  idempotent requests also go to the secondary if the primary has not answered
+  within that many seconds. The first successful response wins.
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+
+# Keep-alive sessions shared by all drivers in a worker, one per endpoint origin.
+_pools: Dict[Tuple[str, str, int], "EndpointPool"] = {}
+_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_pid: Optional[int] = None
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+RETRYABLE_STATUS = (502, 503, 504)
+MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 0.2
+RETRY_MAX_SECONDS = 2.0
+
+DEFAULT_FAILURE_RATE = 50  # percent of calls in the window
+DEFAULT_MIN_REQUESTS = 5
+DEFAULT_WINDOW_SECONDS = 30
+DEFAULT_OPEN_SECONDS = 30
+
+# KEYS: state, probe. ARGV: now_ms, probe_ttl_ms.
+# Returns {1, 0} closed, {2, 0} half-open probe granted, {0, open_until_ms} rejected.
+_ALLOW = """
+local st = redis.call('HMGET', KEYS[1], 'state', 'until')
+if st[1] ~= 'open' then return {1, 0} end
+if tonumber(ARGV[1]) < tonumber(st[2]) then return {0, tonumber(st[2])} end
+if redis.call('SET', KEYS[2], '1', 'NX', 'PX', ARGV[2]) then return {2, 0} end
+return {0, tonumber(ARGV[1]) + 1000}
+"""
+
+# KEYS: state, probe, window. ARGV: ok, now_ms, window_ms, min_requests, failure_rate, open_ms, probe.
+# Returns 1 when this outcome opened the circuit.
+_RECORD = """
+local now = tonumber(ARGV[2])
+local open_ms = tonumber(ARGV[6])
+if ARGV[7] == '1' then
+  redis.call('DEL', KEYS[2])
+  if ARGV[1] == '1' then
+    redis.call('DEL', KEYS[1], KEYS[3])
+    return 0
+  end
+  redis.call('HSET', KEYS[1], 'state', 'open', 'until', now + open_ms)
+  redis.call('PEXPIRE', KEYS[1], open_ms * 2 + 60000)
+  return 1
+end
+if redis.call('HGET', KEYS[1], 'state') == 'open' then return 0 end
+local window_ms = tonumber(ARGV[3])
+local bucket = tostring(math.floor(now / window_ms))
+local w = redis.call('HMGET', KEYS[3], 'b', 'ok', 'fail')
+local ok, fail = 0, 0
+if w[1] == bucket then
+  ok = tonumber(w[2]) or 0
+  fail = tonumber(w[3]) or 0
+end
+if ARGV[1] == '1' then ok = ok + 1 else fail = fail + 1 end
+redis.call('HSET', KEYS[3], 'b', bucket, 'ok', ok, 'fail', fail)
+redis.call('PEXPIRE', KEYS[3], window_ms * 2)
+if ARGV[1] ~= '1' and ok + fail >= tonumber(ARGV[4]) and fail * 100 >= tonumber(ARGV[5]) * (ok + fail) then
+  redis.call('HSET', KEYS[1], 'state', 'open', 'until', now + open_ms)
+  redis.call('PEXPIRE', KEYS[1], open_ms * 2 + 60000)
+  redis.call('DEL', KEYS[3])
+  return 1
+end
+return 0
+"""
+
+
+class CircuitOpen(Exception):
+    """The endpoint failed too often recently; calls fail fast until the cool-down ends."""
+
+    def __init__(self, origin: str, retry_in: float):
+        self.origin = origin
+        self.retry_in = max(retry_in, 0)
+        super().__init__(
+            f"{origin} is unavailable (circuit open after repeated failures); "
+            f"not calling it for another {self.retry_in:.0f}s."
+        )
+
+
+class EndpointPool:
+    def __init__(self, origin: str, pool_size: int):
+        self.origin = origin
+        self.pid = os.getpid()
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.adapter = adapter
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.retries = 0
+        self.hedged = 0
+        self.failovers = 0
+
+    def count(self, field: str):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def request(self, method: str, url: str, timeout: Tuple[float, float], **kwargs) -> requests.Response:
+        with self._stats_lock:
+            self.requests += 1
+        try:
+            return self.session.request(method, url, timeout=timeout, **kwargs)
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        opened = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            opened += getattr(pools.get(key), "num_connections", 0)
+        return {
+            "pool_size": self.pool_size,
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections_opened": opened,
+            "connections_reused": max(self.requests - self.errors - opened, 0),
+            "circuit_rejections": self.rejected,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "failovers": self.failovers,
+        }
+
+
+class Breaker:
+    """Circuit breaker of one endpoint origin, shared by all workers of the site through Redis.
+
+    Keys and the Redis client are resolved at construction (in the request's
+    thread), so allow/record also work from hedging threads. Bookkeeping never
+    raises: without Redis every call is allowed.
+    """
+
+    def __init__(
+        self,
+        origin: str,
+        failure_rate: float = DEFAULT_FAILURE_RATE,
+        min_requests: int = DEFAULT_MIN_REQUESTS,
+        window_seconds: float = DEFAULT_WINDOW_SECONDS,
+        open_seconds: float = DEFAULT_OPEN_SECONDS,
+        probe_timeout: float = 60,
+    ):
+        self.origin = origin
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window_ms = int(window_seconds * 1000)
+        self.open_ms = int(open_seconds * 1000)
+        self.probe_ttl_ms = int(probe_timeout * 1000)
+        self.cache = frappe.cache()
+        prefix = f"alphax_card_terminal:circuit:{origin}:"
+        self.keys = [self.cache.make_key(prefix + part) for part in ("state", "probe", "window")]
+
+    def allow(self) -> bool:
+        """True for the half-open probe call; raises CircuitOpen while the circuit is open."""
+        now = int(time.time() * 1000)
+        try:
+            allowed, until = self.cache.eval(_ALLOW, 2, self.keys[0], self.keys[1], now, self.probe_ttl_ms)
+        except Exception:
+            return False
+        if not int(allowed):
+            raise CircuitOpen(self.origin, (int(until) - now) / 1000.0)
+        return int(allowed) == 2
+
+    def record(self, ok: bool, probe: bool = False):
+        try:
+            self.cache.eval(
+                _RECORD,
+                3,
+                *self.keys,
+                1 if ok else 0,
+                int(time.time() * 1000),
+                self.window_ms,
+                self.min_requests,
+                self.failure_rate,
+                self.open_ms,
+                1 if probe else 0,
+            )
+        except Exception:
+            pass
+
+    def state(self) -> Dict[str, Any]:
+        try:
+            raw = self.cache.pipeline(transaction=False).hgetall(self.keys[0]).execute()[0] or {}
+        except Exception:
+            return {"state": "unknown"}
+        st = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in raw.items()}
+        if st.get("state") != "open":
+            return {"state": "closed"}
+        retry_in = (int(float(st.get("until") or 0)) - time.time() * 1000) / 1000.0
+        return {"state": "open" if retry_in > 0 else "half-open", "retry_in": round(max(retry_in, 0), 1)}
+
+
+def _origin(url: str) -> Tuple[str, str, int]:
+    parts = urlsplit(url)
+    scheme = parts.scheme or "http"
+    port = parts.port or (443 if scheme == "https" else 80)
+    return scheme, parts.hostname or "", port
+
+
+def get_pool(url: str, pool_size: Optional[int] = None) -> EndpointPool:
+    key = _origin(url)
+    pool = _pools.get(key)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = EndpointPool("{}://{}:{}".format(*key), pool_size or DEFAULT_POOL_SIZE)
+            _pools[key] = pool
+        return pool
+
+
+def parse_response(resp: requests.Response) -> Any:
+    """Same contract as frappe.make_post_request: raise on HTTP errors, JSON when possible, else text."""
+    resp.raise_for_status()
+    if resp.headers.get("content-type", "").startswith("application/json"):
+        return resp.json()
+    try:
+        return resp.json()
+    except ValueError:
+        return resp.text
+
+
+def _not_sent(exc: BaseException) -> bool:
+    """The connection was never established, so the request cannot have reached the endpoint."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        from urllib3.exceptions import NewConnectionError
+
+        reason = getattr(exc.args[0], "reason", exc.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def _retryable(exc: BaseException, idempotent: bool) -> bool:
+    if isinstance(exc, CircuitOpen):
+        return False
+    if _not_sent(exc):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return getattr(exc.response, "status_code", None) in RETRYABLE_STATUS
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: retries of many lanes against the same endpoint do not arrive in lockstep.
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+def _call(pool: EndpointPool, breaker: Optional[Breaker], method: str, url: str, timeout, **kwargs) -> Any:
+    try:
+        probe = breaker.allow() if breaker else False
+    except CircuitOpen:
+        pool.count("rejected")
+        raise
+    try:
+        resp = pool.request(method, url, timeout=timeout, **kwargs)
+    except Exception:
+        if breaker:
+            breaker.record(False, probe)
+        raise
+    if breaker:
+        breaker.record(resp.status_code < 500, probe)
+    return parse_response(resp)
+
+
+def _call_with_retries(target, method: str, timeout, retries: int, idempotent: bool, **kwargs) -> Any:
+    pool, breaker, url = target
+    attempt = 0
+    while True:
+        try:
+            return _call(pool, breaker, method, url, timeout, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not _retryable(e, idempotent):
+                raise
+        attempt += 1
+        pool.count("retries")
+        time.sleep(_backoff(attempt))
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_executor, _hedge_pid
+    if _hedge_executor is None or _hedge_pid != os.getpid():
+        with _lock:
+            if _hedge_executor is None or _hedge_pid != os.getpid():
+                _hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="alphax-http-hedge")
+                _hedge_pid = os.getpid()
+    return _hedge_executor
+
+
+def _hedged(targets, hedge_after: float, call) -> Any:
+    """Primary first; the secondary too if the primary is slower than `hedge_after` or fails. First success wins."""
+    primary = _executor().submit(call, targets[0])
+    done, _ = wait([primary], timeout=hedge_after)
+    if done and primary.exception() is None:
+        return primary.result()
+    targets[1][0].count("hedged")
+    pending = {primary, _executor().submit(call, targets[1])}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                return f.result()
+            if error is None or isinstance(error, CircuitOpen):
+                error = f.exception()
+    raise error
+
+
+def request(
+    method: str,
+    url: str,
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: float = 45,
+    pool_size: Optional[int] = None,
+    breaker: Optional[Dict[str, Any]] = None,
+    retries: int = 0,
+    secondary_url: Optional[str] = None,
+    hedge_after: Optional[float] = None,
+    idempotent: Optional[bool] = None,
+    **kwargs,
+) -> Any:
+    """One call through the keep-alive pool.
+
+    breaker:       Breaker options (failure_rate, min_requests, window_seconds, open_seconds), or None
+    retries:       extra attempts (capped at MAX_RETRIES) with jittered backoff, see _retryable
+    secondary_url: failover / hedging endpoint
+    hedge_after:   seconds before an idempotent request is also sent to secondary_url
+    idempotent:    default: by HTTP method; pass True for POSTs the endpoint deduplicates
+    """
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+    timeout = (connect_timeout, read_timeout)
+    retries = min(max(int(retries or 0), 0), MAX_RETRIES)
+
+    targets: List[Tuple[EndpointPool, Optional[Breaker], str]] = []
+    for u in [url] + ([secondary_url] if secondary_url else []):
+        pool = get_pool(u, pool_size)
+        cb = Breaker(pool.origin, probe_timeout=connect_timeout + read_timeout, **breaker) if breaker is not None else None
+        targets.append((pool, cb, u))
+
+    def call(target):
+        return _call_with_retries(target, method, timeout, retries, idempotent, **kwargs)
+
+    try:
+        if len(targets) > 1 and idempotent and hedge_after is not None:
+            return _hedged(targets, max(float(hedge_after), 0), call)
+        return _failover(targets, call, idempotent)
+    except CircuitOpen as e:
+        from alphax_card_terminal import metrics
+
+        metrics.inc("alphax_http_circuit_rejections_total", endpoint=e.origin)
+        raise
+
+
+def _failover(targets, call, idempotent: bool) -> Any:
+    for i, target in enumerate(targets):
+        try:
+            return call(target)
+        except Exception as e:
+            # Move on only when the failed endpoint cannot have processed the request.
+            last = i == len(targets) - 1
+            if last or not (isinstance(e, CircuitOpen) or _not_sent(e) or (idempotent and _retryable(e, True))):
+                raise
+            target[0].count("failovers")
+
+
+def get_circuit_states() -> Dict[str, Dict[str, Any]]:
+    """Shared breaker state (closed / open / half-open) of the endpoints this worker has called."""
+    return {pool.origin: Breaker(pool.origin).state() for pool in list(_pools.values()) if pool.pid == os.getpid()}
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    states = get_circuit_states()
+    return {
+        pool.origin: dict(pool.get_stats(), circuit=states.get(pool.origin))
+        for pool in list(_pools.values())
+        if pool.pid == os.getpid()
+    }
@@ -1,8 +1,7 @@
 from __future__ import annotations
 from typing import Any, Dict
 
-import frappe
-from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest
+from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest, capture_failure
 
 class GenericRestDriver(BaseTerminalDriver):
     driver_code = "generic_rest"
@@ -23,14 +22,16 @@ class GenericRestDriver(BaseTerminalDriver):
             "terminal_id": cfg.get("terminal_id"),
         }
         try:
-            # Frappe helper uses requests internally
-            resp = frappe.make_post_request(url, data=payload, timeout=cfg.get("timeout_seconds") or 45)
+            # Keep-alive pooled session (see BaseTerminalDriver._http)
+            resp = self._http_post(
+                url, data=payload, read_timeout=cfg.get("timeout_seconds") or 45, idempotency_key=req.idempotency_key
+            )
             # Expect dict response
             if isinstance(resp, dict):
                 return resp
             return {"status":"Error","message":"Invalid response type from endpoint.", "raw": resp}
         except Exception as e:
-            return {"status":"Error","message":str(e)}
+            return capture_failure(e)
 
     def test_connection(self) -> Dict[str, Any]:
         cfg = self._get_config()
@@ -38,7 +39,7 @@ class GenericRestDriver(BaseTerminalDriver):
         if not url:
             return {"ok": False, "message": "endpoint_url is required."}
         try:
-            resp = frappe.make_post_request(url.rstrip("/") + "/ping", data={}, timeout=10)
+            resp = self._http_post(url.rstrip("/") + "/ping", data={}, read_timeout=self._ping_timeout())
             return {"ok": True, "message": "Ping OK", "raw": resp}
         except Exception as e:
             return {"ok": False, "message": str(e)}
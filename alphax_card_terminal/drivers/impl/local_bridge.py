@@ -1,8 +1,7 @@
 from __future__ import annotations
 from typing import Any, Dict
 
-import frappe
-from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest
+from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest, capture_failure
 
 class LocalBridgeDriver(BaseTerminalDriver):
     driver_code = "local_bridge"
@@ -19,16 +18,18 @@ class LocalBridgeDriver(BaseTerminalDriver):
             "mode_of_payment": req.mode_of_payment,
         }
         try:
-            resp = frappe.make_post_request(url, data=payload, timeout=cfg.get("timeout_seconds") or 60)
+            resp = self._http_post(
+                url, data=payload, read_timeout=cfg.get("timeout_seconds") or 60, idempotency_key=req.idempotency_key
+            )
             return resp if isinstance(resp, dict) else {"status":"Error","message":"Invalid response from bridge.","raw":resp}
         except Exception as e:
-            return {"status":"Error","message":str(e)}
+            return capture_failure(e)
 
     def test_connection(self) -> Dict[str, Any]:
         cfg = self._get_config()
         url = (cfg.get("endpoint_url") or "http://127.0.0.1:9797").rstrip("/")
         try:
-            resp = frappe.make_get_request(url + "/ping", timeout=10)
+            resp = self._http_get(url + "/ping", read_timeout=self._ping_timeout())
             return {"ok": True, "message": "Bridge reachable", "raw": resp}
         except Exception as e:
             return {"ok": False, "message": str(e)}
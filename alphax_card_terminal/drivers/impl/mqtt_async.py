@@ -4,7 +4,7 @@ from typing import Any, Dict
 
 import frappe
 
-from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest, DriverMode
+from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest, DriverMode, capture_failure
 
 
 class MqttAsyncBridgeDriver(BaseTerminalDriver):
@@ -12,7 +12,8 @@ class MqttAsyncBridgeDriver(BaseTerminalDriver):
 
     This driver represents the common KSA pattern:
     ERP publishes a request to an MQTT topic (device/agent subscribes),
-    and the device/agent posts results back via HTTP callback/webhook.
+    and the device/agent posts results back via HTTP callback/webhook, or publishes them to the
+    broker's result topic for the alphax-mqtt-subscriber worker.
 
     This implementation is intentionally vendor-neutral; protocol specifics live in the agent.
     """
@@ -42,7 +43,7 @@ class MqttAsyncBridgeDriver(BaseTerminalDriver):
         publish_from_erp = int(cfg.get("publish_from_erp") or 0) == 1
         if publish_from_erp:
             try:
-                import paho.mqtt.client as mqtt  # type: ignore
+                import paho.mqtt.client  # noqa: F401  # type: ignore
             except Exception:
                 return {
                     "status": "ERROR",
@@ -50,22 +51,31 @@ class MqttAsyncBridgeDriver(BaseTerminalDriver):
                     "payload": payload,
                 }
 
-            broker_host = cfg.get("broker_host")
-            broker_port = int(cfg.get("broker_port") or 1883)
+            from alphax_card_terminal.drivers.mqtt_pool import MqttPublishError, get_publisher, resolve_broker
+
             topic = cfg.get("topic")
-            if not broker_host or not topic:
+            try:
+                broker = resolve_broker(cfg, self.settings)
+            except MqttPublishError as e:
+                return {"status": "ERROR", "message": str(e), "payload": payload}
+            if not broker.get("host") or not topic:
                 return {"status": "ERROR", "message": "Missing broker_host/topic in config_json.", "payload": payload}
 
-            client = mqtt.Client()
-            if cfg.get("username"):
-                client.username_pw_set(cfg.get("username"), cfg.get("password"))
-            if int(cfg.get("use_ssl") or 0) == 1:
-                client.tls_set()  # relies on system defaults; production should pin CA certs if required
-            client.connect(broker_host, broker_port, int(cfg.get("keepalive") or 60))
-            client.loop_start()
-            client.publish(topic, frappe.as_json(payload), qos=int(cfg.get("qos") or 1))
-            client.loop_stop()
-            client.disconnect()
+            qos = cfg.get("qos")
+            qos = int(qos if qos not in (None, "") else (broker.get("qos") if broker.get("qos") is not None else 1))
+            ack_timeout = float(cfg.get("publish_timeout_seconds") or 5)
+            try:
+                latency_ms = get_publisher(broker).publish(topic, frappe.as_json(payload), qos=qos, timeout=ack_timeout)
+            except Exception as e:
+                return capture_failure(e, f"MQTT publish failed: {e}", payload=payload)
+
+            return {
+                "status": "PENDING",
+                "transport": "MQTT",
+                "payload": payload,
+                "publish_latency_ms": round(latency_ms, 2),
+                "message": "Request published. Await device callback to complete.",
+            }
 
         return {
             "status": "PENDING",
@@ -73,3 +83,23 @@ class MqttAsyncBridgeDriver(BaseTerminalDriver):
             "payload": payload,
             "message": "Request prepared. Await device callback to complete.",
         }
+
+    def cancel_capture(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        """Publish {"action": "cancel", "uuid": ...} to `cancel_topic` (default: the request topic)."""
+        cfg = self._get_config()
+        if int(cfg.get("publish_from_erp") or 0) != 1:
+            return {"ok": False, "message": "publish_from_erp is disabled; the agent must time out on its own."}
+
+        from alphax_card_terminal.drivers.mqtt_pool import get_publisher, resolve_broker
+
+        request = frappe.parse_json(session.get("request_payload") or "{}") or {}
+        topic = cfg.get("cancel_topic") or cfg.get("topic")
+        broker = resolve_broker(cfg, self.settings)
+        if not broker.get("host") or not topic:
+            return {"ok": False, "message": "Missing broker_host/topic in config_json."}
+
+        payload = {"action": "cancel", "uuid": request.get("uuid"), "session": session.get("name")}
+        get_publisher(broker).publish(
+            topic, frappe.as_json(payload), qos=1, timeout=float(cfg.get("publish_timeout_seconds") or 5)
+        )
+        return {"ok": True}
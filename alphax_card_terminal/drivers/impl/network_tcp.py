@@ -1,27 +1,69 @@
 from __future__ import annotations
 from typing import Any, Dict
 
-from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest
+import frappe
+from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest, capture_failure
+from alphax_card_terminal.drivers.tcp_engine import JsonProtocol, get_engine
 
 class NetworkTcpDriver(BaseTerminalDriver):
+    """LAN (ECR) terminal over a persistent TCP connection.
+
+    The wire protocol is pluggable: config_json `tcp_protocol` is the dotted path of a
+    tcp_engine.TerminalProtocol subclass (default: JSON in 4-byte length-prefixed frames).
+    Other keys: `tcp_protocol_options` (keyword arguments of the protocol class),
+    `tcp_header_size` (overrides its header_size), `heartbeat_seconds` (default 30,
+    0 disables), `connect_timeout_seconds` (default 5).
+    """
+
     driver_code = "network_tcp"
     driver_name = "Network TCP (LAN Terminal)"
 
+    def _protocol(self, cfg: Dict[str, Any]):
+        path = cfg.get("tcp_protocol")
+        cls = frappe.get_attr(path) if path else JsonProtocol
+        options = dict(cfg.get("tcp_protocol_options") or {})
+        if cfg.get("tcp_header_size"):
+            options["header_size"] = cfg.get("tcp_header_size")
+        return cls(**options)
+
+    def _engine_kwargs(self, cfg: Dict[str, Any]) -> Dict[str, Any]:
+        heartbeat = cfg.get("heartbeat_seconds")
+        return {
+            "connect_timeout": float(cfg.get("connect_timeout_seconds") or 5),
+            "heartbeat_interval": float(30 if heartbeat in (None, "") else heartbeat),
+        }
+
     def start_capture(self, req: CaptureRequest) -> Dict[str, Any]:
         cfg = self._get_config()
         ip = cfg.get("terminal_ip")
         port = cfg.get("terminal_port")
         if not ip or not port:
             return {"status":"Error","message":"terminal_ip and terminal_port are required for Network TCP driver."}
-        # Stub: implement vendor protocol in customer-specific driver
-        return {
-            "status":"PENDING",
-            "message":"Network TCP driver stub. Implement protocol for your terminal vendor.",
-            "terminal_ip": ip,
-            "terminal_port": port,
+        request = {
+            "type": "SALE",
+            "uuid": req.idempotency_key,
             "amount": req.amount,
-            "currency": req.currency,
+            "currency": req.currency or cfg.get("currency") or "SAR",
+            "reference_doctype": req.reference_doctype,
+            "reference_name": req.reference_name,
+            "merchant_id": cfg.get("merchant_id"),
+            "terminal_id": cfg.get("terminal_id"),
         }
+        try:
+            res = get_engine().call(
+                ip,
+                int(port),
+                self._protocol(cfg),
+                request,
+                timeout=float(cfg.get("timeout_seconds") or 45),
+                **self._engine_kwargs(cfg),
+            )
+        except Exception as e:
+            return capture_failure(e, request=request)
+        res = dict(res or {})
+        res.setdefault("status", "ERROR")
+        res["request"] = request
+        return res
 
     def test_connection(self) -> Dict[str, Any]:
         cfg = self._get_config()
@@ -29,4 +71,8 @@ class NetworkTcpDriver(BaseTerminalDriver):
         port = cfg.get("terminal_port")
         if not ip or not port:
             return {"ok": False, "message": "terminal_ip and terminal_port are required."}
-        return {"ok": True, "message": "Configuration looks valid (connectivity test not implemented)."}
+        try:
+            info = get_engine().probe(ip, int(port), self._protocol(cfg), timeout=10, **self._engine_kwargs(cfg))
+        except Exception as e:
+            return {"ok": False, "message": str(e)}
+        return {"ok": True, "message": f"Terminal reachable ({info['latency_ms']} ms)", "raw": info}
@@ -2,13 +2,39 @@ from __future__ import annotations
 from typing import Any, Dict
 
 import frappe
-from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest
+from frappe.utils import cint
+from alphax_card_terminal.drivers.base import BaseTerminalDriver, CaptureRequest, DriverMode, capture_failure
+
+# Redis list the simulated fleet (benchmarks/fleet.py) pops capture requests from.
+FLEET_JOBS_KEY = "alphax_card_terminal:sim_fleet:jobs"
+FLEET_REQUEST_TOPIC = "alphax/sim/request"
+
+
+def fleet_jobs_key() -> str:
+    return frappe.cache().make_key(FLEET_JOBS_KEY)
+
 
 class SimulatorDriver(BaseTerminalDriver):
+    """Instant approve/decline, or (config_json `simulate_async: 1`) an async terminal.
+
+    In async mode the request is handed to the simulated fleet, over a Redis list
+    (`sim_transport: "redis"`, default) or MQTT (`"mqtt"`: published to
+    `alphax/sim/request/<terminal_id>` on the profile's broker), and the result
+    arrives later through terminal_callback like a real agent's.
+    """
+
     driver_code = "simulator"
     driver_name = "Simulator (Demo/Training)"
 
+    def __init__(self, settings_doc):
+        super().__init__(settings_doc)
+        if cint(self._get_config().get("simulate_async")):
+            self.mode = DriverMode.ASYNC_CALLBACK
+
     def start_capture(self, req: CaptureRequest) -> Dict[str, Any]:
+        if self.mode == DriverMode.ASYNC_CALLBACK:
+            return self._start_async(req)
+
         # Deterministic simulation: amounts ending with .99 decline; else approve.
         try:
             amt = float(req.amount)
@@ -33,5 +59,34 @@ class SimulatorDriver(BaseTerminalDriver):
             "raw": {"simulator": True},
         }
 
+    def _start_async(self, req: CaptureRequest) -> Dict[str, Any]:
+        cfg = self._get_config()
+        payload = {
+            "uuid": req.session_uuid or req.idempotency_key or frappe.generate_hash(length=24),
+            "settings": self.settings.name,
+            "amount": req.amount,
+            "currency": req.currency or cfg.get("currency") or "SAR",
+            "reference_doctype": req.reference_doctype,
+            "reference_name": req.reference_name,
+            "terminal_id": cfg.get("terminal_id"),
+            "merchant_id": cfg.get("merchant_id"),
+        }
+        try:
+            if cfg.get("sim_transport") == "mqtt":
+                from alphax_card_terminal.drivers.mqtt_pool import get_publisher, resolve_broker
+
+                topic = f"{FLEET_REQUEST_TOPIC}/{cfg.get('terminal_id') or self.settings.name}"
+                get_publisher(resolve_broker(cfg, self.settings)).publish(topic, frappe.as_json(payload), qos=1)
+            else:
+                frappe.cache().pipeline(transaction=False).lpush(fleet_jobs_key(), frappe.as_json(payload)).execute()
+        except Exception as e:
+            return capture_failure(e, f"Simulated fleet unreachable: {e}", payload=payload)
+        return {
+            "status": "PENDING",
+            "transport": "SIMULATOR",
+            "payload": payload,
+            "message": "Request handed to the simulated fleet. Await callback.",
+        }
+
     def test_connection(self) -> Dict[str, Any]:
         return {"ok": True, "message": "Simulator ready."}
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import frappe
+
+# One long-lived publisher per broker, shared by all requests in a worker.
+_publishers: Dict[tuple, "MqttPublisher"] = {}
+_lock = threading.Lock()
+
+
+class MqttPublishError(Exception):
+    pass
+
+
+class MqttPublishTimeout(MqttPublishError, TimeoutError):
+    """Broker not connected / PUBACK not received in time."""
+
+
+class MqttPublisher:
+    """A connected paho client kept alive across captures.
+
+    paho's network thread (loop_start) handles keepalive and reconnects with
+    exponential backoff; publish() waits a bounded time for the connection and,
+    for QoS > 0, for the broker's PUBACK.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_ssl: bool = False,
+        keepalive: int = 60,
+    ):
+        import paho.mqtt.client as mqtt  # type: ignore
+
+        self.host = host
+        self.port = port
+        self.pid = os.getpid()
+        self._connected = threading.Event()
+        self._inflight = 0
+        self._connects = 0
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "published": 0,
+            "failed": 0,
+            "ack_timeouts": 0,
+            "reconnects": 0,
+            "latency_ms_total": 0.0,
+            "latency_ms_max": 0.0,
+            "latency_ms_last": 0.0,
+        }
+
+        if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt >= 2.0
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        else:
+            client = mqtt.Client()
+        if username:
+            client.username_pw_set(username, password)
+        if use_ssl:
+            client.tls_set()  # relies on system defaults; production should pin CA certs if required
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        self.client = client
+
+        client.connect_async(host, port, keepalive)
+        client.loop_start()
+
+    # --- paho callbacks (network thread) ---
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        if rc == 0:
+            with self._stats_lock:
+                self._connects += 1
+                self.stats["reconnects"] = self._connects - 1
+            self._connected.set()
+
+    def _on_disconnect(self, client, userdata, rc, *args):
+        self._connected.clear()
+
+    # --- API ---
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def publish(self, topic: str, payload: str, qos: int = 1, timeout: float = 5.0) -> float:
+        """Publish and wait for delivery. Returns latency in milliseconds."""
+        started = time.monotonic()
+        if not self._connected.wait(timeout):
+            self._record(started, ok=False)
+            raise MqttPublishTimeout(f"MQTT broker {self.host}:{self.port} not connected within {timeout}s")
+
+        with self._stats_lock:
+            self._inflight += 1
+        try:
+            info = self.client.publish(topic, payload, qos=qos)
+            if info.rc != 0:
+                self._record(started, ok=False)
+                raise MqttPublishError(f"MQTT publish failed (rc={info.rc})")
+            if qos > 0:
+                remaining = max(0.0, timeout - (time.monotonic() - started))
+                try:
+                    info.wait_for_publish(remaining)
+                except (RuntimeError, ValueError):
+                    pass
+                if not info.is_published():
+                    with self._stats_lock:
+                        self.stats["ack_timeouts"] += 1
+                    self._record(started, ok=False)
+                    raise MqttPublishTimeout(f"No PUBACK from {self.host}:{self.port} within {timeout}s")
+        finally:
+            with self._stats_lock:
+                self._inflight -= 1
+
+        return self._record(started, ok=True)
+
+    def _record(self, started: float, ok: bool) -> float:
+        ms = (time.monotonic() - started) * 1000.0
+        with self._stats_lock:
+            if ok:
+                self.stats["published"] += 1
+                self.stats["latency_ms_total"] += ms
+                self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], ms)
+                self.stats["latency_ms_last"] = ms
+            else:
+                self.stats["failed"] += 1
+        return ms
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out = dict(self.stats)
+            out["inflight"] = self._inflight
+        out["connected"] = self.connected
+        out["latency_ms_avg"] = out["latency_ms_total"] / out["published"] if out["published"] else 0.0
+        return out
+
+    def close(self):
+        try:
+            self.client.loop_stop()
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+def resolve_broker(cfg: Dict[str, Any], settings_doc=None) -> Dict[str, Any]:
+    """Resolve broker connection details.
+
+    Order: config_json.mqtt_settings -> linked device's MQTT settings -> inline broker_* keys.
+    """
+    compiled = getattr(settings_doc, "mqtt_info", None)
+    if compiled:
+        if not compiled["enabled"]:
+            raise MqttPublishError(f"AlphaX MQTT Settings {compiled['name']} is disabled.")
+        return {
+            "key": (frappe.local.site, "settings", compiled["name"], compiled["modified"]),
+            "host": compiled["broker_host"],
+            "port": int(compiled["broker_port"] or 1883),
+            "username": compiled["username"],
+            "password": compiled["password"],
+            "use_ssl": bool(int(compiled["use_ssl"] or 0)),
+            "keepalive": int(compiled["keepalive"] or 60),
+            "timeout": int(compiled["timeout_seconds"] or 0),
+            "qos": compiled["default_qos"],
+        }
+
+    mqtt_settings = cfg.get("mqtt_settings")
+    if not mqtt_settings and settings_doc is not None and getattr(settings_doc, "device", None):
+        mqtt_settings = frappe.db.get_value("AlphaX Terminal Device", settings_doc.device, "mqtt_settings")
+
+    if mqtt_settings:
+        ms = frappe.get_cached_doc("AlphaX MQTT Settings", mqtt_settings)
+        if not ms.enabled:
+            raise MqttPublishError(f"AlphaX MQTT Settings {mqtt_settings} is disabled.")
+        return {
+            "key": (frappe.local.site, "settings", ms.name, str(ms.modified)),
+            "host": ms.broker_host,
+            "port": int(ms.broker_port or 1883),
+            "username": ms.username,
+            "password": ms.get_password("password", raise_exception=False) if ms.username else None,
+            "use_ssl": bool(int(ms.use_ssl or 0)),
+            "keepalive": int(ms.keepalive or 60),
+            "timeout": int(ms.timeout_seconds or 0),
+            "qos": ms.default_qos,
+        }
+
+    host = cfg.get("broker_host")
+    port = int(cfg.get("broker_port") or 1883)
+    username = cfg.get("username")
+    password = cfg.get("password")
+    use_ssl = int(cfg.get("use_ssl") or 0) == 1
+    keepalive = int(cfg.get("keepalive") or 60)
+    # Everything the connection is built from is in the key, so an edited profile gets a new publisher;
+    # the password only as a digest.
+    secret = hashlib.sha256(f"{frappe.local.site}:{password or ''}".encode("utf-8")).hexdigest()[:16]
+    return {
+        "key": (frappe.local.site, "inline", host, port, username, use_ssl, keepalive, secret),
+        "host": host,
+        "port": port,
+        "username": username,
+        "password": password,
+        "use_ssl": use_ssl,
+        "keepalive": keepalive,
+        "timeout": 0,
+        "qos": None,
+    }
+
+
+def get_publisher(broker: Dict[str, Any]) -> MqttPublisher:
+    key = broker["key"]
+    pub = _publishers.get(key)
+    if pub is not None and pub.pid == os.getpid():
+        return pub
+    with _lock:
+        pub = _publishers.get(key)
+        if pub is not None and pub.pid == os.getpid():
+            return pub
+        # A settings change yields a new key: retire the publisher for the old revision
+        # (same settings doc, or same inline broker and user).
+        identity = 3 if key[1] == "settings" else 5
+        for old_key in [k for k in _publishers if k[:identity] == key[:identity]]:
+            old = _publishers.pop(old_key)
+            if old.pid == os.getpid():
+                old.close()
+        pub = MqttPublisher(
+            broker["host"],
+            broker["port"],
+            username=broker.get("username"),
+            password=broker.get("password"),
+            use_ssl=broker.get("use_ssl"),
+            keepalive=broker.get("keepalive") or 60,
+        )
+        _publishers[key] = pub
+        return pub
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    site = getattr(frappe.local, "site", None)
+    return {
+        ":".join(str(p) for p in key[1:5]): pub.get_stats()
+        for key, pub in list(_publishers.items())
+        if key[0] == site
+    }
@@ -1,39 +1,114 @@
 from __future__ import annotations
 import importlib
-from typing import Any
+from typing import Any, Dict, List
 
 import frappe
 
+from alphax_card_terminal.cache import WorkerCache
+
 DEFAULT_DRIVER_MAP = {
     "Generic REST": "generic_rest",
     "Local Bridge (localhost)": "local_bridge",
     "Network TCP": "network_tcp",
 }
 
+BUILTIN_HANDLERS = {
+    "generic_rest": "alphax_card_terminal.drivers.impl.generic_rest.GenericRestDriver",
+    "local_bridge": "alphax_card_terminal.drivers.impl.local_bridge.LocalBridgeDriver",
+    "network_tcp": "alphax_card_terminal.drivers.impl.network_tcp.NetworkTcpDriver",
+    "simulator": "alphax_card_terminal.drivers.impl.simulator.SimulatorDriver",
+}
+
+CATALOG_FIELDS = ["name", "driver_code", "driver_name", "description", "capabilities", "handler_path", "is_active", "modified"]
+
+# Driver catalog rows + resolved classes, per worker and per site.
+_catalog = WorkerCache("driver_catalog")
+# Resolved classes keyed by (driver name, modified); survives catalog reloads so
+# unchanged drivers are not re-imported when another driver is edited.
+_classes: Dict[tuple, Any] = {}
+
+
 def _load_class(handler_path: str):
     mod_name, cls_name = handler_path.rsplit(".", 1)
     mod = importlib.import_module(mod_name)
     return getattr(mod, cls_name)
 
+
+def _load_catalog() -> Dict[str, Dict[str, Any]]:
+    rows = frappe.get_all("AlphaX Terminal Driver", fields=CATALOG_FIELDS, order_by="driver_name asc")
+    return {r.name: r for r in rows}
+
+
+def get_catalog() -> Dict[str, Dict[str, Any]]:
+    """All AlphaX Terminal Driver rows (active or not), keyed by name."""
+    return _catalog.get("rows", _load_catalog)
+
+
+def get_active_drivers() -> List[Dict[str, Any]]:
+    return [r for r in get_catalog().values() if r.is_active]
+
+
+def get_driver_class(driver_name: str):
+    rec = get_catalog().get(driver_name)
+    if not rec:
+        # Not in the cached catalog (e.g. inserted without hooks): fall back to the doc.
+        rec = frappe.get_doc("AlphaX Terminal Driver", driver_name)
+    key = (rec.name, str(rec.modified))
+    cls = _classes.get(key)
+    if cls is None:
+        cls = _load_class(rec.handler_path)
+        _classes[key] = cls
+    return cls
+
+
+def get_builtin_class(code: str):
+    key = ("__builtin__", code)
+    cls = _classes.get(key)
+    if cls is None:
+        cls = _load_class(BUILTIN_HANDLERS[code])
+        _classes[key] = cls
+    return cls
+
+
 def get_driver(settings_doc):
     """Return a driver instance for a given AlphaX Payment Terminal Settings doc."""
     # Preferred: Link field to AlphaX Terminal Driver
     driver_name = getattr(settings_doc, "driver", None)
     if driver_name:
-        rec = frappe.get_doc("AlphaX Terminal Driver", driver_name)
-        handler_path = rec.handler_path
-        cls = _load_class(handler_path)
-        return cls(settings_doc)
+        return get_driver_class(driver_name)(settings_doc)
 
     # Backward compatibility: provider select
     provider = getattr(settings_doc, "provider", None)
     code = DEFAULT_DRIVER_MAP.get(provider or "", "simulator")
     # Use built-in default handlers
-    handler_path = {
-        "generic_rest": "alphax_card_terminal.drivers.impl.generic_rest.GenericRestDriver",
-        "local_bridge": "alphax_card_terminal.drivers.impl.local_bridge.LocalBridgeDriver",
-        "network_tcp": "alphax_card_terminal.drivers.impl.network_tcp.NetworkTcpDriver",
-        "simulator": "alphax_card_terminal.drivers.impl.simulator.SimulatorDriver",
-    }[code]
-    cls = _load_class(handler_path)
-    return cls(settings_doc)
+    return get_builtin_class(code)(settings_doc)
+
+
+def clear_driver_cache(doc=None, method=None):
+    """Invalidate the driver catalog on all workers (doc_events hook)."""
+    _catalog.clear()
+
+
+def warm_driver_cache():
+    """Resolve every active handler once so the first capture does not pay for imports."""
+    if _catalog.peek("warm"):
+        return
+    for rec in get_active_drivers():
+        try:
+            get_driver_class(rec.name)
+        except Exception:
+            frappe.log_error(title=f"AlphaX: cannot load driver {rec.name}")
+    for code in BUILTIN_HANDLERS:
+        get_builtin_class(code)
+    _catalog.set("warm", 1)
+
+
+def warm_driver_cache_on_request():
+    """before_request hook; opt-in via site_config `alphax_warm_drivers: 1`."""
+    if not frappe.conf.get("alphax_warm_drivers") or _catalog.peek("warm"):
+        return
+    try:
+        warm_driver_cache()
+    except Exception:
+        # Warm-up is an optimisation; never fail a request because of it.
+        pass
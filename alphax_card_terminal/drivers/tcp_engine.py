@@ -0,0 +1,409 @@
+"""Asyncio engine for LAN (ECR) terminals.
+
+- One persistent connection per terminal_ip:terminal_port, shared by all
+  requests in a worker and serialized (terminals handle one dialog at a time).
+- Pluggable framing and vendor protocol; the default is JSON in 4-byte
+  big-endian length-prefixed frames.
+- Idle heartbeat, reconnect with backoff, and a real connectivity probe.
+
+The event loop runs in a daemon thread so synchronous Frappe code can call
+TcpEngine.call()/probe(). This module does not import frappe, so the stub
+terminal server can run standalone:
+
+    python -m alphax_card_terminal.drivers.tcp_engine --port 9999
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class TcpTerminalError(Exception):
+    pass
+
+
+# --- Framing ------------------------------------------------------------------
+
+
+class Framing:
+    """Splits the byte stream into protocol frames."""
+
+    def encode(self, payload: bytes) -> bytes:
+        raise NotImplementedError
+
+    async def read_frame(self, reader: asyncio.StreamReader) -> bytes:
+        raise NotImplementedError
+
+
+class LengthPrefixedFraming(Framing):
+    """<length><payload>, length as an unsigned big/little-endian integer of `header_size` bytes."""
+
+    def __init__(self, header_size: int = 4, byteorder: str = "big", max_frame: int = 1024 * 1024):
+        self.header_size = header_size
+        self.byteorder = byteorder
+        self.max_frame = max_frame
+
+    def encode(self, payload: bytes) -> bytes:
+        return len(payload).to_bytes(self.header_size, self.byteorder) + payload
+
+    async def read_frame(self, reader: asyncio.StreamReader) -> bytes:
+        header = await reader.readexactly(self.header_size)
+        size = int.from_bytes(header, self.byteorder)
+        if size > self.max_frame:
+            raise TcpTerminalError(f"Frame too large ({size} bytes)")
+        return await reader.readexactly(size)
+
+
+# --- Protocols ----------------------------------------------------------------
+
+
+class TerminalProtocol:
+    """Vendor protocol: request/response encoding on top of a framing.
+
+    Subclass and point config `tcp_protocol` at the class path to support a
+    vendor's ECR protocol.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.framing: Framing = LengthPrefixedFraming(header_size=int(options.get("header_size") or 4))
+
+    def encode_request(self, request: Dict[str, Any]) -> bytes:
+        raise NotImplementedError
+
+    def decode_response(self, frame: bytes) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def heartbeat_request(self) -> Optional[bytes]:
+        """Frame payload sent when the connection is idle; None disables heartbeats."""
+        return None
+
+    def is_heartbeat_response(self, frame: bytes) -> bool:
+        return False
+
+
+class JsonProtocol(TerminalProtocol):
+    """UTF-8 JSON objects; heartbeat is {"type": "PING"} -> {"type": "PONG"}."""
+
+    def encode_request(self, request: Dict[str, Any]) -> bytes:
+        return json.dumps(request, default=str).encode("utf-8")
+
+    def decode_response(self, frame: bytes) -> Dict[str, Any]:
+        return json.loads(frame.decode("utf-8"))
+
+    def heartbeat_request(self) -> Optional[bytes]:
+        return b'{"type": "PING"}'
+
+    def is_heartbeat_response(self, frame: bytes) -> bool:
+        try:
+            return json.loads(frame.decode("utf-8")).get("type") == "PONG"
+        except Exception:
+            return False
+
+
+# --- Connection ---------------------------------------------------------------
+
+
+class TerminalConnection:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        protocol: TerminalProtocol,
+        connect_timeout: float = 5,
+        heartbeat_interval: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.connect_timeout = connect_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.lock = asyncio.Lock()
+        self.failures = 0
+        self.stats = {"connects": 0, "requests": 0, "errors": 0, "heartbeats": 0}
+        self._last_used = 0.0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        # at_eof(): the terminal closed its side while we were idle.
+        return self.writer is not None and not self.writer.is_closing() and not self.reader.at_eof()
+
+    async def _connect(self):
+        if self.connected:
+            return
+        if self.failures:
+            # Exponential backoff with jitter between reconnect attempts, capped at 5s.
+            await asyncio.sleep(min(5.0, 0.1 * (2 ** min(self.failures, 6))) * random.uniform(0.5, 1.0))
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout=self.connect_timeout
+            )
+        except Exception as e:
+            self.failures += 1
+            raise TcpTerminalError(f"Cannot connect to {self.host}:{self.port}: {e}") from e
+        self.failures = 0
+        self.stats["connects"] += 1
+        if self.heartbeat_interval and self.protocol.heartbeat_request() is not None:
+            if self._heartbeat_task is None or self._heartbeat_task.done():
+                self._heartbeat_task = asyncio.ensure_future(self._heartbeat_loop())
+
+    async def _close(self):
+        writer, self.reader, self.writer = self.writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def close(self):
+        """Stop heartbeats and close the socket once any request in flight has finished."""
+        async with self.lock:
+            if self._heartbeat_task is not None:
+                self._heartbeat_task.cancel()
+                self._heartbeat_task = None
+            await self._close()
+
+    async def _exchange(self, frame: bytes, timeout: float) -> bytes:
+        framing = self.protocol.framing
+        self.writer.write(framing.encode(frame))
+        await self.writer.drain()
+        return await asyncio.wait_for(framing.read_frame(self.reader), timeout=timeout)
+
+    async def request(self, request: Dict[str, Any], timeout: float, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Send `request` and read its response within `timeout` seconds.
+
+        `deadline` (time.monotonic()) is the latest moment the frame may still be
+        written: a request that waited past it behind another dialog is refused
+        unsent, since its caller has already given up on it.
+        """
+        async with self.lock:
+            self.stats["requests"] += 1
+            for attempt in (1, 2):
+                await self._connect()
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.stats["errors"] += 1
+                    raise TcpTerminalError(f"Request to {self.host}:{self.port} not sent: its deadline has passed")
+                try:
+                    # Only the write of a stale socket is retried; a read timeout is never
+                    # retried because the terminal may already be processing the request.
+                    self.writer.write(self.protocol.framing.encode(self.protocol.encode_request(request)))
+                    await self.writer.drain()
+                except (ConnectionError, OSError) as e:
+                    await self._close()
+                    if attempt == 2:
+                        self.stats["errors"] += 1
+                        raise TcpTerminalError(str(e)) from e
+                    continue
+                try:
+                    while True:
+                        frame = await asyncio.wait_for(self.protocol.framing.read_frame(self.reader), timeout=timeout)
+                        if not self.protocol.is_heartbeat_response(frame):
+                            break
+                    self._last_used = asyncio.get_running_loop().time()
+                    return self.protocol.decode_response(frame)
+                except asyncio.CancelledError:
+                    # The caller gave up mid-dialog: the late response must not reach the next request.
+                    self.stats["errors"] += 1
+                    await self._close()
+                    raise
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    await self._close()
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise TcpTerminalError(f"No response from {self.host}:{self.port} within {timeout}s") from e
+                    raise TcpTerminalError(str(e)) from e
+
+    async def probe(self, timeout: float) -> Dict[str, Any]:
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await self._close()
+            await self._connect()
+            beat = self.protocol.heartbeat_request()
+            if beat is not None:
+                try:
+                    frame = await self._exchange(beat, timeout)
+                except Exception as e:
+                    await self._close()
+                    raise TcpTerminalError(f"Connected but no heartbeat reply: {e}") from e
+                if not self.protocol.is_heartbeat_response(frame):
+                    raise TcpTerminalError("Unexpected reply to heartbeat")
+            return {"latency_ms": round((loop.time() - started) * 1000, 2), "heartbeat": beat is not None}
+
+    async def _heartbeat_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.connected:
+            await asyncio.sleep(self.heartbeat_interval)
+            if self.lock.locked() or loop.time() - self._last_used < self.heartbeat_interval:
+                continue
+            async with self.lock:
+                if not self.connected:
+                    return
+                try:
+                    await self._exchange(self.protocol.heartbeat_request(), timeout=self.connect_timeout)
+                    self.stats["heartbeats"] += 1
+                    self._last_used = loop.time()
+                except Exception:
+                    # Dead link: drop it; the next request reconnects.
+                    await self._close()
+                    return
+
+
+# --- Engine (sync facade) -----------------------------------------------------
+
+
+class TcpEngine:
+    """Owns the event loop thread and the per-terminal connections of a worker."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.connections: Dict[Tuple[str, int], TerminalConnection] = {}
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self.loop.run_forever, name="alphax-tcp-engine", daemon=True)
+        thread.start()
+
+    def _connection(self, host: str, port: int, protocol: TerminalProtocol, **kwargs) -> TerminalConnection:
+        key = (host, int(port))
+        with self._lock:
+            conn = self.connections.get(key)
+            if conn is None or type(conn.protocol) is not type(protocol) or conn.protocol.options != protocol.options:
+                if conn is not None:
+                    # Protocol changed: the old socket and heartbeat task must not linger.
+                    asyncio.run_coroutine_threadsafe(conn.close(), self.loop)
+                conn = TerminalConnection(host, int(port), protocol, **kwargs)
+                self.connections[key] = conn
+            else:
+                conn.connect_timeout = kwargs.get("connect_timeout", conn.connect_timeout)
+                conn.heartbeat_interval = kwargs.get("heartbeat_interval", conn.heartbeat_interval)
+            return conn
+
+    def _run(self, coro, timeout: float):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Do not leave the coroutine running (and possibly sending) after the caller gave up.
+            future.cancel()
+            raise
+
+    def call(self, host: str, port: int, protocol: TerminalProtocol, request: Dict[str, Any], timeout: float, **kwargs):
+        conn = self._connection(host, port, protocol, **kwargs)
+        # Allow for waiting behind another request on the same terminal, but write the
+        # frame only while its full read timeout still fits in that budget.
+        budget = timeout * 2 + conn.connect_timeout + 5
+        deadline = time.monotonic() + budget - timeout
+        return self._run(conn.request(request, timeout, deadline=deadline), budget)
+
+    def probe(self, host: str, port: int, protocol: TerminalProtocol, timeout: float = 5, **kwargs):
+        conn = self._connection(host, port, protocol, **kwargs)
+        return self._run(conn.probe(timeout), timeout * 2 + conn.connect_timeout + 5)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            f"{h}:{p}": dict(conn.stats, connected=conn.connected) for (h, p), conn in list(self.connections.items())
+        }
+
+
+_engine: Optional[TcpEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> TcpEngine:
+    global _engine
+    if _engine is None or _engine.pid != os.getpid():
+        with _engine_lock:
+            if _engine is None or _engine.pid != os.getpid():
+                _engine = TcpEngine()
+    return _engine
+
+
+# --- Stub terminal (local testing) --------------------------------------------
+
+
+class StubTerminalServer:
+    """Fake ECR terminal speaking JsonProtocol.
+
+    Approves every SALE except amounts ending in .99 (same rule as SimulatorDriver),
+    answers PING with PONG, and can add latency to mimic a customer at the PIN pad.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.protocol = JsonProtocol()
+        self.connections = 0
+        self.sales = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        framing = self.protocol.framing
+        try:
+            while True:
+                req = json.loads((await framing.read_frame(reader)).decode("utf-8"))
+                if req.get("type") == "PING":
+                    res = {"type": "PONG"}
+                else:
+                    self.sales += 1
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    declined = f"{float(req.get('amount') or 0):.2f}".endswith(".99")
+                    res = {
+                        "type": "RESULT",
+                        "uuid": req.get("uuid"),
+                        "status": "DECLINED" if declined else "APPROVED",
+                        "amount": req.get("amount"),
+                        "rrn": f"{random.randint(0, 10**12 - 1):012d}",
+                        "auth_code": "" if declined else f"{random.randint(0, 999999):06d}",
+                        "response_code": "05" if declined else "00",
+                        "response_message": "STUB DECLINE" if declined else "STUB APPROVAL",
+                        "terminal_id": req.get("terminal_id"),
+                    }
+                writer.write(framing.encode(json.dumps(res).encode("utf-8")))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="AlphaX stub LAN terminal (JSON, 4-byte length prefix)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before answering a SALE")
+    args = parser.parse_args()
+
+    async def run():
+        stub = await StubTerminalServer(args.host, args.port, args.delay).start()
+        print(f"Stub terminal listening on {stub.host}:{stub.port}")
+        await stub.server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,4 +1,14 @@
 import frappe
+from frappe.utils import cint, flt
+
+
+def _mop_requires_approval(mop: str) -> bool:
+    # Cached document values: a Redis hit after the first read, cleared when the MoP is saved.
+    capture, require = frappe.get_cached_value(
+        "Mode of Payment", mop, ["act_capture_terminal_data", "act_require_terminal_approval"]
+    ) or (0, 0)
+    return bool(cint(capture) and cint(require))
+
 
 def sales_invoice_before_submit(doc, method=None):
     """Block submission if any card MoP requires terminal approval and no Approved transaction exists."""
@@ -10,31 +20,35 @@ def sales_invoice_before_submit(doc, method=None):
     if not payments:
         return
 
+    required = []
     for p in payments:
         mop = getattr(p, "mode_of_payment", None)
         amt = getattr(p, "amount", None)
         if not mop or not amt:
             continue
+        if _mop_requires_approval(mop):
+            required.append((mop, amt))
 
-        capture = frappe.db.get_value("Mode of Payment", mop, "act_capture_terminal_data") or 0
-        if not int(capture):
-            continue
-
-        require = frappe.db.get_value("Mode of Payment", mop, "act_require_terminal_approval") or 0
-        if not int(require):
-            continue
+    if not required:
+        return
 
-        exists = frappe.db.exists(
+    # One indexed query for all approved transactions of this invoice
+    approved = {
+        (t.mode_of_payment, flt(t.amount, 6))
+        for t in frappe.get_all(
             "AlphaX Card Transaction",
-            {
+            filters={
                 "reference_doctype": "Sales Invoice",
                 "reference_name": doc.name,
-                "mode_of_payment": mop,
+                "mode_of_payment": ["in", list({mop for mop, _ in required})],
                 "status": "Approved",
-                "amount": amt,
             },
+            fields=["mode_of_payment", "amount"],
         )
-        if not exists:
+    }
+
+    for mop, amt in required:
+        if (mop, flt(amt, 6)) not in approved:
             frappe.throw(
                 f"Terminal approval is required for Mode of Payment '{mop}' (Amount: {amt}). "
                 "Capture and log an Approved terminal transaction before submitting."
@@ -0,0 +1,289 @@
+"""Streaming NDJSON / CSV export of card transactions and terminal sessions.
+
+Rows are read with keyset pagination over (creation, name), a chunk per query,
+and written out as they are read, so memory stays flat whatever the range.
+Only the listed scalar columns are selected; request/response payloads are
+added (resolved from the payload store in one query per chunk) only when
+asked for. The requesting user's User Permissions are applied the way
+get_list applies them (card transactions through the TIDs of the terminal
+profiles the user may see).
+
+HTTP: api.export_terminal_data streams the response. For very large pulls run
+it next to the database instead:
+
+    bench --site <site> execute alphax_card_terminal.export.export_to_file --kwargs "{'doctype': 'AlphaX Card Transaction', 'path': '/tmp/txns.ndjson', 'from_date': '2026-09-01', 'to_date': '2026-09-30'}"
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+import frappe
+from frappe.utils import add_days, cint, getdate
+
+from alphax_card_terminal import payload_store
+
+CHUNK_SIZE = 5000
+FORMATS = ("ndjson", "csv")
+SETTINGS_DOCTYPE = "AlphaX Payment Terminal Settings"
+
+EXPORTS: Dict[str, Dict[str, Any]] = {
+    "AlphaX Card Transaction": {
+        "fields": [
+            "name",
+            "creation",
+            "status",
+            "amount",
+            "currency",
+            "mode_of_payment",
+            "reference_doctype",
+            "reference_name",
+            "terminal_id",
+            "merchant_id",
+            "rrn",
+            "auth_code",
+            "trace_no",
+            "batch_no",
+            "tender_brand",
+            "masked_pan",
+            "response_code",
+            "response_message",
+            "settlement_status",
+            "settlement_reconciliation",
+        ],
+        # output column -> (inline Long Text column, blob link column)
+        "payloads": {"raw_response": ("raw_response", "raw_response_blob")},
+    },
+    "AlphaX Terminal Session": {
+        "fields": [
+            "name",
+            "creation",
+            "uuid",
+            "status",
+            "company",
+            "branch",
+            "mode_of_payment",
+            "terminal_settings",
+            "driver",
+            "device",
+            "amount",
+            "currency",
+            "reference_doctype",
+            "reference_name",
+            "started_on",
+            "completed_on",
+            "created_by_user",
+            "idempotency_key",
+            "error_message",
+        ],
+        "payloads": {
+            "request_payload": ("request_payload", "request_blob"),
+            "response_payload": ("response_payload", "response_blob"),
+        },
+    },
+}
+
+
+def _permission_conditions(table, doctype: str) -> list:
+    """qb criteria for the session user's User Permissions on `doctype`, as get_list builds them."""
+    from frappe.core.doctype.user_permission.user_permission import get_user_permissions
+
+    perms = get_user_permissions(frappe.session.user)
+    if not perms:
+        return []
+    strict = cint(frappe.get_system_settings("apply_strict_user_permissions"))
+    links = [("name", doctype)] + [
+        (df.fieldname, df.options) for df in frappe.get_meta(doctype).get_link_fields() if not df.ignore_user_permissions
+    ]
+    conditions = []
+    for fieldname, target in links:
+        allowed = [
+            p.get("doc") for p in perms.get(target) or [] if not p.get("applicable_for") or p.get("applicable_for") == doctype
+        ]
+        if not allowed:
+            continue
+        condition = table[fieldname].isin(allowed)
+        if not strict and fieldname != "name":
+            condition = condition | table[fieldname].isnull() | (table[fieldname] == "")
+        conditions.append(condition)
+    return conditions
+
+
+def _terminal_ids(company=None, branch=None, terminal=None) -> Optional[List[str]]:
+    """TIDs of the terminal profiles matching the filters and the user's User Permissions
+    (card transactions only carry the TID); None when nothing restricts them."""
+    from alphax_card_terminal.profiles import get_profile
+
+    Settings = frappe.qb.DocType(SETTINGS_DOCTYPE)
+    conditions = _permission_conditions(Settings, SETTINGS_DOCTYPE)
+    if not (company or branch or terminal or conditions):
+        return None
+    q = frappe.qb.from_(Settings).select(Settings.name)
+    for field, value in (("company", company), ("branch", branch), ("name", terminal)):
+        if value:
+            q = q.where(Settings[field] == value)
+    for condition in conditions:
+        q = q.where(condition)
+    tids = set()
+    for (name,) in q.run():
+        tid = get_profile(name).config.get("terminal_id")
+        if tid:
+            tids.add(str(tid))
+    return sorted(tids)
+
+
+def _query(doctype: str, fields: List[str], company, branch, terminal, device, status, from_date, to_date):
+    """Filtered select without pagination, or None when the filters cannot match anything."""
+    table = frappe.qb.DocType(doctype)
+    q = frappe.qb.from_(table).select(*[table[f] for f in fields])
+    if from_date:
+        q = q.where(table.creation >= getdate(from_date))
+    if to_date:
+        q = q.where(table.creation < add_days(getdate(to_date), 1))
+    if status:
+        q = q.where(table.status == status)
+    for condition in _permission_conditions(table, doctype):
+        q = q.where(condition)
+
+    if doctype == "AlphaX Terminal Session":
+        for field, value in (("company", company), ("branch", branch), ("terminal_settings", terminal), ("device", device)):
+            if value:
+                q = q.where(table[field] == value)
+    else:
+        if device:
+            terminal = terminal or frappe.db.get_value(SETTINGS_DOCTYPE, {"device": device}, "name")
+            if not terminal:
+                return None
+        tids = _terminal_ids(company, branch, terminal)
+        if tids is not None:
+            if not tids:
+                return None
+            q = q.where(table.terminal_id.isin(tids))
+    return q, table
+
+
+def iter_rows(
+    doctype: str,
+    company: Optional[str] = None,
+    branch: Optional[str] = None,
+    terminal: Optional[str] = None,
+    device: Optional[str] = None,
+    status: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    include_payloads: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Chunks of export rows in (creation, name) order."""
+    spec = EXPORTS[doctype]
+    fields = list(spec["fields"])
+    payloads = spec["payloads"] if include_payloads else {}
+    for inline, blob in payloads.values():
+        fields += [inline, blob]
+
+    built = _query(doctype, fields, company, branch, terminal, device, status, from_date, to_date)
+    if built is None:
+        return
+    base, table = built
+
+    after = None
+    while True:
+        q = base.orderby(table.creation).orderby(table.name).limit(chunk_size)
+        if after:
+            q = q.where((table.creation > after[0]) | ((table.creation == after[0]) & (table.name > after[1])))
+        rows = q.run(as_dict=True)
+        if not rows:
+            return
+        after = (rows[-1].creation, rows[-1].name)
+
+        if payloads:
+            texts = payload_store.get_texts(r.get(blob) for r in rows for _, blob in payloads.values())
+            for r in rows:
+                for column, (inline, blob) in payloads.items():
+                    r[column] = r.pop(inline) or texts.get(r.pop(blob))
+        yield rows
+
+        if len(rows) < chunk_size:
+            return
+
+
+def _columns(doctype: str, include_payloads: bool) -> List[str]:
+    spec = EXPORTS[doctype]
+    return list(spec["fields"]) + (list(spec["payloads"]) if include_payloads else [])
+
+
+def _default(value):
+    return str(value)
+
+
+def encode(chunks: Iterator[List[Dict[str, Any]]], fmt: str, columns: List[str]) -> Iterator[str]:
+    """Text blocks (one per chunk) in NDJSON or CSV."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        yield buf.getvalue()
+        for rows in chunks:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows([r.get(c) for c in columns] for r in rows)
+            yield buf.getvalue()
+        return
+    for rows in chunks:
+        yield "".join(
+            json.dumps({c: r.get(c) for c in columns}, default=_default, separators=(",", ":")) + "\n" for r in rows
+        )
+
+
+def validate_request(doctype: str, fmt: str, include_payloads: bool):
+    if doctype not in EXPORTS:
+        frappe.throw(f"Export is not available for {doctype}.")
+    if fmt not in FORMATS:
+        frappe.throw(f"Format must be one of {', '.join(FORMATS)}.")
+    if not frappe.has_permission(doctype, "export"):
+        raise frappe.PermissionError
+    if include_payloads:
+        frappe.only_for(("System Manager", "Accounts Manager"))
+
+
+def export_to_file(doctype: str, path: str, format: str = "ndjson", include_payloads: int = 0, **filters) -> int:
+    """Write an export to `path` on this server; returns the number of rows."""
+    include = bool(cint(include_payloads))
+    validate_request(doctype, format, include)
+    count = 0
+
+    def counted():
+        nonlocal count
+        for rows in iter_rows(doctype, include_payloads=include, **filters):
+            count += len(rows)
+            yield rows
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for block in encode(counted(), format, _columns(doctype, include)):
+            f.write(block)
+    return count
+
+
+def stream(doctype: str, format: str = "ndjson", include_payloads: bool = False, **filters) -> Iterator[bytes]:
+    """Response body generator. The web request's DB connection (and usually its frappe.local) is gone
+    before the body is sent, so the generator runs on its own connection as the requesting user."""
+    site, user = frappe.local.site, frappe.session.user
+    columns = _columns(doctype, include_payloads)
+
+    def body():
+        fresh = not getattr(frappe.local, "initialised", False)
+        if fresh:
+            frappe.init(site=site)
+        try:
+            frappe.connect(set_admin_as_user=False)
+            frappe.set_user(user)  # User Permissions are applied for this user
+            for block in encode(iter_rows(doctype, include_payloads=include_payloads, **filters), format, columns):
+                yield block.encode("utf-8")
+        finally:
+            frappe.db.close()
+            if fresh:
+                frappe.destroy()
+
+    return body()
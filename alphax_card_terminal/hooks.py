@@ -34,5 +34,88 @@ doc_events = {
     "Sales Invoice": {
         "before_submit": "alphax_card_terminal.events.sales_invoice_before_submit.sales_invoice_before_submit",
         "on_submit": "alphax_card_terminal.events.sales_invoice_on_submit.sales_invoice_on_submit",
-    }
+    },
+    "AlphaX Terminal Driver": {
+        "on_update": "alphax_card_terminal.drivers.registry.clear_driver_cache",
+        "on_trash": "alphax_card_terminal.drivers.registry.clear_driver_cache",
+    },
+    "AlphaX Payment Terminal Settings": {
+        "on_update": [
+            "alphax_card_terminal.drivers.registry.clear_driver_cache",
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.mapping.clear_mapping_cache",
+        ],
+        "on_trash": [
+            "alphax_card_terminal.drivers.registry.clear_driver_cache",
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.mapping.clear_mapping_cache",
+        ],
+    },
+    # Compiled terminal profiles embed these records
+    "AlphaX Terminal Device": {
+        "on_update": [
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.presence.clear_device_cache",
+        ],
+        "on_trash": [
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.presence.clear_device_cache",
+        ],
+    },
+    "AlphaX Terminal Brand": {
+        "on_update": [
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.mapping.clear_mapping_cache",
+        ],
+        "on_trash": [
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.mapping.clear_mapping_cache",
+        ],
+    },
+    "AlphaX Bank App Config": {
+        "on_update": [
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.mapping.clear_mapping_cache",
+        ],
+        "on_trash": [
+            "alphax_card_terminal.profiles.clear_profile_cache",
+            "alphax_card_terminal.mapping.clear_mapping_cache",
+        ],
+    },
+    "AlphaX MQTT Settings": {
+        "on_update": "alphax_card_terminal.profiles.clear_profile_cache",
+        "on_trash": "alphax_card_terminal.profiles.clear_profile_cache",
+    },
+    "Mode of Payment": {
+        "on_update": "alphax_card_terminal.profiles.clear_profile_cache",
+    },
+}
+
+# -----------------------------------------------------------------------------
+# Request hooks
+# -----------------------------------------------------------------------------
+# Opt-in driver warm-up (site_config: "alphax_warm_drivers": 1)
+before_request = [
+    "alphax_card_terminal.drivers.registry.warm_driver_cache_on_request",
+]
+
+# -----------------------------------------------------------------------------
+# Scheduled jobs
+# -----------------------------------------------------------------------------
+scheduler_events = {
+    "cron": {
+        # Expire PENDING sessions past their profile timeout; persist device presence
+        "* * * * *": [
+            "alphax_card_terminal.reaper.expire_stale_sessions",
+            "alphax_card_terminal.presence.flush_presence",
+        ],
+    },
+    "hourly": [
+        # Drop lease -> device entries of expired device leases
+        "alphax_card_terminal.device_pool.prune_owners",
+    ],
+    "daily_long": [
+        # Move inline payloads into the blob store, archive old blobs to files
+        "alphax_card_terminal.payload_store.run_maintenance",
+    ],
 }
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Callable, Optional
+
+import frappe
+from frappe.utils import cint
+
+IN_FLIGHT = "__in_flight__"
+
+DEFAULT_TTL = 24 * 3600
+
+
+class IdempotencyBusy(Exception):
+    """Another request with the same key is still running."""
+
+
+def _key(namespace: str, key: str) -> str:
+    return frappe.cache().make_key(f"alphax_card_terminal:idempotency:{namespace}:{key}")
+
+
+def _ttl() -> int:
+    return cint(frappe.conf.get("alphax_idempotency_ttl_seconds")) or DEFAULT_TTL
+
+
+def run_once(
+    namespace: str,
+    key: Optional[str],
+    fn: Callable[[], Any],
+    wait_seconds: float = 5,
+    in_flight_seconds: int = 120,
+    keep: Optional[Callable[[Any], bool]] = None,
+) -> Any:
+    """Run `fn` once per (namespace, key) and replay its result for repeated keys.
+
+    - The first caller claims the key (SET NX) and runs `fn`.
+    - Concurrent duplicates wait up to `wait_seconds` for that result instead of
+      running `fn` again; if it is still running, IdempotencyBusy is raised.
+    - The result is stored (with TTL) only after the transaction commits; a
+      rollback releases the key so the client can retry.
+    - A result for which `keep(result)` is false (nothing was done, e.g. the
+      device was busy) is not stored: the key is released on commit instead.
+
+    Without a key, or when Redis is unreachable, `fn` simply runs; callers keep
+    their own database-level guard for that case.
+    """
+    if not key:
+        return fn()
+
+    cache = frappe.cache()
+    rkey = _key(namespace, key)
+    try:
+        claimed = cache.set(rkey, IN_FLIGHT, nx=True, ex=in_flight_seconds)
+    except Exception:
+        return fn()
+
+    if not claimed:
+        found, result = _wait_for_result(rkey, wait_seconds)
+        if found:
+            return result
+        # The owner rolled back (key released): take over once.
+        return run_once(namespace, key, fn, wait_seconds=0, in_flight_seconds=in_flight_seconds, keep=keep)
+
+    try:
+        result = fn()
+    except Exception:
+        _release(rkey)
+        raise
+
+    if keep is not None and not keep(result):
+        on_commit(lambda: _release(rkey))
+        on_rollback(lambda: _release(rkey))
+        return result
+
+    stored = frappe.as_json(result)
+    on_commit(lambda: cache.set(rkey, stored, ex=_ttl()))
+    on_rollback(lambda: _release(rkey))
+    return result
+
+
+def _wait_for_result(rkey: str, wait_seconds: float):
+    cache = frappe.cache()
+    deadline = time.monotonic() + max(wait_seconds, 0)
+    delay = 0.05
+    while True:
+        val = cache.get(rkey)
+        if val is None:
+            return False, None
+        if isinstance(val, bytes):
+            val = val.decode("utf-8")
+        if val != IN_FLIGHT:
+            return True, json.loads(val)
+        if time.monotonic() >= deadline:
+            raise IdempotencyBusy
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+def _release(rkey: str):
+    try:
+        frappe.cache().delete(rkey)
+    except Exception:
+        pass
+
+
+def on_commit(fn):
+    hook = getattr(frappe.db, "after_commit", None)
+    if hook is not None:
+        hook.add(fn)
+    else:
+        fn()
+
+
+def on_rollback(fn):
+    hook = getattr(frappe.db, "after_rollback", None)
+    if hook is not None:
+        hook.add(fn)
@@ -0,0 +1,204 @@
+"""Declarative response mapping (AlphaX Bank App Config.response_mapping_json).
+
+A mapping turns a bank app / agent / gateway payload into the standard
+fields used by AlphaX Terminal Session and AlphaX Card Transaction. Each
+entry maps a standard field to a spec:
+
+    "rrn": "data.rrn|transaction_id"              dotted paths, first non-empty wins
+    "rrn": ["data.rrn", "transaction_id"]         same, as a list
+    "amount": {"path": "txn.amount", "type": "float", "default": 0}
+    "status": {"path": "result.code", "map": {"00": "APPROVED", "51": "DECLINED"}}
+
+Types: str, int, float, bool, upper, lower. Unmapped standard fields keep
+the built-in defaults below. Mappings are compiled once per worker into
+path tuples and coercion callables, and cached per terminal profile.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, flt
+
+from alphax_card_terminal.cache import WorkerCache
+from alphax_card_terminal.session_events import FINAL_STATUSES
+
+DEFAULT_MAPPING: Dict[str, Any] = {
+    "status": "status|result",
+    "terminal_id": "terminal_id|tid",
+    "merchant_id": "merchant_id|mid",
+    "rrn": "rrn|transaction_id",
+    "auth_code": "auth_code",
+    "response_code": "response_code",
+    "response_message": "message|response_message",
+    "masked_pan": "masked_pan",
+    "tender_brand": "tender_brand|brand",
+    "trace_no": "trace_no",
+    "batch_no": "batch_no",
+}
+
+# Spec keys used in bank app configs -> AlphaX Card Transaction fieldnames
+FIELD_ALIASES = {"brand": "tender_brand", "message": "response_message", "tid": "terminal_id", "mid": "merchant_id"}
+
+# Raw status values (case-insensitive) understood without an explicit "map"
+STATUS_SYNONYMS = {
+    "APPROVED": "APPROVED",
+    "APPROVE": "APPROVED",
+    "SUCCESS": "APPROVED",
+    "SUCCESSFUL": "APPROVED",
+    "ACCEPTED": "APPROVED",
+    "00": "APPROVED",
+    "DECLINED": "DECLINED",
+    "DECLINE": "DECLINED",
+    "REJECTED": "DECLINED",
+    "DENIED": "DECLINED",
+    "ERROR": "ERROR",
+    "FAILED": "ERROR",
+    "FAILURE": "ERROR",
+    # drivers report TIMEOUT (capture_failure); the session ends as ERROR, metrics keep TIMEOUT
+    "TIMEOUT": "ERROR",
+    "TIMED_OUT": "ERROR",
+    "CANCELLED": "CANCELLED",
+    "CANCELED": "CANCELLED",
+    "ABORTED": "CANCELLED",
+    "PENDING": "PENDING",
+}
+
+COERCE: Dict[str, Callable[[Any], Any]] = {
+    "str": lambda v: str(v),
+    "int": cint,
+    "float": flt,
+    "bool": lambda v: bool(cint(v)) if not isinstance(v, str) else v.strip().lower() in ("1", "true", "yes", "y"),
+    "upper": lambda v: str(v).upper(),
+    "lower": lambda v: str(v).lower(),
+}
+
+_mappings = WorkerCache("response_mappings")
+
+_MISSING = object()
+
+Getter = Tuple[Tuple[str, ...], ...]
+
+
+def _paths(spec: Any) -> Getter:
+    if isinstance(spec, str):
+        spec = spec.split("|")
+    return tuple(tuple(p.strip().split(".")) for p in spec if p and p.strip())
+
+
+def _lookup(payload: Any, path: Tuple[str, ...]) -> Any:
+    cur = payload
+    for part in path:
+        if isinstance(cur, dict):
+            cur = cur.get(part, _MISSING)
+        elif isinstance(cur, list) and part.isdigit() and int(part) < len(cur):
+            cur = cur[int(part)]
+        else:
+            return _MISSING
+        if cur is _MISSING:
+            return _MISSING
+    return cur
+
+
+class CompiledMapping:
+    __slots__ = ("fields", "status_paths", "status_map")
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.fields: List[tuple] = []
+        self.status_paths: Getter = ()
+        self.status_map: Dict[str, str] = dict(STATUS_SYNONYMS)
+
+        for target, rule in spec.items():
+            target = FIELD_ALIASES.get(target, target)
+            if isinstance(rule, dict):
+                paths = _paths(rule.get("path") or rule.get("paths") or target)
+                coerce = COERCE.get(rule.get("type") or "")
+                default = rule.get("default")
+                valmap = {str(k).upper(): v for k, v in (rule.get("map") or {}).items()}
+            else:
+                paths, coerce, default, valmap = _paths(rule), None, None, {}
+
+            if target == "status":
+                # The default paths stay as fallbacks: SYNC driver results carry a plain top-level status.
+                defaults = _paths(DEFAULT_MAPPING["status"])
+                self.status_paths = paths + tuple(p for p in defaults if p not in paths)
+                self.status_map.update({k: str(v).upper() for k, v in valmap.items()})
+                continue
+            self.fields.append((target, paths, coerce, default, valmap))
+
+    def _first(self, payload: Dict[str, Any], paths: Getter) -> Any:
+        for path in paths:
+            v = _lookup(payload, path)
+            if v is not _MISSING and v not in (None, ""):
+                return v
+        return None
+
+    def status(self, payload: Dict[str, Any]) -> str:
+        raw = self._first(payload, self.status_paths)
+        status = self.status_map.get(str(raw).strip().upper()) if raw is not None else None
+        return status if status in FINAL_STATUSES else "PENDING"
+
+    def apply(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Standard fields (including normalized `status`) extracted from `payload`."""
+        payload = payload or {}
+        out: Dict[str, Any] = {"status": self.status(payload)}
+        for target, paths, coerce, default, valmap in self.fields:
+            v = self._first(payload, paths)
+            if v is None:
+                v = default
+            elif valmap:
+                v = valmap.get(str(v).upper(), v)
+            if v is not None and coerce is not None:
+                try:
+                    v = coerce(v)
+                except Exception:
+                    v = default
+            out[target] = v
+        return out
+
+
+def compile_mapping(response_mapping_json: Optional[str]) -> CompiledMapping:
+    spec = dict(DEFAULT_MAPPING)
+    if response_mapping_json:
+        try:
+            custom = frappe.parse_json(response_mapping_json) or {}
+        except Exception:
+            frappe.log_error(title="AlphaX: invalid response_mapping_json")
+            custom = {}
+        for k, v in custom.items():
+            spec[FIELD_ALIASES.get(k, k)] = v
+    return CompiledMapping(spec)
+
+
+def get_default_mapping() -> CompiledMapping:
+    return _mappings.get("__default__", lambda: compile_mapping(None))
+
+
+def get_mapping(settings_name: Optional[str]) -> CompiledMapping:
+    """Compiled mapping of the profile's bank app config (or the built-in default)."""
+    if not settings_name:
+        return get_default_mapping()
+
+    def _compile():
+        from alphax_card_terminal.profiles import get_profile
+
+        try:
+            bank_app = get_profile(settings_name).bank_app_info
+        except frappe.DoesNotExistError:
+            bank_app = None
+        if not bank_app or not bank_app.get("response_mapping_json"):
+            return get_default_mapping()
+        return compile_mapping(bank_app["response_mapping_json"])
+
+    return _mappings.get(f"settings:{settings_name}", _compile)
+
+
+def card_transaction_fieldnames() -> frozenset:
+    return _mappings.get(
+        "__card_transaction_fields__",
+        lambda: frozenset(frappe.get_meta("AlphaX Card Transaction").get_valid_columns()),
+    )
+
+
+def clear_mapping_cache(doc=None, method=None):
+    _mappings.clear()
@@ -0,0 +1,154 @@
+"""Capture / callback metrics, aggregated across workers in one Redis hash per site.
+
+Histograms and counters are stored as hash fields "<metric>\\t<labels>\\t<suffix>"
+and incremented with a single pipelined round trip per observation; the
+Prometheus text exposition is rendered from the hash on scrape
+(api.get_terminal_metrics). Recording never raises.
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import socket
+from typing import Any, Dict, List, Tuple
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+
+# Upper bounds in seconds; terminal interactions include customer time, hence the long tail.
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+METRICS: Dict[str, Tuple[str, str]] = {
+    "alphax_capture_duration_seconds": ("histogram", "terminal_capture_start duration by driver, profile and outcome."),
+    "alphax_driver_call_duration_seconds": ("histogram", "Driver start_capture duration by driver, profile and outcome."),
+    "alphax_callback_duration_seconds": ("histogram", "Callback ingestion duration by profile and outcome."),
+    "alphax_session_lag_seconds": ("histogram", "Session started_on to completed_on by driver, profile and final status."),
+    "alphax_log_response_duration_seconds": ("histogram", "log_terminal_response duration by outcome."),
+    "alphax_callbacks_rejected_total": ("counter", "Callbacks rejected before ingestion, by reason."),
+    "alphax_session_update_failures_total": ("counter", "Driver results that could not be written to the session."),
+    "alphax_mqtt_messages_total": ("counter", "Messages handled by the MQTT result subscriber, by kind and outcome."),
+    "alphax_mqtt_batch_duration_seconds": ("histogram", "MQTT subscriber micro-batch ingestion duration."),
+    "alphax_http_circuit_rejections_total": ("counter", "Driver HTTP calls failed fast by an open circuit breaker, by endpoint."),
+}
+
+TIMEOUT = "TIMEOUT"
+
+
+def _key() -> str:
+    return frappe.cache().make_key("alphax_card_terminal:metrics")
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    return ",".join(f"{k}={_escape(v)}" for k, v in sorted(labels.items()))
+
+
+def _escape(value: Any) -> str:
+    s = "" if value is None else str(value)
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def outcome_of_exception(exc: BaseException) -> str:
+    """TIMEOUT for connect/read/ack timeouts (any transport), else ERROR."""
+    if isinstance(exc, (TimeoutError, socket.timeout, asyncio.TimeoutError)):
+        return TIMEOUT
+    name = type(exc).__name__.lower()
+    return TIMEOUT if "timeout" in name or "timed out" in str(exc).lower() else "ERROR"
+
+
+def outcome_of_result(res: Dict[str, Any], status: str) -> str:
+    """Metric outcome of a driver result whose normalized session status is `status`."""
+    raw = str((res or {}).get("status") or "").strip().upper()
+    return TIMEOUT if raw in (TIMEOUT, "TIMED_OUT") else status
+
+
+def observe(metric: str, seconds: float, **labels):
+    """Add one observation to histogram `metric`."""
+    lbl = _labels(labels)
+    bucket = next((str(b) for b in BUCKETS if seconds <= b), "+Inf")
+    try:
+        pipe = frappe.cache().pipeline(transaction=False)
+        key = _key()
+        pipe.hincrby(key, f"{metric}\t{lbl}\t{bucket}", 1)
+        pipe.hincrby(key, f"{metric}\t{lbl}\tcount", 1)
+        pipe.hincrbyfloat(key, f"{metric}\t{lbl}\tsum", float(seconds))
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def inc(metric: str, value: int = 1, **labels):
+    try:
+        frappe.cache().pipeline(transaction=False).hincrby(_key(), f"{metric}\t{_labels(labels)}\t", value).execute()
+    except Exception:
+        pass
+
+
+def observe_session_final(ss, status: str, completed_on=None):
+    """Session lag for a session (doc or row with driver/terminal_settings/started_on) turning final."""
+    if not ss.get("started_on"):
+        return
+    lag = (get_datetime(completed_on or now_datetime()) - get_datetime(ss.started_on)).total_seconds()
+    observe(
+        "alphax_session_lag_seconds",
+        max(lag, 0),
+        driver=ss.get("driver"),
+        settings=ss.get("terminal_settings"),
+        status=status,
+    )
+
+
+def _read() -> Dict[str, str]:
+    pipe = frappe.cache().pipeline(transaction=False)
+    pipe.hgetall(_key())
+    raw = pipe.execute()[0] or {}
+    return {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in raw.items()}
+
+
+def render() -> str:
+    """Prometheus text exposition format (0.0.4)."""
+    series: Dict[str, Dict[str, Dict[str, str]]] = {}
+    for field, value in _read().items():
+        try:
+            metric, lbl, suffix = field.split("\t")
+        except ValueError:
+            continue
+        series.setdefault(metric, {}).setdefault(lbl, {})[suffix] = value
+
+    lines: List[str] = []
+    for metric in sorted(series):
+        kind, help_ = METRICS.get(metric, ("untyped", ""))
+        lines.append(f"# HELP {metric} {help_}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for lbl in sorted(series[metric]):
+            values = series[metric][lbl]
+            sep = "," if lbl else ""
+            braces = f"{{{lbl}}}" if lbl else ""
+            if kind != "histogram":
+                lines.append(f"{metric}{braces} {values.get('', 0)}")
+                continue
+            cumulative = 0
+            for b in BUCKETS:
+                cumulative += int(values.get(str(b), 0))
+                lines.append(f'{metric}_bucket{{{lbl}{sep}le="{b}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{lbl}{sep}le="+Inf"}} {values.get("count", 0)}')
+            lines.append(f"{metric}_sum{braces} {values.get('sum', 0)}")
+            lines.append(f"{metric}_count{braces} {values.get('count', 0)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    frappe.cache().delete(_key())
+
+
+def scrape_allowed() -> bool:
+    """Guests may scrape with the site's metrics token or from an allowed IP; users need System Manager."""
+    if frappe.session.user != "Guest":
+        return "System Manager" in frappe.get_roles()
+
+    token = frappe.conf.get("alphax_metrics_token")
+    auth = (frappe.get_request_header("Authorization") or "").strip()
+    if token and hmac.compare_digest(auth, f"Bearer {token}"):
+        return True
+    allowed_ips = frappe.conf.get("alphax_metrics_allowed_ips") or []
+    return bool(allowed_ips) and getattr(frappe.local, "request_ip", None) in allowed_ips
+
@@ -0,0 +1,332 @@
+"""MQTT result subscriber: terminal results and heartbeats without an HTTP round trip per result.
+
+Started with `bench --site all alphax-mqtt-subscriber` (see commands.py) and kept
+running by supervisor. One process serves many sites. Each site gets a
+thread with its own DB connection and one paho client per enabled AlphaX MQTT
+Settings that has "Receive Results over MQTT" checked. paho's network threads
+only enqueue messages. The site thread drains its queue in micro-batches
+(`batch_size` messages or `linger_ms`, whichever comes first):
+
+- result messages go through callbacks.ingest_batch, the same signature check,
+  mapping and set-based writes as the HTTP batch endpoint, then one commit;
+- heartbeats become one presence.record_heartbeats call.
+
+Broker sessions are persistent (clean_session=False, QoS 1, a stable client
+id per site and broker), so results published while the worker is down are
+delivered when it reconnects. With paho-mqtt >= 2 results are acknowledged
+only after their batch is committed; a batch that fails is retried message by
+message, and a message that still fails stays unacknowledged so the broker
+redelivers it (nonces of rolled-back results are given back, see
+callbacks._replay_reason). A message whose results were all refused as
+replays is not acknowledged either: the delivery that holds the nonce may
+still roll back. Ingestion skips sessions that are already final, so
+redelivered messages are harmless.
+"""
+from __future__ import annotations
+
+import hashlib
+import queue
+from functools import partial
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import frappe
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_LINGER_MS = 200
+# Broker settings are re-read this often; changed or new brokers are reconnected.
+RELOAD_SECONDS = 60
+RESULT = "result"
+HEARTBEAT = "heartbeat"
+
+# (kind, topic, payload, ack): ack is None when paho already acknowledged the message
+Message = Tuple[str, str, bytes, Optional[Callable[[], None]]]
+
+
+def result_item(topic: str, payload: bytes) -> List[Dict[str, Any]]:
+    """ingest_batch items of one result message.
+
+    Accepted: the raw callback JSON (uuid from the body or the topic suffix), an
+    envelope {"uuid", "body", "signature", "timestamp"} as for terminal_callback_batch,
+    or a list / {"results": [...]} of envelopes.
+    """
+    text = payload.decode("utf-8") if isinstance(payload, bytes) else payload
+    data = frappe.parse_json(text)
+    if isinstance(data, dict) and isinstance(data.get("results"), list):
+        data = data["results"]
+    if isinstance(data, list):
+        return [item for item in data if isinstance(item, dict)]
+    if not isinstance(data, dict):
+        return []
+    if "body" in data or "signature" in data:
+        return [data]
+    return [{"uuid": data.get("uuid") or topic.rsplit("/", 1)[-1], "body": text}]
+
+
+def _topic(topic: str, shared_group: Optional[str]) -> str:
+    return f"$share/{shared_group}/{topic}" if shared_group else topic
+
+
+class BrokerClient:
+    """One paho client for one AlphaX MQTT Settings of one site; messages go to `inbox`."""
+
+    def __init__(self, site: str, settings: Dict[str, Any], inbox: queue.Queue, shared_group: Optional[str] = None):
+        import paho.mqtt.client as mqtt  # type: ignore
+
+        self.name = settings["name"]
+        self.modified = settings["modified"]
+        self.result_topic = settings.get("result_topic") or "alphax/result/#"
+        self.heartbeat_topic = settings.get("heartbeat_topic") or "alphax/heartbeat/#"
+        self.result_prefix = self.result_topic.rstrip("#").rstrip("/")
+        self.shared_group = shared_group
+        self.qos = int(settings.get("default_qos") if settings.get("default_qos") is not None else 1)
+        self.inbox = inbox
+
+        client_id = "alphax-sub-" + hashlib.sha1(f"{site}:{self.name}".encode()).hexdigest()[:16]
+        kwargs = {"client_id": client_id, "clean_session": False}
+        if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt >= 2.0
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, **kwargs)
+        else:
+            client = mqtt.Client(**kwargs)
+        if settings.get("username"):
+            client.username_pw_set(settings["username"], settings.get("password"))
+        if settings.get("use_ssl"):
+            client.tls_set()
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        # paho-mqtt >= 2: PUBACK only once the result is committed (see process_batch)
+        self.manual_ack = hasattr(client, "manual_ack_set")
+        if self.manual_ack:
+            client.manual_ack_set(True)
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        self.client = client
+        client.connect_async(settings["broker_host"], int(settings.get("broker_port") or 1883), int(settings.get("keepalive") or 60))
+        client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        if rc == 0:
+            client.subscribe(
+                [(_topic(self.result_topic, self.shared_group), self.qos), (_topic(self.heartbeat_topic, self.shared_group), 0)]
+            )
+
+    def _on_message(self, client, userdata, msg):
+        kind = RESULT if msg.topic == self.result_prefix or msg.topic.startswith(self.result_prefix + "/") else HEARTBEAT
+        ack = partial(self._ack, msg.mid, msg.qos) if self.manual_ack and msg.qos else None
+        self.inbox.put((kind, msg.topic, msg.payload, ack))
+
+    def _ack(self, mid: int, qos: int):
+        try:
+            self.client.ack(mid, qos)
+        except Exception:
+            pass  # connection gone: the broker redelivers the message to the persistent session
+
+    def close(self):
+        try:
+            self.client.loop_stop()
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+def _broker_settings() -> Dict[str, Dict[str, Any]]:
+    rows = frappe.get_all(
+        "AlphaX MQTT Settings",
+        filters={"enabled": 1, "subscribe_results": 1},
+        fields=[
+            "name",
+            "modified",
+            "broker_host",
+            "broker_port",
+            "use_ssl",
+            "username",
+            "keepalive",
+            "default_qos",
+            "result_topic",
+            "heartbeat_topic",
+        ],
+    )
+    for r in rows:
+        if r.username:
+            r.password = frappe.get_doc("AlphaX MQTT Settings", r.name).get_password("password", raise_exception=False)
+    return {r.name: r for r in rows if r.broker_host}
+
+
+class SiteWorker(threading.Thread):
+    """Connections, subscriptions and micro-batched ingestion for one site."""
+
+    def __init__(self, site: str, stop: threading.Event, batch_size: int, linger_ms: int, shared_group: Optional[str]):
+        super().__init__(name=f"alphax-mqtt:{site}", daemon=True)
+        self.site = site
+        self.stop = stop
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000.0
+        self.shared_group = shared_group
+        self.inbox: queue.Queue = queue.Queue()
+        self.clients: Dict[str, BrokerClient] = {}
+        self.idle = False  # app not installed on this site
+
+    def run(self):
+        frappe.init(site=self.site)
+        try:
+            frappe.connect()
+            if "alphax_card_terminal" not in frappe.get_installed_apps():
+                self.idle = True
+                return
+            self._loop()
+        finally:
+            self._close_clients()
+            frappe.destroy()
+
+    def _close_clients(self):
+        for c in self.clients.values():
+            c.close()
+        self.clients = {}
+
+    def _sync_clients(self):
+        wanted = _broker_settings()
+        frappe.db.commit()  # end the read snapshot
+        for name in list(self.clients):
+            if name not in wanted or str(wanted[name].modified) != str(self.clients[name].modified):
+                self.clients.pop(name).close()
+        for name, settings in wanted.items():
+            if name not in self.clients:
+                self.clients[name] = BrokerClient(self.site, settings, self.inbox, self.shared_group)
+
+    def _next_batch(self) -> List[Message]:
+        try:
+            batch = [self.inbox.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.inbox.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        reload_at = 0.0
+        while not self.stop.is_set() or not self.inbox.empty():
+            if self.stop.is_set():
+                self._close_clients()  # stop receiving, drain what was received
+            elif time.monotonic() >= reload_at:
+                try:
+                    self._sync_clients()
+                except Exception:
+                    frappe.log_error(title="AlphaX: MQTT subscriber could not load brokers")
+                    frappe.db.rollback()
+                reload_at = time.monotonic() + RELOAD_SECONDS
+            batch = self._next_batch()
+            if batch:
+                process_batch(batch)
+
+
+def _acknowledge(ack: Optional[Callable[[], None]]):
+    if ack:
+        ack()
+
+
+def _ingest(messages: List[Tuple[List[Dict[str, Any]], Optional[Callable[[], None]]]]) -> Tuple[int, int, int]:
+    """(ok, rejected, failed) result counts; a message is acknowledged once its results are committed.
+
+    Messages whose results were all refused as replays stay unacknowledged (counted as rejected).
+    """
+    from alphax_card_terminal.callbacks import ingest_batch
+
+    try:
+        outcomes = ingest_batch([item for items, _ in messages for item in items])
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        if len(messages) == 1:
+            frappe.log_error(title="AlphaX: MQTT result message failed (left for redelivery)")
+            return 0, 0, len(messages[0][0])
+        # One bad message must not hold back the others: retry each on its own.
+        totals = [0, 0, 0]
+        for message in messages:
+            for i, n in enumerate(_ingest([message])):
+                totals[i] += n
+        return totals[0], totals[1], totals[2]
+    position = 0
+    for items, ack in messages:
+        mine = outcomes[position : position + len(items)]
+        position += len(items)
+        if not all(o.get("reason") == "replay" for o in mine):
+            _acknowledge(ack)
+    ok = sum(1 for o in outcomes if o.get("ok"))
+    return ok, len(outcomes) - ok, 0
+
+
+def process_batch(batch: List[Message]) -> Dict[str, int]:
+    """Ingest one micro-batch for the current site: results in one ingest_batch + commit, heartbeats in one ZADD."""
+    from alphax_card_terminal import metrics
+    from alphax_card_terminal.presence import mqtt_heartbeat_codes, record_heartbeats
+
+    messages = []
+    codes: List[str] = []
+    for kind, topic, payload, ack in batch:
+        if kind == HEARTBEAT:
+            codes += mqtt_heartbeat_codes(topic, payload)
+            _acknowledge(ack)
+            continue
+        try:
+            items = result_item(topic, payload)
+        except Exception:
+            items = None
+            metrics.inc("alphax_mqtt_messages_total", kind=RESULT, outcome="invalid")
+        if items:
+            messages.append((items, ack))
+        else:
+            _acknowledge(ack)  # redelivery cannot make it valid
+
+    if codes:
+        try:
+            record_heartbeats(codes)
+        except Exception:
+            frappe.log_error(title="AlphaX: MQTT heartbeats not recorded")
+        metrics.inc("alphax_mqtt_messages_total", len(codes), kind=HEARTBEAT, outcome="ok")
+
+    if not messages:
+        return {"results": 0, "heartbeats": len(codes)}
+
+    started = time.perf_counter()
+    ok, rejected, failed = _ingest(messages)
+    for outcome, n in (("ok", ok), ("rejected", rejected), ("error", failed)):
+        if n:
+            metrics.inc("alphax_mqtt_messages_total", n, kind=RESULT, outcome=outcome)
+    metrics.observe("alphax_mqtt_batch_duration_seconds", time.perf_counter() - started)
+    return {"results": ok, "heartbeats": len(codes)}
+
+
+def run(sites: List[str], batch_size: int = DEFAULT_BATCH_SIZE, linger_ms: int = DEFAULT_LINGER_MS, shared_group: Optional[str] = None):
+    """Serve `sites` until SIGTERM / SIGINT; a site thread that dies is restarted with backoff."""
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *a: stop.set())
+
+    def start(site):
+        w = SiteWorker(site, stop, batch_size, linger_ms, shared_group)
+        w.start()
+        return w
+
+    workers = {site: start(site) for site in sites}
+    backoff = {site: 1.0 for site in sites}
+    restart_at: Dict[str, float] = {}
+    while not stop.is_set():
+        stop.wait(1.0)
+        for site, w in workers.items():
+            if w.is_alive() or w.idle or stop.is_set():
+                continue
+            if site not in restart_at:
+                restart_at[site] = time.monotonic() + backoff[site]
+                backoff[site] = min(backoff[site] * 2, 60.0)
+            elif time.monotonic() >= restart_at.pop(site):
+                workers[site] = start(site)
+    for w in workers.values():
+        w.join(timeout=10)
@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+    # Sales Invoice before_submit approval check
+    frappe.db.add_index(
+        "AlphaX Card Transaction",
+        ["reference_doctype", "reference_name", "mode_of_payment", "status"],
+        index_name="reference_mop_status_index",
+    )
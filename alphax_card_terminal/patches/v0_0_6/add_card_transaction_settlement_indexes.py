@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+    # Settlement reconciliation: exact and fuzzy lookups, per-run claims, missing-in-settlement scan
+    frappe.db.add_index("AlphaX Card Transaction", ["rrn", "terminal_id"], index_name="rrn_terminal_index")
+    frappe.db.add_index("AlphaX Card Transaction", ["terminal_id", "auth_code"], index_name="terminal_auth_code_index")
+    frappe.db.add_index("AlphaX Card Transaction", ["terminal_id", "trace_no"], index_name="terminal_trace_index")
+    frappe.db.add_index("AlphaX Card Transaction", ["settlement_reconciliation"])
+    frappe.db.add_index("AlphaX Card Transaction", ["status", "creation"], index_name="status_creation_index")
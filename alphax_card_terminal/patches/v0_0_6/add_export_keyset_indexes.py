@@ -0,0 +1,7 @@
+import frappe
+
+
+def execute():
+    # Keyset-paginated export over (creation, name)
+    for doctype in ("AlphaX Card Transaction", "AlphaX Terminal Session"):
+        frappe.db.add_index(doctype, ["creation", "name"], index_name="creation_name_index")
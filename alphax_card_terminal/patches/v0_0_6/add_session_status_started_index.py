@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    # Session reaper: PENDING sessions ordered by age
+    frappe.db.add_index("AlphaX Terminal Session", ["status", "started_on"], index_name="status_started_on_index")
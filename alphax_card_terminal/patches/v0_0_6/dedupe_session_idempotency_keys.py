@@ -0,0 +1,32 @@
+import frappe
+
+
+def execute():
+    """Make idempotency_key safe for the new unique index.
+
+    Blank keys become NULL; for duplicated keys only the oldest session keeps it.
+    """
+    if not frappe.db.table_exists("AlphaX Terminal Session"):
+        return
+
+    frappe.db.sql("update `tabAlphaX Terminal Session` set idempotency_key = NULL where idempotency_key = ''")
+
+    duplicates = frappe.db.sql(
+        """
+        select idempotency_key from `tabAlphaX Terminal Session`
+        where idempotency_key is not null
+        group by idempotency_key having count(*) > 1
+        """,
+        pluck=True,
+    )
+    for key in duplicates:
+        names = frappe.get_all(
+            "AlphaX Terminal Session",
+            filters={"idempotency_key": key},
+            order_by="creation asc",
+            pluck="name",
+        )
+        frappe.db.sql(
+            "update `tabAlphaX Terminal Session` set idempotency_key = NULL where name in %(names)s",
+            {"names": names[1:]},
+        )
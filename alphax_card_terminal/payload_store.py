@@ -0,0 +1,242 @@
+"""Compressed, deduplicated storage for terminal request/response payloads.
+
+Payloads are canonical JSON (frappe.as_json), stored once per content in
+AlphaX Payload Blob (name = sha256, zlib + base64 when that is smaller) and
+referenced from AlphaX Terminal Session.request_blob / response_blob and
+AlphaX Card Transaction.raw_response_blob. A callback's session response and
+card transaction raw response are the same blob.
+
+A daily job moves blobs older than `alphax_payload_archive_days` (site config,
+default 90) into append-only archive files under private/alphax_payload_archive;
+they stay readable through get_text(). The same job moves payloads still held
+inline in the old Long Text columns into blobs, a chunk at a time.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import zlib
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+BLOB_DOCTYPE = "AlphaX Payload Blob"
+ARCHIVE_DIR = "alphax_payload_archive"
+DEFAULT_ARCHIVE_DAYS = 90
+CHUNK_SIZE = 500
+# archive_offset / archive_length are Int (signed 32-bit) columns: roll to a new part file well before 2 GiB
+ARCHIVE_MAX_BYTES = 1 << 30
+
+# Inline Long Text column -> blob link column, per doctype
+INLINE_COLUMNS = {
+    "AlphaX Terminal Session": (("request_payload", "request_blob"), ("response_payload", "response_blob")),
+    "AlphaX Card Transaction": (("raw_response", "raw_response_blob"),),
+}
+
+_EMPTY = ("", "{}", "null", "[]")
+
+
+def to_text(payload: Any) -> Optional[str]:
+    if payload is None:
+        return None
+    text = payload if isinstance(payload, str) else frappe.as_json(payload)
+    return None if text.strip() in _EMPTY else text
+
+
+def _encode(text: str) -> Tuple[str, str, str, int, int]:
+    """(sha256, codec, data, size, stored_size) for JSON text."""
+    raw = text.encode("utf-8")
+    sha = hashlib.sha256(raw).hexdigest()
+    packed = zlib.compress(raw, 6)
+    if len(packed) * 4 // 3 < len(raw):
+        data = base64.b64encode(packed).decode("ascii")
+        return sha, "zlib", data, len(raw), len(data)
+    return sha, "raw", text, len(raw), len(raw)
+
+
+def put_many(payloads: Iterable[Any]) -> List[Optional[str]]:
+    """Store payloads (dicts or JSON text) with one INSERT IGNORE; returns their blob names (None for empty)."""
+    names: List[Optional[str]] = []
+    rows: Dict[str, list] = {}
+    now = now_datetime()
+    user = frappe.session.user
+    for payload in payloads:
+        text = to_text(payload)
+        if text is None:
+            names.append(None)
+            continue
+        sha, codec, data, size, stored = _encode(text)
+        names.append(sha)
+        rows.setdefault(sha, [sha, now, now, user, user, 0, codec, size, stored, data, 0])
+    if rows:
+        frappe.db.bulk_insert(
+            BLOB_DOCTYPE,
+            ["name", "creation", "modified", "owner", "modified_by", "docstatus", "codec", "size", "stored_size", "data", "archived"],
+            list(rows.values()),
+            ignore_duplicates=True,
+        )
+    return names
+
+
+def put(payload: Any) -> Optional[str]:
+    return put_many([payload])[0]
+
+
+def _decode(codec: str, data: bytes | str) -> str:
+    if codec == "zlib":
+        packed = base64.b64decode(data) if isinstance(data, str) else data
+        return zlib.decompress(packed).decode("utf-8")
+    return data.decode("utf-8") if isinstance(data, bytes) else data
+
+
+def _archive_path(filename: str) -> str:
+    return frappe.get_site_path("private", ARCHIVE_DIR, filename)
+
+
+def _archive_part(month: str, needed: int) -> str:
+    """First "<YYYYMM>-<part>.zpack" of the month that still has room for `needed` bytes."""
+    part = 0
+    while True:
+        filename = f"{month}-{part:03d}.zpack"
+        path = _archive_path(filename)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if not size or size + needed <= ARCHIVE_MAX_BYTES:
+            return filename
+        part += 1
+
+
+def get_text(name: Optional[str]) -> Optional[str]:
+    """JSON text of a blob, from the table or its archive file."""
+    if not name:
+        return None
+    row = frappe.db.get_value(
+        BLOB_DOCTYPE, name, ["codec", "data", "archived", "archive_file", "archive_offset", "archive_length"], as_dict=True
+    )
+    if not row:
+        return None
+    if not cint(row.archived):
+        return _decode(row.codec, row.data or "")
+    with open(_archive_path(row.archive_file), "rb") as f:
+        f.seek(cint(row.archive_offset))
+        return _decode(row.codec, f.read(cint(row.archive_length)))
+
+
+def get_texts(names: Iterable[Optional[str]]) -> Dict[str, str]:
+    """blob name -> JSON text for many blobs; one query (archived blobs are read from their files)."""
+    names = list({n for n in names if n})
+    if not names:
+        return {}
+    texts = {}
+    for row in frappe.get_all(
+        BLOB_DOCTYPE, filters={"name": ["in", names]}, fields=["name", "codec", "data", "archived"]
+    ):
+        texts[row.name] = get_text(row.name) if cint(row.archived) else _decode(row.codec, row.data or "")
+    return texts
+
+
+def load(inline: Optional[str], blob: Optional[str]) -> Any:
+    """Parsed payload of a row that has either the old inline column or a blob link."""
+    text = inline or get_text(blob)
+    return frappe.parse_json(text) if text else {}
+
+
+def load_text(inline: Optional[str], blob: Optional[str]) -> Optional[str]:
+    return inline or get_text(blob)
+
+
+# -----------------------------------------------------------------------------
+# Maintenance (daily)
+# -----------------------------------------------------------------------------
+def compact_inline_payloads(chunk_size: int = CHUNK_SIZE, max_chunks: int = 20) -> int:
+    """Move payloads still stored in the Long Text columns into blobs (oldest rows first)."""
+    moved = 0
+    for doctype, columns in INLINE_COLUMNS.items():
+        for inline, blob in columns:
+            for _ in range(max_chunks):
+                rows = frappe.get_all(
+                    doctype,
+                    filters={inline: ["is", "set"]},
+                    fields=["name", inline],
+                    order_by="creation asc",
+                    limit=chunk_size,
+                )
+                if not rows:
+                    break
+                names = put_many(r.get(inline) for r in rows)
+                table = frappe.qb.DocType(doctype)
+                for row, blob_name in zip(rows, names):
+                    frappe.qb.update(table).set(table[blob], blob_name).set(table[inline], None).where(
+                        table.name == row.name
+                    ).run()
+                frappe.db.commit()
+                moved += len(rows)
+    return moved
+
+
+def archive_old_payloads(chunk_size: int = CHUNK_SIZE, max_chunks: int = 50) -> int:
+    """Append blobs older than the configured age to this month's archive files and drop their data."""
+    days = cint(frappe.conf.get("alphax_payload_archive_days") or DEFAULT_ARCHIVE_DAYS)
+    if days <= 0:
+        return 0
+    cutoff = now_datetime() - timedelta(days=days)
+    month = f"{now_datetime():%Y%m}"
+    os.makedirs(os.path.dirname(_archive_path(month)), exist_ok=True)
+
+    archived = 0
+    Blob = frappe.qb.DocType(BLOB_DOCTYPE)
+    for _ in range(max_chunks):
+        rows = frappe.get_all(
+            BLOB_DOCTYPE,
+            filters={"archived": 0, "creation": ["<", cutoff]},
+            fields=["name", "codec", "data"],
+            order_by="creation asc",
+            limit=chunk_size,
+        )
+        if not rows:
+            break
+
+        placed = []
+        files = []
+        f = None
+        try:
+            for r in rows:
+                chunk = base64.b64decode(r.data or "") if r.codec == "zlib" else (r.data or "").encode("utf-8")
+                if f is None or (f.tell() and f.tell() + len(chunk) > ARCHIVE_MAX_BYTES):
+                    if f is not None:
+                        f.flush()
+                    filename = _archive_part(month, len(chunk))
+                    f = open(_archive_path(filename), "ab")
+                    files.append(f)
+                offset = f.tell()
+                f.write(chunk)
+                placed.append((r.name, filename, offset, len(chunk)))
+            for f in files:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in files:
+                f.close()
+
+        # Files are durable before the data column is cleared.
+        for name, filename, offset, length in placed:
+            (
+                frappe.qb.update(Blob)
+                .set(Blob.archived, 1)
+                .set(Blob.archive_file, filename)
+                .set(Blob.archive_offset, offset)
+                .set(Blob.archive_length, length)
+                .set(Blob.data, None)
+                .where(Blob.name == name)
+            ).run()
+        frappe.db.commit()
+        archived += len(placed)
+    return archived
+
+
+def run_maintenance():
+    """Scheduler job (daily)."""
+    compact_inline_payloads()
+    archive_old_payloads()
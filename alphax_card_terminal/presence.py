@@ -0,0 +1,222 @@
+"""Live device presence from agent heartbeats.
+
+Heartbeats (HTTP: api.terminal_heartbeat, MQTT: handle_mqtt_message) only
+touch Redis: one ZADD of device -> unix time into a per-site sorted set.
+flush_presence (scheduler, every minute) writes last_seen / status of
+AlphaX Terminal Device in one UPDATE for the devices that changed.
+
+A device is OFFLINE once its last heartbeat is older than
+`alphax_device_offline_after_seconds` (site config, default 30). Devices that
+never sent a heartbeat (no agent, or Redis was flushed) are UNKNOWN and are
+not blocked.
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import frappe
+from frappe.query_builder import Case
+from frappe.utils import cint, convert_utc_to_system_timezone
+
+from alphax_card_terminal.cache import WorkerCache
+
+ONLINE = "ONLINE"
+OFFLINE = "OFFLINE"
+UNKNOWN = "UNKNOWN"
+
+DEFAULT_OFFLINE_AFTER_SECONDS = 30
+# Presence entries older than this are dropped from Redis by the flush job.
+FORGET_AFTER_SECONDS = 7 * 24 * 3600
+
+_devices = WorkerCache("terminal_devices")
+
+
+def _key() -> str:
+    return frappe.cache().make_key("alphax_card_terminal:presence")
+
+
+def offline_after() -> int:
+    return cint(frappe.conf.get("alphax_device_offline_after_seconds") or DEFAULT_OFFLINE_AFTER_SECONDS)
+
+
+def _device_names() -> Dict[str, str]:
+    """device_code (and name) -> AlphaX Terminal Device name, enabled devices only."""
+    names: Dict[str, str] = {}
+    for d in frappe.get_all("AlphaX Terminal Device", filters={"enabled": 1}, fields=["name", "device_code"]):
+        names[d.name] = d.name
+        if d.device_code:
+            names[d.device_code] = d.name
+    return names
+
+
+def resolve_device(code: Optional[str]) -> Optional[str]:
+    return _devices.get("codes", _device_names).get(code) if code else None
+
+
+def clear_device_cache(doc=None, method=None):
+    _devices.clear()
+
+
+def record_heartbeats(codes: Iterable[str], at: Optional[float] = None) -> int:
+    """Mark devices (by device_code or name) as seen now; one Redis round trip. Returns the number accepted."""
+    at = at or time.time()
+    seen = {name: at for name in (resolve_device(c) for c in codes) if name}
+    if seen:
+        frappe.cache().pipeline(transaction=False).zadd(_key(), seen).execute()
+    return len(seen)
+
+
+def _last_seen(device: str) -> Optional[float]:
+    pipe = frappe.cache().pipeline(transaction=False)
+    pipe.zscore(_key(), device)
+    return pipe.execute()[0]
+
+
+def device_state(device: Optional[str]) -> Tuple[str, Optional[float]]:
+    """(ONLINE|OFFLINE|UNKNOWN, last heartbeat unix time) of a device."""
+    if not device:
+        return UNKNOWN, None
+    try:
+        seen = _last_seen(device)
+    except Exception:
+        return UNKNOWN, None  # Redis down: never block captures on presence
+    if seen is None:
+        return UNKNOWN, None
+    return (ONLINE if time.time() - seen <= offline_after() else OFFLINE), seen
+
+
+def route(profile) -> Tuple[Optional[Any], Optional[str]]:
+    """Profile to capture with: `profile` unless its device is offline, else the first usable
+    profile from config_json `fallback_settings`. Returns (profile, None) or (None, reason)."""
+    from alphax_card_terminal.profiles import get_profile
+
+    device = getattr(profile, "device", None)
+    state, seen = device_state(device)
+    if state != OFFLINE:
+        return profile, None
+
+    for name in profile.config.get("fallback_settings") or []:
+        try:
+            alt = get_profile(name)
+        except frappe.DoesNotExistError:
+            continue
+        if cint(alt.get("enabled", 1)) and device_state(alt.get("device"))[0] != OFFLINE:
+            return alt, None
+
+    ago = int(time.time() - seen)
+    return None, f"Terminal device {device} is offline (last heartbeat {ago}s ago)."
+
+
+def _to_system_time(ts: float) -> datetime:
+    return convert_utc_to_system_timezone(datetime.fromtimestamp(ts, timezone.utc)).replace(tzinfo=None)
+
+
+def flush_presence():
+    """Scheduler job: persist last_seen / status for devices whose presence changed."""
+    pipe = frappe.cache().pipeline(transaction=False)
+    pipe.zremrangebyscore(_key(), "-inf", time.time() - FORGET_AFTER_SECONDS)
+    pipe.zrange(_key(), 0, -1, withscores=True)
+    scores = {(k.decode() if isinstance(k, bytes) else k): v for k, v in pipe.execute()[1]}
+
+    now = time.time()
+    limit = offline_after()
+    updates: Dict[str, Tuple[datetime, str]] = {}
+    if scores:
+        current = {
+            d.name: d
+            for d in frappe.get_all(
+                "AlphaX Terminal Device",
+                filters={"name": ["in", list(scores)]},
+                fields=["name", "status", "last_seen"],
+            )
+        }
+        for name, seen in scores.items():
+            row = current.get(name)
+            if not row:
+                continue
+            status = ONLINE if now - seen <= limit else OFFLINE
+            last_seen = _to_system_time(seen)
+            if row.status != status or not row.last_seen or abs((last_seen - row.last_seen).total_seconds()) >= 1:
+                updates[name] = (last_seen, status)
+
+    Device = frappe.qb.DocType("AlphaX Terminal Device")
+    if updates:
+        seen_case, status_case = Case(), Case()
+        for name, (last_seen, status) in updates.items():
+            seen_case = seen_case.when(Device.name == name, last_seen)
+            status_case = status_case.when(Device.name == name, status)
+        (
+            frappe.qb.update(Device)
+            .set(Device.last_seen, seen_case)
+            .set(Device.status, status_case)
+            .where(Device.name.isin(list(updates)))
+        ).run()
+
+    # Devices marked ONLINE whose heartbeats are gone from Redis
+    cutoff = _to_system_time(now - limit)
+    (
+        frappe.qb.update(Device)
+        .set(Device.status, OFFLINE)
+        .where(Device.status == ONLINE)
+        .where(Device.last_seen < cutoff)
+    ).run()
+    frappe.db.commit()
+
+
+def parse_heartbeats(data: Any) -> Iterable[str]:
+    """Device codes from {"device": ...}, {"heartbeats": [{"device": ...}, ...]} or a list of those."""
+    if isinstance(data, dict) and "heartbeats" in data:
+        data = data["heartbeats"]
+    items = data if isinstance(data, list) else [data]
+    for item in items:
+        if isinstance(item, dict):
+            code = item.get("device") or item.get("device_code")
+        else:
+            code = item
+        if code:
+            yield str(code)
+
+
+def mqtt_heartbeat_codes(topic: str, payload: bytes) -> List[str]:
+    """Device codes of an MQTT heartbeat: a JSON body as for HTTP, or any payload on topic `<prefix>/<device_code>`."""
+    codes = []
+    try:
+        data = frappe.parse_json(payload.decode("utf-8")) if payload else None
+    except Exception:
+        data = None
+    if isinstance(data, (dict, list)):
+        codes = list(parse_heartbeats(data))
+    return codes or [topic.rsplit("/", 1)[-1]]
+
+
+def handle_mqtt_message(topic: str, payload: bytes) -> int:
+    return record_heartbeats(mqtt_heartbeat_codes(topic, payload))
+
+
+def listen_mqtt_heartbeats(mqtt_settings: str, topic: str = "alphax/heartbeat/#"):
+    """Blocking MQTT heartbeat listener for one site:
+
+    bench --site <site> execute alphax_card_terminal.presence.listen_mqtt_heartbeats --kwargs "{'mqtt_settings': 'Main Broker'}"
+    """
+    import paho.mqtt.client as mqtt  # type: ignore
+
+    ms = frappe.get_doc("AlphaX MQTT Settings", mqtt_settings)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1) if hasattr(mqtt, "CallbackAPIVersion") else mqtt.Client()
+    if ms.username:
+        client.username_pw_set(ms.username, ms.get_password("password", raise_exception=False))
+    if ms.use_ssl:
+        client.tls_set()
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    client.on_connect = lambda c, u, f, rc, *a: c.subscribe(topic, qos=0) if rc == 0 else None
+
+    def on_message(c, u, msg):
+        try:
+            handle_mqtt_message(msg.topic, msg.payload)
+        except Exception:
+            frappe.log_error(title="AlphaX: MQTT heartbeat failed")
+
+    client.on_message = on_message
+    client.connect(ms.broker_host, int(ms.broker_port or 1883), int(ms.keepalive or 60))
+    client.loop_forever(retry_first_connection=True)
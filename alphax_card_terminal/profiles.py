@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
+
+import frappe
+
+from alphax_card_terminal.cache import WorkerCache
+
+# Explicit settings fields merged into the driver config (config_json overrides them).
+CONFIG_FIELDS = [
+    "endpoint_url",
+    "terminal_ip",
+    "terminal_port",
+    "timeout_seconds",
+    "merchant_id",
+    "terminal_id",
+    "provider",
+]
+
+_profiles = WorkerCache("terminal_profiles")
+
+
+class TerminalProfile:
+    """Immutable, precompiled view of an AlphaX Payment Terminal Settings record.
+
+    Behaves like the settings doc for attribute reads (drivers and api use
+    getattr(settings, ...)), and carries the merged driver config plus the
+    linked device / brand / bank app / MQTT records, so a capture needs no
+    further queries or JSON parsing.
+    """
+
+    __slots__ = ("_fields", "config", "device_info", "brand_info", "bank_app_info", "mqtt_info")
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        config: Dict[str, Any],
+        device_info: Optional[Dict[str, Any]] = None,
+        brand_info: Optional[Dict[str, Any]] = None,
+        bank_app_info: Optional[Dict[str, Any]] = None,
+        mqtt_info: Optional[Dict[str, Any]] = None,
+    ):
+        set_ = object.__setattr__
+        set_(self, "_fields", MappingProxyType(dict(fields)))
+        set_(self, "config", MappingProxyType(dict(config)))
+        set_(self, "device_info", _frozen(device_info))
+        set_(self, "brand_info", _frozen(brand_info))
+        set_(self, "bank_app_info", _frozen(bank_app_info))
+        set_(self, "mqtt_info", _frozen(mqtt_info))
+
+    def __getattr__(self, key: str) -> Any:
+        try:
+            return self._fields[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key: str, value: Any):
+        raise AttributeError("TerminalProfile is read-only")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._fields.get(key, default)
+
+    def __repr__(self):
+        return f"<TerminalProfile {self._fields.get('name')}>"
+
+
+def _frozen(d: Optional[Dict[str, Any]]) -> Optional[Mapping[str, Any]]:
+    return MappingProxyType(dict(d)) if d else None
+
+
+def _linked(doctype: str, name: Optional[str], fields) -> Optional[Dict[str, Any]]:
+    if not name:
+        return None
+    return frappe.db.get_value(doctype, name, fields, as_dict=True)
+
+
+def compile_profile(settings_name: str) -> TerminalProfile:
+    doc = frappe.get_doc("AlphaX Payment Terminal Settings", settings_name)
+    fields = doc.as_dict(no_default_fields=True)
+    fields["name"] = doc.name
+    fields["modified"] = doc.modified
+
+    cfg: Dict[str, Any] = {}
+    for k in CONFIG_FIELDS:
+        v = fields.get(k)
+        if v not in (None, ""):
+            cfg[k] = v
+    try:
+        if doc.get("config_json"):
+            cfg.update(frappe.parse_json(doc.config_json))
+    except Exception:
+        pass
+
+    device = _linked(
+        "AlphaX Terminal Device",
+        doc.get("device"),
+        ["name", "enabled", "company", "branch", "device_code", "display_name", "mqtt_settings"],
+    )
+    brand = _linked("AlphaX Terminal Brand", doc.get("brand"), ["name", "brand_code", "brand_name", "default_bank_app_config"])
+    bank_app_name = doc.get("bank_app_config") or (brand or {}).get("default_bank_app_config")
+    bank_app = _linked(
+        "AlphaX Bank App Config",
+        bank_app_name,
+        ["name", "config_code", "package_name", "intent_action_sale", "intent_action_refund", "extras_json", "response_mapping_json"],
+    )
+
+    mqtt = None
+    mqtt_name = cfg.get("mqtt_settings") or (device or {}).get("mqtt_settings")
+    if mqtt_name:
+        ms = frappe.get_doc("AlphaX MQTT Settings", mqtt_name)
+        mqtt = {
+            "name": ms.name,
+            "modified": str(ms.modified),
+            "enabled": ms.enabled,
+            "broker_host": ms.broker_host,
+            "broker_port": ms.broker_port,
+            "use_ssl": ms.use_ssl,
+            "username": ms.username,
+            "password": ms.get_password("password", raise_exception=False) if ms.username else None,
+            "default_qos": ms.default_qos,
+            "keepalive": ms.keepalive,
+            "timeout_seconds": ms.timeout_seconds,
+        }
+
+    return TerminalProfile(fields, cfg, device, brand, bank_app, mqtt)
+
+
+def get_profile(settings_name: str) -> TerminalProfile:
+    """Compiled profile for a settings name (per-worker cache, invalidated on modify)."""
+    return _profiles.get(f"settings:{settings_name}", lambda: compile_profile(settings_name))
+
+
+def get_profile_for_mop(mode_of_payment: str) -> Optional[TerminalProfile]:
+    # Mode of Payment custom fields (fixtures)
+    settings_name = _profiles.get(
+        f"mop:{mode_of_payment}",
+        lambda: frappe.db.get_value("Mode of Payment", mode_of_payment, "act_terminal_settings"),
+    )
+    return get_profile(settings_name) if settings_name else None
+
+
+def _load_callback_keys() -> Dict[str, Dict[str, Any]]:
+    keys: Dict[str, Dict[str, Any]] = {}
+    for r in frappe.get_all("AlphaX Payment Terminal Settings", fields=["name", "config_json"]):
+        try:
+            cfg = frappe.parse_json(r.config_json or "{}")
+        except Exception:
+            cfg = {}
+        keys[r.name] = frappe._dict(
+            secret=cfg.get("callback_secret"),
+            tolerance_seconds=cfg.get("callback_tolerance_seconds"),
+            buffered_tolerance_seconds=cfg.get("callback_buffered_tolerance_seconds"),
+            require_timestamp=cfg.get("require_callback_timestamp"),
+        )
+    return keys
+
+
+def get_callback_key(settings_name: Optional[str]) -> Dict[str, Any]:
+    """Callback verification settings from a per-worker table of all profiles (one query to build)."""
+    if not settings_name:
+        return frappe._dict()
+    return _profiles.get("callback_keys", _load_callback_keys).get(settings_name) or frappe._dict()
+
+
+def get_callback_secret(settings_name: Optional[str]) -> Optional[str]:
+    return get_callback_key(settings_name).get("secret")
+
+
+def _load_pools() -> Dict[tuple, List[str]]:
+    pools: Dict[tuple, List[str]] = {}
+    for r in frappe.get_all(
+        "AlphaX Payment Terminal Settings",
+        filters={"enabled": 1, "use_device_pool": 1},
+        fields=["name", "company", "branch", "driver"],
+        order_by="name asc",
+    ):
+        pools.setdefault((r.company, r.branch, r.driver), []).append(r.name)
+    return pools
+
+
+def get_pool_members(profile) -> List[str]:
+    """Enabled pooled profiles (one per device) sharing the profile's company, branch and driver."""
+    key = (profile.get("company"), profile.get("branch"), profile.get("driver"))
+    return _profiles.get("device_pools", _load_pools).get(key) or [profile.name]
+
+
+def clear_profile_cache(doc=None, method=None):
+    """doc_events hook for every doctype a profile is compiled from."""
+    _profiles.clear()
@@ -0,0 +1,141 @@
+"""Expire PENDING terminal sessions whose device never answered.
+
+Runs every minute from the scheduler. A session expires once it is older than
+its profile's `timeout_seconds` (default 45) plus a grace period
+(`alphax_session_expiry_grace_seconds` in site config, default 60). Stale rows
+are found through the (status, started_on) index with keyset pagination and
+expired with one guarded UPDATE per chunk, committed chunk by chunk.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Any, Dict, List, Tuple
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from alphax_card_terminal import metrics, payload_store
+from alphax_card_terminal.session_events import EXPIRED, notify_session_final
+
+DEFAULT_TIMEOUT_SECONDS = 45
+DEFAULT_GRACE_SECONDS = 60
+CHUNK_SIZE = 500
+
+EXPIRY_MESSAGE = "No result from the terminal before the timeout."
+
+_FIELDS = ["name", "uuid", "terminal_settings", "driver", "started_on", "created_by_user"]
+
+
+def _profile_rules() -> Tuple[Dict[str, int], set]:
+    """Timeout per profile, and the profiles whose config_json asks for `cancel_on_expiry`."""
+    timeouts, cancel = {}, set()
+    for r in frappe.get_all("AlphaX Payment Terminal Settings", fields=["name", "timeout_seconds", "config_json"]):
+        timeouts[r.name] = cint(r.timeout_seconds) or DEFAULT_TIMEOUT_SECONDS
+        try:
+            if cint((frappe.parse_json(r.config_json or "{}") or {}).get("cancel_on_expiry")):
+                cancel.add(r.name)
+        except Exception:
+            pass
+    return timeouts, cancel
+
+
+def _pending_chunk(cutoff, after, limit: int) -> List[Dict[str, Any]]:
+    Session = frappe.qb.DocType("AlphaX Terminal Session")
+    q = (
+        frappe.qb.from_(Session)
+        .select(*[Session[f] for f in _FIELDS])
+        .where(Session.status == "PENDING")
+        .where(Session.started_on < cutoff)
+        .orderby(Session.started_on)
+        .orderby(Session.name)
+        .limit(limit)
+    )
+    if after:
+        q = q.where((Session.started_on > after[0]) | ((Session.started_on == after[0]) & (Session.name > after[1])))
+    return q.run(as_dict=True)
+
+
+def _expire(names: List[str], now) -> List[str]:
+    """Mark still-PENDING sessions EXPIRED; returns the names actually expired."""
+    Session = frappe.qb.DocType("AlphaX Terminal Session")
+    (
+        frappe.qb.update(Session)
+        .set(Session.status, EXPIRED)
+        .set(Session.completed_on, now)
+        .set(Session.error_message, EXPIRY_MESSAGE)
+        .set(Session.modified, now)
+        .set(Session.modified_by, frappe.session.user)
+        .where(Session.name.isin(names))
+        .where(Session.status == "PENDING")  # a callback may have won the race
+    ).run()
+    return frappe.get_all(
+        "AlphaX Terminal Session",
+        filters={"name": ["in", names], "status": EXPIRED, "completed_on": now},
+        pluck="name",
+    )
+
+
+def expire_stale_sessions(chunk_size: int = CHUNK_SIZE) -> int:
+    """Scheduler job: expire overdue PENDING sessions. Returns the number expired."""
+    now = now_datetime()
+    grace = cint(frappe.conf.get("alphax_session_expiry_grace_seconds") or DEFAULT_GRACE_SECONDS)
+    timeouts, cancel_profiles = _profile_rules()
+
+    # Nothing younger than the shortest timeout can be due.
+    shortest = min(list(timeouts.values()) + [DEFAULT_TIMEOUT_SECONDS])
+    cutoff = now - timedelta(seconds=shortest + grace)
+
+    expired_total = 0
+    after = None
+    while True:
+        rows = _pending_chunk(cutoff, after, chunk_size)
+        if not rows:
+            break
+        after = (rows[-1].started_on, rows[-1].name)
+
+        due = {
+            r.name: r
+            for r in rows
+            if r.started_on
+            < now - timedelta(seconds=timeouts.get(r.terminal_settings, DEFAULT_TIMEOUT_SECONDS) + grace)
+        }
+        if due:
+            expired = _expire(list(due), now)
+            to_cancel = []
+            for name in expired:
+                ss = due[name]
+                notify_session_final(ss.uuid, EXPIRED, ss.name, ss.created_by_user)
+                metrics.observe_session_final(ss, EXPIRED, now)
+                if ss.terminal_settings in cancel_profiles:
+                    to_cancel.append(name)
+            if to_cancel:
+                frappe.enqueue(
+                    "alphax_card_terminal.reaper.cancel_expired_captures",
+                    queue="short",
+                    sessions=to_cancel,
+                    enqueue_after_commit=True,
+                )
+            expired_total += len(expired)
+            frappe.db.commit()
+
+        if len(rows) < chunk_size:
+            break
+
+    return expired_total
+
+
+def cancel_expired_captures(sessions: List[str]):
+    """Background job: ask each session's driver to abort the capture on the device (best effort)."""
+    from alphax_card_terminal.drivers.registry import get_driver
+    from alphax_card_terminal.profiles import get_profile
+
+    for row in frappe.get_all(
+        "AlphaX Terminal Session",
+        filters={"name": ["in", sessions], "status": EXPIRED},
+        fields=_FIELDS + ["request_payload", "request_blob"],
+    ):
+        row.request_payload = payload_store.load_text(row.request_payload, row.request_blob)
+        try:
+            get_driver(get_profile(row.terminal_settings)).cancel_capture(row)
+        except Exception:
+            frappe.log_error(title=f"AlphaX: cancel of expired session {row.name} failed")
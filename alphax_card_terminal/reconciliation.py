@@ -0,0 +1,458 @@
+"""Settlement reconciliation: match acquirer / terminal settlement reports against AlphaX Card Transaction.
+
+The report attached to an AlphaX Settlement Reconciliation is streamed (CSV,
+JSON Lines or a JSON array, optionally gzipped) and processed in chunks; no
+step holds more than one chunk in memory. Each chunk is matched with indexed
+lookups:
+
+1. exact: rrn (+ terminal_id when the report has it) and amount within tolerance
+2. fuzzy: terminal_id + auth_code, or terminal_id + trace_no (+ batch_no), and amount
+
+and written back with one bulk INSERT of AlphaX Settlement Item rows plus one
+UPDATE per outcome on the matched transactions (settlement_status /
+settlement_reconciliation), committed chunk by chunk. A transaction already
+claimed by an earlier line of the same run is not matched twice. With a date
+range on the run, approved transactions in that range the report never
+mentioned are listed as "Missing in Settlement" by a keyset scan.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import frappe
+from frappe.utils import add_days, add_to_date, cint, flt, get_datetime, getdate, now_datetime
+
+RUN_DOCTYPE = "AlphaX Settlement Reconciliation"
+ITEM_DOCTYPE = "AlphaX Settlement Item"
+TXN_DOCTYPE = "AlphaX Card Transaction"
+
+CHUNK_SIZE = 2000
+JOB_TIMEOUT = 4 * 3600
+
+MATCHED = "Matched"
+MISMATCHED = "Mismatched"
+UNMATCHED = "Unmatched"
+MISSING = "Missing in Settlement"
+INVALID = "Invalid"
+
+LINE_FIELDS = ("rrn", "terminal_id", "merchant_id", "auth_code", "trace_no", "batch_no", "amount")
+
+# Normalised report column names recognised per field (a run's column_map takes precedence).
+ALIASES = {
+    "rrn": ("rrn", "retrieval_reference_number", "retrieval_ref_no", "retrieval_reference", "reference_number", "ref_no"),
+    "terminal_id": ("terminal_id", "tid", "terminal", "terminal_no", "terminal_number"),
+    "merchant_id": ("merchant_id", "mid", "merchant_no", "merchant_number"),
+    "auth_code": ("auth_code", "approval_code", "authorization_code", "auth_id", "authorisation_code"),
+    "trace_no": ("trace_no", "stan", "trace", "trace_number", "system_trace_audit_number"),
+    "batch_no": ("batch_no", "batch", "batch_number"),
+    "amount": ("amount", "txn_amount", "transaction_amount", "settled_amount", "gross_amount"),
+}
+
+_TXN_FIELDS = [
+    "name",
+    "status",
+    "amount",
+    "rrn",
+    "terminal_id",
+    "auth_code",
+    "trace_no",
+    "batch_no",
+    "settlement_reconciliation",
+]
+_ITEM_COLUMNS = [
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "docstatus",
+    "reconciliation",
+    "result",
+    "match_method",
+    "mismatch_reason",
+    "card_transaction",
+    "line_no",
+    *LINE_FIELDS,
+    "erp_amount",
+]
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_WS = re.compile(r"[\s,]*")
+
+
+# -----------------------------------------------------------------------------
+# Streaming readers
+# -----------------------------------------------------------------------------
+def _norm_key(key: Any) -> str:
+    return _NON_WORD.sub("_", str(key or "").strip().lower()).strip("_")
+
+
+def _key_map(column_map: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """Normalised report column -> line field."""
+    keys = {alias: field for field, aliases in ALIASES.items() for alias in aliases}
+    for field, column in (column_map or {}).items():
+        if field in LINE_FIELDS and column:
+            keys[_norm_key(column)] = field
+    return keys
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def _detect_format(path: str, f) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "CSV"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "JSON Lines"
+    head = f.read(4096)
+    f.seek(0)
+    first = head.lstrip()[:1]
+    if first == "[":
+        return "JSON"
+    return "JSON Lines" if first == "{" else "CSV"
+
+
+def _iter_json_array(f, bufsize: int = 1 << 16) -> Iterator[Any]:
+    """Elements of a top-level JSON array, decoded incrementally from a text stream."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof, opened = "", 0, False, False
+    while True:
+        pos = _WS.match(buf, pos).end()
+        if pos < len(buf):
+            if not opened:
+                if buf[pos] != "[":
+                    frappe.throw("Settlement JSON file must contain an array of records.")
+                opened, pos = True, pos + 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                yield obj
+                pos = end
+                continue
+        elif eof:
+            return
+        more = f.read(bufsize)
+        eof = not more
+        buf, pos = buf[pos:] + more, 0
+
+
+def _iter_records(path: str, file_format: str) -> Iterator[Dict[str, Any]]:
+    with _open(path) as f:
+        if not file_format or file_format == "Auto":
+            file_format = _detect_format(path, f)
+        if file_format == "CSV":
+            yield from csv.DictReader(f)
+        elif file_format == "JSON":
+            yield from _iter_json_array(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _to_line(record: Any, keys: Dict[str, str], minor_units: bool) -> Optional[Dict[str, Any]]:
+    """Report record -> {rrn, terminal_id, ..., amount}, or None when it cannot be matched."""
+    if not isinstance(record, dict):
+        return None
+    line: Dict[str, Any] = dict.fromkeys(LINE_FIELDS)
+    for key, value in record.items():
+        field = keys.get(_norm_key(key))
+        if field and value not in (None, ""):
+            line[field] = str(value).strip()
+    if line["amount"] is None or not (line["rrn"] or line["auth_code"] or line["trace_no"]):
+        return None
+    try:
+        amount = float(str(line["amount"]).replace(",", ""))
+    except ValueError:
+        return None
+    line["amount"] = flt(amount / 100 if minor_units else amount, 2)
+    return line
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -----------------------------------------------------------------------------
+# Matching
+# -----------------------------------------------------------------------------
+def _candidates(field: str, values: set, extra: Optional[Tuple[str, set]] = None) -> List[Dict[str, Any]]:
+    if not values:
+        return []
+    filters = {field: ["in", list(values)]}
+    if extra and extra[1]:
+        filters[extra[0]] = ["in", list(extra[1])]
+    return frappe.get_all(TXN_DOCTYPE, filters=filters, fields=_TXN_FIELDS)
+
+
+def _pick(line, txns, run: str, claimed: set, tolerance: float):
+    """(transaction, result, reason) for the best unclaimed candidate, or None."""
+    free = [t for t in txns if t.name not in claimed and t.settlement_reconciliation != run]
+    if not free:
+        return None
+    same_amount = [t for t in free if abs(flt(t.amount) - line["amount"]) <= tolerance + 1e-9]
+    approved = [t for t in same_amount if t.status == "Approved"]
+    if approved:
+        return approved[0], MATCHED, None
+    if same_amount:
+        return same_amount[0], MISMATCHED, f"Transaction status is {same_amount[0].status}"
+    t = free[0]
+    return t, MISMATCHED, f"Amount {line['amount']} settled, {flt(t.amount)} captured"
+
+
+def _match_chunk(lines: List[Tuple[int, Dict[str, Any]]], run: str, tolerance: float):
+    """[(line_no, line, result, method, reason, txn)] for one chunk, using indexed lookups only."""
+    claimed: set = set()
+    results = []
+    pending = []
+
+    by_rrn: Dict[str, list] = {}
+    for t in _candidates("rrn", {l["rrn"] for _, l in lines if l["rrn"]}):
+        by_rrn.setdefault(t.rrn, []).append(t)
+
+    for line_no, line in lines:
+        txns = by_rrn.get(line["rrn"]) or []
+        if line["terminal_id"]:
+            txns = [t for t in txns if not t.terminal_id or t.terminal_id == line["terminal_id"]]
+        hit = _pick(line, txns, run, claimed, tolerance) if txns else None
+        if hit:
+            claimed.add(hit[0].name)
+            results.append((line_no, line, hit[1], "Exact", hit[2], hit[0]))
+        else:
+            pending.append((line_no, line))
+
+    # Fuzzy: same terminal and auth code or trace number; the amount must agree.
+    fuzzy = [(n, l) for n, l in pending if l["terminal_id"] and (l["auth_code"] or l["trace_no"])]
+    by_auth: Dict[tuple, list] = {}
+    by_trace: Dict[tuple, list] = {}
+    if fuzzy:
+        tids = {l["terminal_id"] for _, l in fuzzy}
+        for t in _candidates("auth_code", {l["auth_code"] for _, l in fuzzy if l["auth_code"]}, ("terminal_id", tids)):
+            by_auth.setdefault((t.terminal_id, t.auth_code), []).append(t)
+        for t in _candidates("trace_no", {l["trace_no"] for _, l in fuzzy if l["trace_no"]}, ("terminal_id", tids)):
+            by_trace.setdefault((t.terminal_id, t.trace_no), []).append(t)
+    fuzzy_lines = {n for n, _ in fuzzy}
+
+    for line_no, line in pending:
+        hit = None
+        if line_no in fuzzy_lines:
+            txns = by_auth.get((line["terminal_id"], line["auth_code"]), []) + [
+                t
+                for t in by_trace.get((line["terminal_id"], line["trace_no"]), [])
+                if not line["batch_no"] or not t.batch_no or t.batch_no == line["batch_no"]
+            ]
+            txns = [t for t in txns if abs(flt(t.amount) - line["amount"]) <= tolerance + 1e-9]
+            hit = _pick(line, txns, run, claimed, tolerance) if txns else None
+        if hit:
+            claimed.add(hit[0].name)
+            results.append((line_no, line, hit[1], "Fuzzy", hit[2], hit[0]))
+        else:
+            results.append((line_no, line, UNMATCHED, None, None, None))
+    return results
+
+
+# -----------------------------------------------------------------------------
+# Bulk writes
+# -----------------------------------------------------------------------------
+def _item_row(run: str, now, user, line_no, line, result, method=None, reason=None, txn=None) -> list:
+    line = line or dict.fromkeys(LINE_FIELDS)
+    return [
+        frappe.generate_hash(length=12),
+        now,
+        now,
+        user,
+        user,
+        0,
+        run,
+        result,
+        method,
+        reason,
+        txn.name if txn else None,
+        line_no,
+        *(line[f] for f in LINE_FIELDS),
+        flt(txn.amount) if txn else None,
+    ]
+
+
+def _write(run: str, rows: List[list], claimed: Dict[str, List[str]]):
+    if rows:
+        frappe.db.bulk_insert(ITEM_DOCTYPE, _ITEM_COLUMNS, rows)
+    Txn = frappe.qb.DocType(TXN_DOCTYPE)
+    for status, names in claimed.items():
+        if names:
+            (
+                frappe.qb.update(Txn)
+                .set(Txn.settlement_status, status)
+                .set(Txn.settlement_reconciliation, run)
+                .where(Txn.name.isin(names))
+            ).run()
+
+
+def _reset(run: str):
+    """Forget the results of a previous attempt of this run."""
+    frappe.db.delete(ITEM_DOCTYPE, {"reconciliation": run})
+    Txn = frappe.qb.DocType(TXN_DOCTYPE)
+    (
+        frappe.qb.update(Txn)
+        .set(Txn.settlement_status, None)
+        .set(Txn.settlement_reconciliation, None)
+        .where(Txn.settlement_reconciliation == run)
+    ).run()
+
+
+def _missing_in_settlement(run: str, from_date, to_date, counts: Dict[str, int], chunk_size: int):
+    """Approved transactions in the run's date range that no settlement line matched."""
+    Txn = frappe.qb.DocType(TXN_DOCTYPE)
+    start, end = getdate(from_date), add_days(getdate(to_date), 1)
+    after = None
+    while True:
+        q = (
+            frappe.qb.from_(Txn)
+            .select(Txn.name, Txn.creation, Txn.amount, *[Txn[f] for f in LINE_FIELDS if f != "amount"])
+            .where(Txn.status == "Approved")
+            .where(Txn.creation >= start)
+            .where(Txn.creation < end)
+            .where(Txn.settlement_reconciliation.isnull() | (Txn.settlement_reconciliation != run))
+            .orderby(Txn.creation)
+            .orderby(Txn.name)
+            .limit(chunk_size)
+        )
+        if after:
+            q = q.where((Txn.creation > after[0]) | ((Txn.creation == after[0]) & (Txn.name > after[1])))
+        txns = q.run(as_dict=True)
+        if not txns:
+            break
+        after = (txns[-1].creation, txns[-1].name)
+        now, user = now_datetime(), frappe.session.user
+        rows = [_item_row(run, now, user, None, dict(t, amount=None), MISSING, txn=t) for t in txns]
+        _write(run, rows, {})
+        counts["missing_in_settlement"] += len(rows)
+        _save_progress(run, counts)
+        frappe.db.commit()
+        if len(txns) < chunk_size:
+            break
+
+
+def _save_progress(run: str, counts: Dict[str, int], **values):
+    frappe.db.set_value(RUN_DOCTYPE, run, dict(counts, **values), update_modified=False)
+
+
+# -----------------------------------------------------------------------------
+# Entry points
+# -----------------------------------------------------------------------------
+def is_stale(started_on) -> bool:
+    """A Running run whose job cannot still be alive (RQ stops jobs after JOB_TIMEOUT)."""
+    return not started_on or get_datetime(started_on) < add_to_date(now_datetime(), seconds=-JOB_TIMEOUT)
+
+
+def _claim(run: str) -> bool:
+    """Mark the run Running unless a live job already has it; atomic across workers."""
+    Run = frappe.qb.DocType(RUN_DOCTYPE)
+    now = now_datetime()
+    (
+        frappe.qb.update(Run)
+        .set(Run.status, "Running")
+        .set(Run.started_on, now)
+        .set(Run.completed_on, None)
+        .set(Run.error_message, None)
+        .where(Run.name == run)
+        .where(
+            (Run.status != "Running") | Run.started_on.isnull() | (Run.started_on < add_to_date(now, seconds=-JOB_TIMEOUT))
+        )
+    ).run()
+    return cint(getattr(frappe.db._cursor, "rowcount", 0)) == 1
+
+
+def enqueue_reconciliation(run: str):
+    frappe.db.set_value(RUN_DOCTYPE, run, {"status": "Queued", "error_message": None})
+    frappe.enqueue(
+        "alphax_card_terminal.reconciliation.run_reconciliation",
+        queue="long",
+        timeout=JOB_TIMEOUT,
+        enqueue_after_commit=True,
+        run=run,
+    )
+
+
+def run_reconciliation(run: str, chunk_size: int = CHUNK_SIZE):
+    """Background job: reconcile the run's settlement file. Safe to re-run; earlier results are replaced."""
+    if not _claim(run):
+        return  # another job is on it
+    frappe.db.commit()
+    doc = frappe.get_doc(RUN_DOCTYPE, run)
+
+    counts = dict.fromkeys(
+        ("total_lines", "matched", "fuzzy_matched", "mismatched", "unmatched", "missing_in_settlement", "invalid_lines"),
+        0,
+    )
+    _save_progress(run, counts)
+    frappe.db.commit()
+
+    try:
+        _reset(run)
+        frappe.db.commit()
+
+        column_map = frappe.parse_json(doc.column_map) if doc.column_map else {}
+        keys = _key_map(column_map if isinstance(column_map, dict) else {})
+        tolerance = flt(doc.amount_tolerance)
+        minor_units = bool(cint(doc.amount_in_minor_units))
+        path = frappe.get_doc("File", {"file_url": doc.source_file}).get_full_path()
+
+        records = enumerate(_iter_records(path, doc.file_format), start=1)
+        for chunk in _chunks(records, chunk_size):
+            now, user = now_datetime(), frappe.session.user
+            rows, lines = [], []
+            for line_no, record in chunk:
+                line = _to_line(record, keys, minor_units)
+                if line is None:
+                    rows.append(_item_row(run, now, user, line_no, None, INVALID))
+                    counts["invalid_lines"] += 1
+                else:
+                    lines.append((line_no, line))
+
+            claimed: Dict[str, List[str]] = {MATCHED: [], MISMATCHED: []}
+            for line_no, line, result, method, reason, txn in _match_chunk(lines, run, tolerance):
+                rows.append(_item_row(run, now, user, line_no, line, result, method, reason, txn))
+                if txn:
+                    claimed[result].append(txn.name)
+                if result == MATCHED:
+                    counts["fuzzy_matched" if method == "Fuzzy" else "matched"] += 1
+                else:
+                    counts["mismatched" if result == MISMATCHED else "unmatched"] += 1
+
+            _write(run, rows, claimed)
+            counts["total_lines"] += len(chunk)
+            _save_progress(run, counts)
+            frappe.db.commit()
+
+        if doc.from_date and doc.to_date:
+            _missing_in_settlement(run, doc.from_date, doc.to_date, counts, chunk_size)
+
+        _save_progress(run, counts, status="Completed", completed_on=now_datetime())
+        frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(title=f"AlphaX: settlement reconciliation {run} failed")
+        _save_progress(run, counts, status="Failed", completed_on=now_datetime(), error_message=str(e)[:1000])
+        frappe.db.commit()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+import frappe
+
+EXPIRED = "EXPIRED"
+
+# EXPIRED (set by the reaper) is final for pollers, but a late terminal result still overrides it.
+FINAL_STATUSES = ("APPROVED", "DECLINED", "ERROR", "CANCELLED", EXPIRED)
+
+REALTIME_EVENT = "alphax_terminal_session"
+
+
+def _channel(uuid: str) -> str:
+    return frappe.cache().make_key(f"alphax_card_terminal:session:{uuid}")
+
+
+def notify_session_final(uuid: str, status: str, session: Optional[str] = None, user: Optional[str] = None):
+    """Wake long-pollers, free the session's pooled device and push a realtime event once the
+    current transaction commits."""
+
+    def _publish():
+        try:
+            frappe.cache().publish(_channel(uuid), status)
+        except Exception:
+            # Pollers fall back to their timeout; never fail the callback over a notification.
+            pass
+        if session:
+            from alphax_card_terminal.device_pool import release
+
+            release(session)
+
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(_publish)
+    else:
+        _publish()
+
+    frappe.publish_realtime(
+        REALTIME_EVENT,
+        {"uuid": uuid, "status": status, "session": session},
+        user=user,
+        after_commit=True,
+    )
+
+
+class SessionWaiter:
+    """Redis pub/sub subscription for one session's final-state notification.
+
+    Subscribe *before* re-checking the database so a notification published
+    between the check and the wait is not lost.
+    """
+
+    def __init__(self, uuid: str):
+        self.pubsub = frappe.cache().pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(_channel(uuid))
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            msg = self.pubsub.get_message(timeout=min(remaining, 1.0))
+            if msg and msg.get("type") == "message":
+                return True
+
+    def close(self):
+        try:
+            self.pubsub.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,99 @@
+import hashlib
+import hmac
+import time
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal import callbacks
+from alphax_card_terminal.callbacks import hmac_ok
+
+SECRET = "s3cret"
+BODY = b'{"uuid":"u-1","status":"Approved"}'
+
+
+def _sign(message: bytes, secret: str = SECRET) -> str:
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+class TestHmacOk(FrappeTestCase):
+    def test_body_signature_with_or_without_prefix(self):
+        sig = _sign(BODY)
+        self.assertTrue(hmac_ok(SECRET, BODY, sig))
+        self.assertTrue(hmac_ok(SECRET, BODY, f"sha256={sig}"))
+
+    def test_timestamped_signature_covers_the_timestamp(self):
+        sig = _sign(b"1700000000." + BODY)
+        self.assertTrue(hmac_ok(SECRET, BODY, sig, "1700000000"))
+        self.assertFalse(hmac_ok(SECRET, BODY, sig, "1700000001"))
+        self.assertFalse(hmac_ok(SECRET, BODY, sig))
+
+    def test_rejects_tampering_and_missing_inputs(self):
+        sig = _sign(BODY)
+        self.assertFalse(hmac_ok(SECRET, BODY + b" ", sig))
+        self.assertFalse(hmac_ok("other", BODY, sig))
+        self.assertFalse(hmac_ok("", BODY, sig))
+        self.assertFalse(hmac_ok(SECRET, BODY, None))
+        self.assertFalse(hmac_ok(SECRET, BODY, ""))
+
+
+class TestReplayAfterRollback(FrappeTestCase):
+    """A result whose write rolled back must be accepted when the agent retries it."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from alphax_card_terminal.benchmarks.capture_flow import setup
+
+        cls.secret = setup()
+
+    def setUp(self):
+        from alphax_card_terminal import api
+        from alphax_card_terminal.benchmarks.capture_flow import MODE_OF_PAYMENT, SETTINGS_NAME
+
+        self.session = api.create_terminal_session(MODE_OF_PAYMENT, 100, settings_name=SETTINGS_NAME)
+        frappe.db.commit()  # the failed write below rolls back; the session must survive it
+
+    def tearDown(self):
+        frappe.db.rollback()
+        frappe.db.delete("AlphaX Card Transaction", {"rrn": self.rrn})
+        frappe.db.delete("AlphaX Terminal Session", {"name": self.session["session"]})
+        frappe.db.commit()
+
+    def signed(self):
+        self.rrn = frappe.generate_hash(length=12).upper()
+        raw = frappe.as_json({"uuid": self.session["uuid"], "status": "Approved", "amount": 100, "rrn": self.rrn}).encode()
+        timestamp = str(int(time.time()))
+        sig = "sha256=" + _sign(f"{timestamp}.".encode() + raw, self.secret)
+        return raw, sig, timestamp
+
+    def test_retry_after_failed_write_is_accepted(self):
+        raw, sig, timestamp = self.signed()
+        headers = {"X-AlphaX-Signature": sig, "X-AlphaX-Timestamp": timestamp, "X-AlphaX-Nonce": "n-1"}
+
+        with patch.object(callbacks, "_bulk_insert_card_transactions", side_effect=frappe.QueryDeadlockError):
+            self.assertRaises(frappe.QueryDeadlockError, callbacks.ingest_callback, self.session["uuid"], raw, headers)
+        frappe.db.rollback()
+
+        res = callbacks.ingest_callback(self.session["uuid"], raw, headers)
+        self.assertEqual(res["status"], "APPROVED")
+        self.assertNotIn("skipped", res)
+        frappe.db.commit()
+        self.assertEqual(frappe.db.count("AlphaX Card Transaction", {"rrn": self.rrn}), 1)
+
+        # The nonce is spent once the write committed.
+        frappe.db.set_value("AlphaX Terminal Session", self.session["session"], "status", "PENDING")
+        self.assertRaises(frappe.PermissionError, callbacks.ingest_callback, self.session["uuid"], raw, headers)
+
+    def test_failed_batch_can_be_retried(self):
+        raw, sig, timestamp = self.signed()
+        item = {"uuid": self.session["uuid"], "body": raw.decode(), "signature": sig, "timestamp": timestamp}
+
+        with patch.object(callbacks, "_bulk_insert_card_transactions", side_effect=frappe.QueryDeadlockError):
+            self.assertRaises(frappe.QueryDeadlockError, callbacks.ingest_batch, [item])
+        frappe.db.rollback()
+
+        [outcome] = callbacks.ingest_batch([item])
+        self.assertTrue(outcome["ok"], outcome)
+        self.assertEqual(outcome["status"], "APPROVED")
@@ -0,0 +1,97 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal import api, device_pool
+
+SETTINGS = "AlphaX Test Serialized"
+
+
+def _owners() -> dict:
+    raw = frappe.cache().pipeline(transaction=False).hgetall(device_pool._key("owners")).execute()[0] or {}
+    return {(k.decode() if isinstance(k, bytes) else k): v for k, v in raw.items()}
+
+
+def _leases(device: str) -> list:
+    raw = frappe.cache().pipeline(transaction=False).zrange(device_pool._key("device", device), 0, -1).execute()[0]
+    return [m.decode() if isinstance(m, bytes) else m for m in raw or []]
+
+
+class TestDeviceLease(FrappeTestCase):
+    def setUp(self):
+        device = frappe.new_doc("AlphaX Terminal Device")
+        device.device_code = f"TEST-{frappe.generate_hash(length=6)}"
+        device.insert(ignore_permissions=True)
+        self.device = device.name
+
+        if frappe.db.exists("AlphaX Payment Terminal Settings", SETTINGS):
+            s = frappe.get_doc("AlphaX Payment Terminal Settings", SETTINGS)
+        else:
+            s = frappe.new_doc("AlphaX Payment Terminal Settings")
+            s.settings_name = SETTINGS
+        s.enabled = 1
+        s.driver = "simulator"
+        s.device = self.device
+        s.serialize_device_access = 1
+        s.run_capture_in_background = 1
+        s.pool_wait_seconds = 0
+        s.save(ignore_permissions=True)
+
+    def tearDown(self):
+        frappe.cache().delete(device_pool._key("device", self.device))
+
+    def test_background_capture_without_session_leases_under_session(self):
+        res = api.terminal_capture_start("Cash", 10, settings_name=SETTINGS, idempotency_key=None)
+        self.assertEqual(res["status"], "PENDING")
+        session = res["session"]
+
+        # The lease is held under the session created for the capture, so its final status frees it.
+        self.assertEqual(_leases(self.device), [session])
+        self.assertIn(session, _owners())
+
+        busy = api.terminal_capture_start("Cash", 10, settings_name=SETTINGS)
+        self.assertEqual(busy.get("device_status"), device_pool.BUSY)
+
+        device_pool.release(session)
+        self.assertEqual(_leases(self.device), [])
+        self.assertNotIn(session, _owners())
+
+    def test_busy_result_is_not_replayed_for_its_idempotency_key(self):
+        profile = frappe._dict(device=self.device, timeout_seconds=10, pool_wait_seconds=0)
+        device_pool.acquire_device(profile, "lease-a")
+        key = frappe.generate_hash(length=12)
+        busy = api.terminal_capture_start("Cash", 10, settings_name=SETTINGS, idempotency_key=key)
+        self.assertEqual(busy.get("device_status"), device_pool.BUSY)
+        frappe.db.after_commit.run()  # what committing this request would do
+
+        device_pool.release("lease-a")
+        res = api.terminal_capture_start("Cash", 10, settings_name=SETTINGS, idempotency_key=key)
+        self.assertEqual(res["status"], "PENDING")
+        self.assertTrue(res.get("session"))
+        device_pool.release(res["session"])
+
+    def test_rekey_moves_lease(self):
+        profile = frappe._dict(device=self.device, timeout_seconds=10, pool_wait_seconds=0)
+        routed, reason, _ = device_pool.acquire_device(profile, "lease-a")
+        self.assertIsNotNone(routed, reason)
+        device_pool.rekey("lease-a", "lease-b")
+        self.assertEqual(_leases(self.device), ["lease-b"])
+        device_pool.release("lease-b")
+        self.assertEqual(_leases(self.device), [])
+
+    def expire(self, lease: str):
+        key = device_pool._key("device", self.device)
+        frappe.cache().pipeline(transaction=False).zadd(key, {lease: 1}).execute()
+
+    def test_expired_leases_leave_the_owners_hash(self):
+        profile = frappe._dict(device=self.device, timeout_seconds=10, pool_wait_seconds=0)
+        device_pool.acquire_device(profile, "lease-a")
+        self.expire("lease-a")
+        routed, reason, _ = device_pool.acquire_device(profile, "lease-b")
+        self.assertIsNotNone(routed, reason)
+        self.assertNotIn("lease-a", _owners())
+        self.assertIn("lease-b", _owners())
+
+        self.expire("lease-b")
+        self.assertGreaterEqual(device_pool.prune_owners(), 1)
+        self.assertNotIn("lease-b", _owners())
+        self.assertEqual(_leases(self.device), [])
@@ -0,0 +1,46 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal import export
+
+SESSION = "AlphaX Terminal Session"
+
+
+class TestExportUserPermissions(FrappeTestCase):
+    def setUp(self):
+        self.companies = frappe.get_all("Company", pluck="name", limit=2)
+        if len(self.companies) < 2:
+            self.skipTest("needs two companies")
+        self.user = "alphax-export@example.com"
+        if not frappe.db.exists("User", self.user):
+            user = frappe.new_doc("User")
+            user.update({"email": self.user, "first_name": "AlphaX Export", "send_welcome_email": 0})
+            user.insert(ignore_permissions=True)
+            user.add_roles("System Manager")
+        frappe.get_doc(
+            {"doctype": "User Permission", "user": self.user, "allow": "Company", "for_value": self.companies[0]}
+        ).insert(ignore_permissions=True)
+        self.tag = frappe.generate_hash(length=8)
+        now = frappe.utils.now_datetime()
+        frappe.db.bulk_insert(
+            SESSION,
+            ["name", "creation", "modified", "owner", "modified_by", "uuid", "status", "company", "mode_of_payment"],
+            [
+                [f"{self.tag}-{i}", now, now, "Administrator", "Administrator", f"{self.tag}-{i}", "PENDING", c, "Cash"]
+                for i, c in enumerate(self.companies)
+            ],
+        )
+
+    def tearDown(self):
+        frappe.set_user("Administrator")
+        frappe.db.rollback()
+
+    def exported(self, **filters):
+        rows = [r for chunk in export.iter_rows(SESSION, **filters) for r in chunk]
+        return {r.company for r in rows if r.uuid.startswith(self.tag)}
+
+    def test_rows_outside_the_users_companies_are_not_exported(self):
+        self.assertEqual(self.exported(), set(self.companies))
+        frappe.set_user(self.user)
+        self.assertEqual(self.exported(), {self.companies[0]})
+        self.assertEqual(self.exported(company=self.companies[1]), set())
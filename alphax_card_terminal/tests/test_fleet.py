@@ -0,0 +1,25 @@
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal.benchmarks.fleet import parse_latency
+
+
+class TestParseLatency(FrappeTestCase):
+    def test_fixed(self):
+        self.assertEqual(parse_latency("fixed:250")(), 0.25)
+
+    def test_uniform_stays_in_range(self):
+        sample = parse_latency("uniform:100:200")
+        for _ in range(100):
+            self.assertTrue(0.1 <= sample() <= 0.2)
+
+    def test_normal_is_never_negative(self):
+        sample = parse_latency("normal:1:1000")
+        self.assertTrue(all(sample() >= 0 for _ in range(100)))
+
+    def test_lognormal_is_positive(self):
+        sample = parse_latency("lognormal:800:0.5")
+        self.assertTrue(all(sample() > 0 for _ in range(100)))
+
+    def test_unknown_distribution(self):
+        with self.assertRaises(ValueError):
+            parse_latency("poisson:3")
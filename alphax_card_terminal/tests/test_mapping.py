@@ -0,0 +1,59 @@
+import json
+
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal.mapping import compile_mapping
+
+
+class TestMapping(FrappeTestCase):
+    def test_default_mapping_and_synonyms(self):
+        m = compile_mapping(None)
+        self.assertEqual(m.status({"status": "success"}), "APPROVED")
+        self.assertEqual(m.status({"result": "00"}), "APPROVED")
+        self.assertEqual(m.status({"status": "Canceled"}), "CANCELLED")
+        self.assertEqual(m.status({"status": "Denied"}), "DECLINED")
+        out = m.apply({"status": "Approved", "tid": "T1", "brand": "VISA", "message": "OK"})
+        self.assertEqual(out["status"], "APPROVED")
+        self.assertEqual(out["terminal_id"], "T1")
+        self.assertEqual(out["tender_brand"], "VISA")
+        self.assertEqual(out["response_message"], "OK")
+
+    def test_unknown_or_missing_status_is_pending(self):
+        m = compile_mapping(None)
+        self.assertEqual(m.status({"status": "WHATEVER"}), "PENDING")
+        self.assertEqual(m.status({}), "PENDING")
+
+    def test_custom_paths_types_defaults_and_maps(self):
+        spec = {
+            "status": {"path": "data.result.code", "map": {"A": "Approved", "D": "Declined"}},
+            "rrn": ["data.rrn", "data.ref"],
+            "brand": {"path": "card.scheme", "type": "upper", "default": "UNKNOWN"},
+            "batch_no": {"path": "batches.0.no", "type": "int"},
+            "response_code": {"path": "data.code", "map": {"X1": "05"}},
+        }
+        m = compile_mapping(json.dumps(spec))
+        payload = {
+            "data": {"result": {"code": "a"}, "ref": "R-9", "code": "x1"},
+            "card": {"scheme": "mada"},
+            "batches": [{"no": "17"}],
+        }
+        out = m.apply(payload)
+        self.assertEqual(out["status"], "APPROVED")
+        self.assertEqual(out["rrn"], "R-9")
+        self.assertEqual(out["tender_brand"], "MADA")
+        self.assertEqual(out["batch_no"], 17)
+        self.assertEqual(out["response_code"], "05")
+        self.assertEqual(m.apply({"data": {"result": {"code": "D"}}})["tender_brand"], "UNKNOWN")
+        self.assertEqual(m.status({"data": {"result": {"code": "D"}}}), "DECLINED")
+        # the default "status|result" paths remain fallbacks for plain driver results
+        self.assertEqual(m.status({"status": "Approved"}), "APPROVED")
+        self.assertEqual(m.status({"data": {"result": {"code": "D"}}, "status": "Approved"}), "DECLINED")
+
+    def test_custom_status_path_still_reads_a_plain_driver_result(self):
+        m = compile_mapping(json.dumps({"status": {"path": "result.code", "map": {"00": "Approved"}}}))
+        self.assertEqual(m.status({"result": {"code": "00"}}), "APPROVED")
+        self.assertEqual(m.apply({"status": "Approved", "rrn": "R-1"})["status"], "APPROVED")
+        self.assertEqual(m.apply({"status": "DECLINED"})["status"], "DECLINED")
+
+    def test_driver_timeout_ends_the_session_as_error(self):
+        self.assertEqual(compile_mapping(None).status({"status": "TIMEOUT"}), "ERROR")
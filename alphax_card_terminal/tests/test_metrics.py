@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal import metrics
+
+
+class TestRender(FrappeTestCase):
+    def render(self, fields):
+        with patch.object(metrics, "_read", return_value=fields):
+            return metrics.render().splitlines()
+
+    def test_histogram_buckets_are_cumulative(self):
+        lbl = 'driver="simulator",outcome="APPROVED"'
+        lines = self.render(
+            {
+                f"alphax_capture_duration_seconds\t{lbl}\t0.05": "2",
+                f"alphax_capture_duration_seconds\t{lbl}\t1": "1",
+                f"alphax_capture_duration_seconds\t{lbl}\t+Inf": "1",
+                f"alphax_capture_duration_seconds\t{lbl}\tcount": "4",
+                f"alphax_capture_duration_seconds\t{lbl}\tsum": "400.2",
+            }
+        )
+        self.assertIn("# TYPE alphax_capture_duration_seconds histogram", lines)
+        self.assertIn(f'alphax_capture_duration_seconds_bucket{{{lbl},le="0.025"}} 0', lines)
+        self.assertIn(f'alphax_capture_duration_seconds_bucket{{{lbl},le="0.05"}} 2', lines)
+        self.assertIn(f'alphax_capture_duration_seconds_bucket{{{lbl},le="1"}} 3', lines)
+        self.assertIn(f'alphax_capture_duration_seconds_bucket{{{lbl},le="300"}} 3', lines)
+        self.assertIn(f'alphax_capture_duration_seconds_bucket{{{lbl},le="+Inf"}} 4', lines)
+        self.assertIn(f"alphax_capture_duration_seconds_sum{{{lbl}}} 400.2", lines)
+        self.assertIn(f"alphax_capture_duration_seconds_count{{{lbl}}} 4", lines)
+
+    def test_counters_and_unlabelled_series(self):
+        lines = self.render(
+            {
+                'alphax_callbacks_rejected_total\treason="bad_signature"\t': "3",
+                "alphax_session_update_failures_total\t\t": "1",
+                "malformed-field": "9",
+            }
+        )
+        self.assertIn("# TYPE alphax_callbacks_rejected_total counter", lines)
+        self.assertIn('alphax_callbacks_rejected_total{reason="bad_signature"} 3', lines)
+        self.assertIn("alphax_session_update_failures_total 1", lines)
+        self.assertFalse(any("malformed" in line for line in lines))
+
+    def test_labels_are_escaped(self):
+        self.assertEqual(metrics._labels({"b": 'say "hi"', "a": None}), 'a="",b="say \\"hi\\""')
+
+
+class TestOutcome(FrappeTestCase):
+    def test_timeouts_are_distinguished(self):
+        from alphax_card_terminal.drivers.base import capture_failure
+        from alphax_card_terminal.drivers.mqtt_pool import MqttPublishTimeout
+
+        self.assertEqual(capture_failure(TimeoutError("read timed out"))["status"], metrics.TIMEOUT)
+        self.assertEqual(capture_failure(MqttPublishTimeout("No PUBACK"))["status"], metrics.TIMEOUT)
+        failed = capture_failure(ValueError("bad"), request={"uuid": "u-1"})
+        self.assertEqual(failed, {"status": "ERROR", "message": "bad", "request": {"uuid": "u-1"}})
+
+    def test_outcome_of_result(self):
+        self.assertEqual(metrics.outcome_of_result({"status": "TIMEOUT"}, "ERROR"), metrics.TIMEOUT)
+        self.assertEqual(metrics.outcome_of_result({"status": "Error"}, "ERROR"), "ERROR")
+        self.assertEqual(metrics.outcome_of_result({"status": "00"}, "APPROVED"), "APPROVED")
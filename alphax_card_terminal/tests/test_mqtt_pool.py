@@ -0,0 +1,47 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal.drivers import mqtt_pool
+
+
+class FakePublisher:
+    def __init__(self, host, port, **kwargs):
+        self.host, self.port, self.kwargs = host, port, kwargs
+        self.pid = mqtt_pool.os.getpid()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def get_stats(self):
+        return {}
+
+
+class TestInlineBrokerKey(FrappeTestCase):
+    def setUp(self):
+        mqtt_pool._publishers.clear()
+        patcher = patch.object(mqtt_pool, "MqttPublisher", FakePublisher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(mqtt_pool._publishers.clear)
+
+    def broker(self, **cfg):
+        return mqtt_pool.resolve_broker(dict({"broker_host": "mq.example.com", "username": "pos"}, **cfg))
+
+    def test_password_and_keepalive_are_part_of_the_key(self):
+        base = self.broker(password="a")
+        self.assertNotEqual(base["key"], self.broker(password="b")["key"])
+        self.assertNotEqual(base["key"], self.broker(password="a", keepalive=30)["key"])
+        self.assertNotIn("a", base["key"])  # only a digest of the password
+
+    def test_changed_inline_broker_retires_the_old_publisher(self):
+        old = mqtt_pool.get_publisher(self.broker(password="a"))
+        self.assertIs(mqtt_pool.get_publisher(self.broker(password="a")), old)
+        new = mqtt_pool.get_publisher(self.broker(password="b"))
+        self.assertIsNot(new, old)
+        self.assertTrue(old.closed)
+        self.assertEqual(new.kwargs["password"], "b")
+        self.assertEqual(list(mqtt_pool.get_pool_stats()), ["inline:mq.example.com:1883:pos"])
+        self.assertEqual(len([k for k in mqtt_pool._publishers if k[0] == frappe.local.site]), 1)
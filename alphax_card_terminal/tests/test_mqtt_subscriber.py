@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal import callbacks
+from alphax_card_terminal.benchmarks.capture_flow import SETTINGS_NAME
+from alphax_card_terminal.mqtt_subscriber import HEARTBEAT, RESULT, process_batch, result_item
+
+
+class TestResultItem(FrappeTestCase):
+    def test_raw_callback_body(self):
+        body = json.dumps({"uuid": "u-1", "status": "Approved"})
+        self.assertEqual(result_item("alphax/results/u-9", body.encode()), [{"uuid": "u-1", "body": body}])
+
+    def test_raw_body_without_uuid_uses_topic_suffix(self):
+        body = json.dumps({"status": "Declined"})
+        self.assertEqual(result_item("alphax/results/u-9", body.encode()), [{"uuid": "u-9", "body": body}])
+
+    def test_envelope_is_passed_through(self):
+        envelope = {"uuid": "u-1", "body": "{}", "signature": "sha256=00", "timestamp": "1700000000"}
+        self.assertEqual(result_item("alphax/results", json.dumps(envelope).encode()), [envelope])
+
+    def test_lists_of_envelopes(self):
+        items = [{"uuid": "u-1", "body": "{}"}, {"uuid": "u-2", "body": "{}"}]
+        self.assertEqual(result_item("t", json.dumps(items).encode()), items)
+        self.assertEqual(result_item("t", json.dumps({"results": items + ["junk"]}).encode()), items)
+
+    def test_non_object_payload(self):
+        self.assertEqual(result_item("t", b"42"), [])
+
+
+def _sign(secret: str, raw: bytes, timestamp: str) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + raw, hashlib.sha256).hexdigest()
+
+
+class TestProcessBatch(FrappeTestCase):
+    """Real ingest_batch against committed sessions; the card transaction insert is made to fail."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from alphax_card_terminal.benchmarks.capture_flow import setup
+
+        cls.secret = setup()
+
+    def setUp(self):
+        from alphax_card_terminal import api
+        from alphax_card_terminal.benchmarks.capture_flow import MODE_OF_PAYMENT, SETTINGS_NAME
+
+        self.sessions = [api.create_terminal_session(MODE_OF_PAYMENT, 100, settings_name=SETTINGS_NAME) for _ in range(3)]
+        frappe.db.commit()  # process_batch commits and rolls back on its own
+        self.rrns = {}
+        patcher = patch.object(frappe, "log_error")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        frappe.db.rollback()
+        frappe.db.delete("AlphaX Card Transaction", {"rrn": ["in", list(self.rrns.values())]})
+        frappe.db.delete("AlphaX Terminal Session", {"name": ["in", [s["session"] for s in self.sessions]]})
+        frappe.db.commit()
+
+    def message(self, session):
+        uuid = session["uuid"]
+        self.rrns[uuid] = frappe.generate_hash(length=12).upper()
+        raw = json.dumps({"uuid": uuid, "status": "Approved", "amount": 100, "rrn": self.rrns[uuid]}).encode()
+        timestamp = str(int(time.time()))
+        envelope = {
+            "uuid": uuid,
+            "body": raw.decode(),
+            "signature": _sign(self.secret, raw, timestamp),
+            "timestamp": timestamp,
+            "nonce": frappe.generate_hash(length=16),
+        }
+        return (RESULT, f"alphax/result/{uuid}", json.dumps(envelope).encode(), MagicMock(name=uuid))
+
+    def failing_for(self, *uuids, times=None):
+        """_bulk_insert_card_transactions that raises for rows of `uuids` (the first `times` calls if given)."""
+        original = callbacks._bulk_insert_card_transactions
+        rrns = {self.rrns[u] for u in uuids}
+        calls = []
+
+        def insert(rows, now):
+            calls.append(rows)
+            if (times is None or len(calls) <= times) and any(r.get("rrn") in rrns for r in rows):
+                raise frappe.QueryDeadlockError("deadlock")
+            return original(rows, now)
+
+        return patch.object(callbacks, "_bulk_insert_card_transactions", side_effect=insert)
+
+    def status(self, session):
+        return frappe.db.get_value("AlphaX Terminal Session", session["session"], "status")
+
+    def test_failed_batch_is_retried_per_message_and_acked_after_commit(self):
+        batch = [self.message(s) for s in self.sessions]
+        with self.failing_for(self.sessions[0]["uuid"], times=1):
+            self.assertEqual(process_batch(batch)["results"], 3)
+        for session, (*_, ack) in zip(self.sessions, batch):
+            self.assertEqual(self.status(session), "APPROVED")
+            ack.assert_called_once_with()
+
+    def test_a_message_that_keeps_failing_is_left_for_redelivery(self):
+        batch = [self.message(s) for s in self.sessions]
+        poison = self.sessions[1]
+        with self.failing_for(poison["uuid"]):
+            self.assertEqual(process_batch(batch)["results"], 2)
+        batch[0][3].assert_called_once_with()
+        batch[1][3].assert_not_called()
+        batch[2][3].assert_called_once_with()
+        self.assertEqual(self.status(poison), "PENDING")
+
+        # Broker redelivery of the same signed message is accepted.
+        self.assertEqual(process_batch([batch[1]])["results"], 1)
+        batch[1][3].assert_called_once_with()
+        self.assertEqual(self.status(poison), "APPROVED")
+
+    def test_replayed_message_for_an_unsettled_session_is_not_acked(self):
+        kind, topic, payload, ack = self.message(self.sessions[0])
+        envelope = json.loads(payload)
+        key = frappe.cache().make_key(
+            f"alphax_card_terminal:callback_nonce:{SETTINGS_NAME}:{envelope['uuid']}:{envelope['nonce']}"
+        )
+        frappe.cache().set(key, 1, ex=60)  # held by another delivery still in flight
+        self.addCleanup(frappe.cache().delete, key)
+        self.assertEqual(process_batch([(kind, topic, payload, ack)])["results"], 0)
+        ack.assert_not_called()
+
+    def test_invalid_messages_and_heartbeats_are_acked(self):
+        invalid = (RESULT, "alphax/result/x", b"[]", MagicMock())
+        heartbeat = (HEARTBEAT, "alphax/heartbeat/dev-1", b"{}", MagicMock())
+        with patch("alphax_card_terminal.presence.record_heartbeats"):
+            process_batch([invalid, heartbeat])
+        invalid[3].assert_called_once_with()
+        heartbeat[3].assert_called_once_with()
@@ -0,0 +1,35 @@
+import os
+from datetime import timedelta
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from alphax_card_terminal import payload_store
+
+
+class TestArchive(FrappeTestCase):
+    def test_archive_rolls_to_a_new_part_by_size(self):
+        payloads = [{"n": i, "pad": frappe.generate_hash(length=64)} for i in range(4)]
+        names = payload_store.put_many(payloads)
+        Blob = frappe.qb.DocType(payload_store.BLOB_DOCTYPE)
+        frappe.qb.update(Blob).set(Blob.creation, now_datetime() - timedelta(days=400)).where(
+            Blob.name.isin(names)
+        ).run()
+
+        with patch.object(payload_store, "ARCHIVE_MAX_BYTES", 120):
+            payload_store.archive_old_payloads()
+
+        rows = frappe.get_all(
+            payload_store.BLOB_DOCTYPE,
+            filters={"name": ["in", names]},
+            fields=["archived", "archive_file", "archive_offset", "archive_length"],
+        )
+        self.assertTrue(all(r.archived for r in rows))
+        self.assertGreater(len({r.archive_file for r in rows}), 1)
+        for r in rows:
+            self.assertLessEqual(r.archive_offset + r.archive_length, 120)
+            self.assertLessEqual(os.path.getsize(payload_store._archive_path(r.archive_file)), 120)
+        for name, payload in zip(names, payloads):
+            self.assertEqual(frappe.parse_json(payload_store.get_text(name)), payload)
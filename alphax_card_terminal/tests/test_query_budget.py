@@ -0,0 +1,343 @@
+"""Query, row and (opt-in) wall-time budgets for every API entry point and Sales Invoice hook.
+
+Every function whitelisted in api.py must have an entry in BUDGETS and a scenario
+below; a new endpoint without one fails test_every_entry_point_has_a_budget.
+Each scenario is called once to warm the worker and Redis caches, then REPEAT
+times measured:
+
+- queries: statements sent through frappe.db.sql (max over the measured calls)
+- rows:    rows read by the storage engine (MariaDB Handler_read_* counters);
+           rows returned on PostgreSQL
+- ms:      median wall time, only checked when ALPHAX_BUDGET_TIME_FACTOR is set
+           (e.g. 1 on a quiet staging box, 3 on shared CI runners)
+
+    bench --site <test-site> run-tests --module alphax_card_terminal.tests.test_query_budget
+
+A change that legitimately costs more raises its budget here in the same commit.
+"""
+import hashlib
+import hmac
+import inspect
+import os
+import statistics
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import cint, flt, nowdate
+
+from alphax_card_terminal import api
+from alphax_card_terminal.benchmarks.capture_flow import MODE_OF_PAYMENT, SETTINGS_NAME, setup
+
+# entry point -> ceiling per call on warm caches
+BUDGETS: Dict[str, Dict[str, float]] = {
+    "get_available_drivers": {"queries": 0, "rows": 0, "ms": 5},
+    "get_mqtt_publisher_stats": {"queries": 0, "rows": 0, "ms": 5},
+    "get_http_pool_stats": {"queries": 0, "rows": 0, "ms": 5},
+    "terminal_test_connection": {"queries": 0, "rows": 0, "ms": 5},
+    "create_terminal_session": {"queries": 15, "rows": 60, "ms": 60},
+    "terminal_capture_start": {"queries": 20, "rows": 80, "ms": 80},
+    "terminal_callback": {"queries": 8, "rows": 20, "ms": 40},
+    # 10 results: set-based, so the cost must not grow with the batch
+    "terminal_callback_batch": {"queries": 10, "rows": 60, "ms": 80},
+    "terminal_heartbeat": {"queries": 0, "rows": 0, "ms": 5},
+    "get_terminal_payload": {"queries": 2, "rows": 4, "ms": 10},
+    "export_terminal_data": {"queries": 2, "rows": 400, "ms": 50},
+    "rerun_settlement_reconciliation": {"queries": 6, "rows": 20, "ms": 30},
+    "get_terminal_metrics": {"queries": 0, "rows": 0, "ms": 20},
+    "get_terminal_session_status": {"queries": 2, "rows": 4, "ms": 10},
+    "wait_for_terminal_session": {"queries": 2, "rows": 4, "ms": 10},
+    "log_terminal_response": {"queries": 25, "rows": 100, "ms": 80},
+    "sales_invoice_before_submit": {"queries": 1, "rows": 10, "ms": 10},
+    "sales_invoice_on_submit": {"queries": 0, "rows": 0, "ms": 5},
+}
+
+REPEAT = 3
+BATCH_SIZE = 10
+TIME_FACTOR = flt(os.environ.get("ALPHAX_BUDGET_TIME_FACTOR"))
+
+
+def whitelisted_entry_points():
+    """Names of the functions api.py exposes through frappe.whitelist."""
+    allowed = set(frappe.whitelisted)
+    return sorted(
+        name
+        for name, fn in inspect.getmembers(api, inspect.isfunction)
+        if fn.__module__ == api.__name__ and (fn in allowed or getattr(fn, "__wrapped__", None) in allowed)
+    )
+
+
+class Meter:
+    """Counts statements, rows returned and (MariaDB) rows read on frappe.db."""
+
+    def __init__(self, db):
+        self.db = db
+        self.queries = 0
+        self.rows_returned = 0
+        self._sql = db.sql
+        self.engine_rows = db.db_type == "mariadb"
+        self._overhead = 0
+
+        def counted(*args, **kwargs):
+            self.queries += 1
+            result = self._sql(*args, **kwargs)
+            if isinstance(result, (list, tuple)):
+                self.rows_returned += len(result)
+            return result
+
+        db.sql = counted
+        if self.engine_rows:
+            # SHOW STATUS reads a few rows itself; measure and subtract that.
+            first = self._handler_reads()
+            self._overhead = self._handler_reads() - first
+
+    def close(self):
+        self.db.sql = self._sql
+
+    def _handler_reads(self) -> int:
+        return sum(cint(value) for _, value in self._sql("SHOW SESSION STATUS LIKE 'Handler_read%'"))
+
+    def measure(self, fn: Callable[[], Any]) -> Dict[str, float]:
+        reads = self._handler_reads() if self.engine_rows else 0
+        queries, returned = self.queries, self.rows_returned
+        started = time.perf_counter()
+        fn()
+        ms = (time.perf_counter() - started) * 1000
+        if self.engine_rows:
+            rows = max(self._handler_reads() - reads - self._overhead, 0)
+        else:
+            rows = self.rows_returned - returned
+        return {"queries": self.queries - queries, "rows": rows, "ms": ms}
+
+
+@contextmanager
+def _request(body: Any, headers: Optional[Dict[str, str]] = None):
+    """frappe.request for endpoints that read the raw body / headers."""
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+
+    raw = body if isinstance(body, bytes) else frappe.as_json(body).encode("utf-8")
+    previous = getattr(frappe.local, "request", None)
+    builder = EnvironBuilder(method="POST", data=raw, headers=headers or {}, content_type="application/json")
+    frappe.local.request = Request(builder.get_environ())
+    try:
+        yield
+    finally:
+        frappe.local.request = previous
+
+
+class Fixture:
+    """Sessions, results and transactions for the scenarios; rolled back after the test."""
+
+    def __init__(self, secret: str):
+        self.secret = secret
+        self.run_id = frappe.generate_hash(length=6)
+
+    def session(self, final: bool = False) -> Dict[str, Any]:
+        from alphax_card_terminal.callbacks import ingest_callback
+
+        s = api.create_terminal_session(MODE_OF_PAYMENT, 100, settings_name=SETTINGS_NAME)
+        if final:
+            raw, headers = self.signed(s["uuid"])
+            ingest_callback(s["uuid"], raw, headers)
+        return s
+
+    def result(self, uuid: Optional[str]) -> Dict[str, Any]:
+        return {
+            "uuid": uuid,
+            "status": "Approved",
+            "amount": 100,
+            "currency": "SAR",
+            "rrn": frappe.generate_hash(length=12).upper(),
+            "auth_code": frappe.generate_hash(length=6).upper(),
+            "response_code": "00",
+            "terminal_id": "BENCH0001",
+        }
+
+    def sign(self, raw: bytes, timestamp: str) -> str:
+        sig = hmac.new(self.secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + raw, hashlib.sha256)
+        return "sha256=" + sig.hexdigest()
+
+    def signed(self, uuid: str):
+        raw = frappe.as_json(self.result(uuid)).encode("utf-8")
+        timestamp = str(int(time.time()))
+        return raw, {
+            "X-AlphaX-Signature": self.sign(raw, timestamp),
+            "X-AlphaX-Timestamp": timestamp,
+            "X-AlphaX-Nonce": frappe.generate_hash(length=16),
+        }
+
+    def invoice_doc(self, approved: bool):
+        """In-memory Sales Invoice; its approved transaction is inserted without a real invoice row."""
+        from alphax_card_terminal.callbacks import _bulk_insert_card_transactions
+
+        name = f"ACT-BUDGET-{self.run_id}-{frappe.generate_hash(length=6)}"
+        if approved:
+            row = dict(
+                status="Approved",
+                amount=100,
+                mode_of_payment=MODE_OF_PAYMENT,
+                reference_doctype="Sales Invoice",
+                reference_name=name,
+            )
+            _bulk_insert_card_transactions([row], frappe.utils.now_datetime())
+        return frappe._dict(
+            doctype="Sales Invoice",
+            name=name,
+            payments=[frappe._dict(mode_of_payment=MODE_OF_PAYMENT, amount=100)],
+        )
+
+
+def _scenarios(fx: Fixture) -> Dict[str, Callable[[], Callable[[], Any]]]:
+    """Entry point -> preparation (unmeasured) returning the call to measure."""
+    from alphax_card_terminal import export, payload_store
+    from alphax_card_terminal.events.sales_invoice_before_submit import sales_invoice_before_submit
+    from alphax_card_terminal.events.sales_invoice_on_submit import sales_invoice_on_submit
+    from alphax_card_terminal.reconciliation import RUN_DOCTYPE
+
+    def create_terminal_session():
+        key = frappe.generate_hash(length=16)
+        return lambda: api.create_terminal_session(MODE_OF_PAYMENT, 100, settings_name=SETTINGS_NAME, idempotency_key=key)
+
+    def terminal_capture_start():
+        s = fx.session()
+        key = frappe.generate_hash(length=16)
+        return lambda: api.terminal_capture_start(
+            MODE_OF_PAYMENT, 100, settings_name=SETTINGS_NAME, session=s["session"], idempotency_key=key
+        )
+
+    def terminal_callback():
+        uuid = fx.session()["uuid"]
+        raw, headers = fx.signed(uuid)
+
+        def call():
+            with _request(raw, headers):
+                return api.terminal_callback(uuid)
+
+        return call
+
+    def terminal_callback_batch():
+        timestamp = str(int(time.time()))
+        items = []
+        for _ in range(BATCH_SIZE):
+            body = frappe.as_json(fx.result(fx.session()["uuid"]))
+            items.append({"body": body, "signature": fx.sign(body.encode("utf-8"), timestamp), "timestamp": timestamp})
+
+        def call():
+            with _request({"results": items}):
+                return api.terminal_callback_batch()
+
+        return call
+
+    def terminal_heartbeat():
+        body = {"heartbeats": [{"device": f"BENCH-DEV-{i}"} for i in range(BATCH_SIZE)]}
+
+        def call():
+            with _request(body):
+                return api.terminal_heartbeat()
+
+        return call
+
+    def get_terminal_payload():
+        blob = payload_store.put({"budget": fx.run_id, "nonce": frappe.generate_hash(length=8)})
+        return lambda: api.get_terminal_payload(blob)
+
+    def export_terminal_data():
+        # The endpoint streams on its own connection; the body is produced here on this one.
+        filters = {"terminal": SETTINGS_NAME, "from_date": nowdate(), "to_date": nowdate()}
+
+        def call():
+            export.validate_request("AlphaX Terminal Session", "ndjson", False)
+            columns = export._columns("AlphaX Terminal Session", False)
+            for _ in export.encode(export.iter_rows("AlphaX Terminal Session", **filters), "ndjson", columns):
+                pass
+
+        return call
+
+    def rerun_settlement_reconciliation():
+        doc = frappe.new_doc(RUN_DOCTYPE)
+        doc.flags.ignore_mandatory = True
+        doc.insert(ignore_permissions=True)  # its queued job is dropped with the rollback
+        return lambda: api.rerun_settlement_reconciliation(doc.name)
+
+    def get_terminal_session_status():
+        uuid = fx.session(final=True)["uuid"]
+        return lambda: api.get_terminal_session_status(uuid)
+
+    def wait_for_terminal_session():
+        uuid = fx.session(final=True)["uuid"]
+        return lambda: api.wait_for_terminal_session(uuid)
+
+    def log_terminal_response():
+        s = fx.session()
+        payload = dict(fx.result(s["uuid"]), mode_of_payment=MODE_OF_PAYMENT)
+        return lambda: api.log_terminal_response(payload, s["uuid"])
+
+    def before_submit():
+        doc = fx.invoice_doc(approved=True)
+        return lambda: sales_invoice_before_submit(doc)
+
+    def on_submit():
+        doc = fx.invoice_doc(approved=False)
+        return lambda: sales_invoice_on_submit(doc)
+
+    return {
+        "get_available_drivers": lambda: api.get_available_drivers,
+        "get_mqtt_publisher_stats": lambda: api.get_mqtt_publisher_stats,
+        "get_http_pool_stats": lambda: api.get_http_pool_stats,
+        "terminal_test_connection": lambda: lambda: api.terminal_test_connection(SETTINGS_NAME),
+        "create_terminal_session": create_terminal_session,
+        "terminal_capture_start": terminal_capture_start,
+        "terminal_callback": terminal_callback,
+        "terminal_callback_batch": terminal_callback_batch,
+        "terminal_heartbeat": terminal_heartbeat,
+        "get_terminal_payload": get_terminal_payload,
+        "export_terminal_data": export_terminal_data,
+        "rerun_settlement_reconciliation": rerun_settlement_reconciliation,
+        "get_terminal_metrics": lambda: api.get_terminal_metrics,
+        "get_terminal_session_status": get_terminal_session_status,
+        "wait_for_terminal_session": wait_for_terminal_session,
+        "log_terminal_response": log_terminal_response,
+        "sales_invoice_before_submit": before_submit,
+        "sales_invoice_on_submit": on_submit,
+    }
+
+
+class TestQueryBudget(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.secret = setup()  # the capture_flow benchmark profile and Mode of Payment
+
+    def setUp(self):
+        frappe.set_user("Administrator")
+        self.fx = Fixture(self.secret)
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def test_every_entry_point_has_a_budget(self):
+        entry_points = whitelisted_entry_points()
+        self.assertTrue(entry_points)
+        self.assertEqual([n for n in entry_points if n not in BUDGETS], [], "whitelisted functions without a budget")
+        self.assertEqual(sorted(BUDGETS), sorted(_scenarios(self.fx)), "budgets and scenarios differ")
+
+    def test_entry_points_stay_within_budget(self):
+        meter = Meter(frappe.db)
+        try:
+            for name, prepare in _scenarios(self.fx).items():
+                with self.subTest(entry_point=name):
+                    prepare()()  # warm-up
+                    samples = [meter.measure(prepare()) for _ in range(REPEAT)]
+                    budget = BUDGETS[name]
+                    queries = max(s["queries"] for s in samples)
+                    rows = max(s["rows"] for s in samples)
+                    self.assertLessEqual(queries, budget["queries"], f"{name}: queries per call")
+                    self.assertLessEqual(rows, budget["rows"], f"{name}: rows read per call")
+                    if TIME_FACTOR:
+                        ms = statistics.median(s["ms"] for s in samples)
+                        self.assertLessEqual(ms, budget["ms"] * TIME_FACTOR, f"{name}: median ms per call")
+        finally:
+            meter.close()
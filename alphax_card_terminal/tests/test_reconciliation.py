@@ -0,0 +1,41 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from alphax_card_terminal import reconciliation
+from alphax_card_terminal.reconciliation import JOB_TIMEOUT, RUN_DOCTYPE
+
+
+class TestRunClaim(FrappeTestCase):
+    def setUp(self):
+        doc = frappe.new_doc(RUN_DOCTYPE)
+        doc.flags.ignore_mandatory = True
+        doc.insert(ignore_permissions=True)
+        self.run = doc.name
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def set_running(self, seconds_ago: int):
+        started = add_to_date(now_datetime(), seconds=-seconds_ago)
+        frappe.db.set_value(RUN_DOCTYPE, self.run, {"status": "Running", "started_on": started})
+
+    def test_claim_is_exclusive(self):
+        self.assertTrue(reconciliation._claim(self.run))
+        self.assertEqual(frappe.db.get_value(RUN_DOCTYPE, self.run, "status"), "Running")
+        self.assertFalse(reconciliation._claim(self.run))
+
+    def test_stale_running_run_can_be_claimed_and_rerun(self):
+        from alphax_card_terminal.api import rerun_settlement_reconciliation
+
+        self.set_running(60)
+        self.assertFalse(reconciliation.is_stale(frappe.db.get_value(RUN_DOCTYPE, self.run, "started_on")))
+        self.assertRaises(frappe.ValidationError, rerun_settlement_reconciliation, self.run)
+
+        self.set_running(JOB_TIMEOUT + 60)
+        self.assertEqual(rerun_settlement_reconciliation(self.run), {"status": "Queued"})
+        self.assertEqual(frappe.db.get_value(RUN_DOCTYPE, self.run, "status"), "Queued")
+
+        # The re-queued job claims the run once; a second worker is refused.
+        self.assertTrue(reconciliation._claim(self.run))
+        self.assertFalse(reconciliation._claim(self.run))
@@ -0,0 +1,71 @@
+import concurrent.futures
+import time
+import unittest
+
+from frappe.tests.utils import FrappeTestCase
+
+from alphax_card_terminal.drivers.impl.network_tcp import NetworkTcpDriver
+from alphax_card_terminal.drivers.tcp_engine import JsonProtocol, StubTerminalServer, TcpEngine, TcpTerminalError
+
+
+class TestTcpEngine(FrappeTestCase):
+    def setUp(self):
+        self.engine = TcpEngine()
+        self.stub = self.engine._run(StubTerminalServer().start(), 5)
+        self.addCleanup(self.engine._run, self.stub.stop(), 5)
+
+    def call(self, amount, protocol=None):
+        request = {"type": "SALE", "uuid": "u-1", "amount": amount, "terminal_id": "T1"}
+        return self.engine.call("127.0.0.1", self.stub.port, protocol or JsonProtocol(), request, timeout=5)
+
+    def test_sale_over_one_persistent_connection(self):
+        self.assertEqual(self.call(10)["status"], "APPROVED")
+        self.assertEqual(self.call(10.99)["status"], "DECLINED")
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_probe_sends_a_heartbeat(self):
+        info = self.engine.probe("127.0.0.1", self.stub.port, JsonProtocol(), timeout=5)
+        self.assertTrue(info["heartbeat"])
+
+    def test_changed_protocol_closes_the_old_connection(self):
+        self.call(10)
+        old = self.engine.connections[("127.0.0.1", self.stub.port)]
+        self.assertTrue(old.connected)
+
+        self.call(10, JsonProtocol(header_size=4, vendor="x"))
+        new = self.engine.connections[("127.0.0.1", self.stub.port)]
+        self.assertIsNot(new, old)
+        deadline = time.monotonic() + 5
+        while old.writer is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(old.connected)
+        self.assertIsNone(old._heartbeat_task)
+        self.assertEqual(self.stub.connections, 2)
+
+    def test_request_past_its_deadline_is_not_sent(self):
+        conn = self.engine._connection("127.0.0.1", self.stub.port, JsonProtocol())
+        request = {"type": "SALE", "uuid": "u-1", "amount": 10, "terminal_id": "T1"}
+        with self.assertRaises(TcpTerminalError):
+            self.engine._run(conn.request(request, 5, deadline=time.monotonic() - 1), 5)
+        self.assertEqual(self.stub.sales, 0)
+
+    def test_timed_out_call_is_cancelled_and_frees_the_terminal(self):
+        self.stub.delay = 1
+        conn = self.engine._connection("127.0.0.1", self.stub.port, JsonProtocol())
+        request = {"type": "SALE", "uuid": "u-1", "amount": 10, "terminal_id": "T1"}
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.engine._run(conn.request(request, 5), 0.2)
+        self.stub.delay = 0
+        # The abandoned dialog's socket was dropped, so its late answer cannot be read as this one's.
+        self.assertEqual(self.call(10.99)["status"], "DECLINED")
+        self.assertEqual(self.stub.connections, 2)
+
+
+class TestNetworkTcpProtocol(unittest.TestCase):
+    def test_header_size_in_both_places(self):
+        driver = NetworkTcpDriver(None)
+        protocol = driver._protocol({"tcp_header_size": 2, "tcp_protocol_options": {"header_size": 4, "vendor": "x"}})
+        self.assertEqual(protocol.framing.header_size, 2)
+        self.assertEqual(protocol.options["vendor"], "x")
+        self.assertEqual(driver._protocol({"tcp_protocol_options": {"header_size": 2}}).framing.header_size, 2)
+        self.assertEqual(driver._protocol({}).framing.header_size, 4)